@@ -0,0 +1,74 @@
+"""
+Push channel for agents: /agent/ws (and metrics for ?wait= long polling).
+
+An agent connects once with its API key and is pushed the question the
+moment its combat turns RUNNING, instead of finding out on its next 2 s
+poll of /agent/me - which matters because ties go to the earlier
+submission. It submits over the same socket and is pushed the result.
+
+Wake-ups come from the combat's status feed (combat_feeds), so a waiting
+agent costs no queries until something changes. Database work uses short
+sessions from `session_factory`, never one held for the socket's lifetime.
+
+Protocol (JSON text frames):
+    server -> agent  {"type": "state", "combatId", "state"}      on connect and each change before the start
+                     {"type": "question", ...AgentMeResponse}     once, when the combat is RUNNING
+                     {"type": "submitted", "ok", "status"}        submission accepted
+                     {"type": "error", "status", "detail"}        submission rejected (socket stays open)
+                     {"type": "result", ...AgentResultResponse}   when the combat ends; then the socket closes
+    agent -> server  {"type": "submit", "answer": "..."}
+"""
+
+from datetime import datetime
+from typing import Optional
+
+
+class AgentChannel:
+    """Session source and delivery metrics for agent WebSockets"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        # Metrics
+        self.open_sockets = 0
+        self.connections = 0
+        self.rejected = 0
+        self.questions_pushed = 0
+        self.results_pushed = 0
+        self.submissions = 0
+        # Long-polling /agent/me and /agent/result (?wait=)
+        self.long_polls = 0
+        self.long_poll_timeouts = 0
+        self._question_lag_ms_total = 0.0
+        self.question_lag_ms_max = 0.0
+
+    def session(self):
+        return self.session_factory()
+
+    def connected(self):
+        self.connections += 1
+        self.open_sockets += 1
+
+    def disconnected(self):
+        self.open_sockets -= 1
+
+    def question_pushed(self, started_at: Optional[datetime]):
+        """Count a question push; lag is measured from the combat's start"""
+        self.questions_pushed += 1
+        if started_at is not None:
+            lag_ms = max((datetime.utcnow() - started_at).total_seconds() * 1000, 0.0)
+            self._question_lag_ms_total += lag_ms
+            self.question_lag_ms_max = max(self.question_lag_ms_max, lag_ms)
+
+    def to_dict(self) -> dict:
+        return {
+            "openSockets": self.open_sockets,
+            "connections": self.connections,
+            "rejected": self.rejected,
+            "questionsPushed": self.questions_pushed,
+            "resultsPushed": self.results_pushed,
+            "submissions": self.submissions,
+            "longPolls": self.long_polls,
+            "longPollTimeouts": self.long_poll_timeouts,
+            "questionLagMsAvg": round(self._question_lag_ms_total / self.questions_pushed, 2) if self.questions_pushed else 0.0,
+            "questionLagMsMax": round(self.question_lag_ms_max, 2),
+        }
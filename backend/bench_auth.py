@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Benchmark: event-loop lag while verifying Firebase ID tokens.
+
+Serves a small app with uvicorn, fires N concurrent authenticated requests
+at it from a separate thread (distinct tokens, so every one needs an RS256
+check) and samples how late a 1 ms ticker on the server's event loop wakes
+up. Compares verification inline in the async dependency (the old
+behaviour) with the verification pool, plus an unauthenticated baseline.
+
+Runs fully offline: tokens are signed with a locally generated key and the
+key fetch is simulated with a configurable latency.
+
+Usage:
+    python bench_auth.py --requests 200 --key-fetch-ms 100
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import time
+from datetime import datetime
+
+import httpx
+import jwt
+import uvicorn
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import Depends, FastAPI, Header
+
+import firebase_auth
+from metrics import percentile
+from token_verifier import FirebaseTokenVerifier, JWKSCache
+
+PROJECT_ID = "bench-project"
+
+
+def make_verifier(private_key, key_fetch_ms):
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": "bench", "alg": "RS256"})
+
+    def fetch():
+        time.sleep(key_fetch_ms / 1000)
+        return {"keys": [jwk]}, 3600
+
+    return FirebaseTokenVerifier(PROJECT_ID, jwks=JWKSCache(fetch=fetch))
+
+
+def make_tokens(private_key, count):
+    now = int(datetime.utcnow().timestamp())
+    return [
+        jwt.encode(
+            {
+                "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+                "aud": PROJECT_ID,
+                "sub": f"bench-user-{i}",
+                "iat": now,
+                "exp": now + 3600,
+            },
+            private_key,
+            algorithm="RS256",
+            headers={"kid": "bench"},
+        )
+        for i in range(count)
+    ]
+
+
+async def inline_user(authorization: str = Header(None)) -> dict:
+    """Old dependency: synchronous verification on the event loop"""
+    return firebase_auth.verify_firebase_token(authorization.replace("Bearer ", ""))
+
+
+app = FastAPI()
+
+
+@app.get("/none")
+async def unauthenticated_route():
+    return {"uid": None}
+
+
+@app.get("/inline")
+async def inline_route(user: dict = Depends(inline_user)):
+    return {"uid": user["uid"]}
+
+
+@app.get("/pooled")
+async def pooled_route(user: dict = Depends(firebase_auth.get_current_firebase_user)):
+    return {"uid": user["uid"]}
+
+
+def fire(base_url, path, tokens):
+    """Send all requests at once from this thread's own event loop"""
+    async def go():
+        limits = httpx.Limits(max_connections=len(tokens))
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+            return await asyncio.gather(*[
+                client.get(path, headers={"Authorization": f"Bearer {token}"})
+                for token in tokens
+            ])
+    return asyncio.run(go())
+
+
+async def measure(base_url, path, tokens):
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            expected = time.perf_counter() + 0.001
+            await asyncio.sleep(0.001)
+            lags.append((time.perf_counter() - expected) * 1000)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    responses = await asyncio.to_thread(fire, base_url, path, tokens)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+
+    failures = sum(1 for r in responses if r.status_code != 200)
+    return elapsed, lags, failures
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def main(count, key_fetch_ms):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    firebase_auth.verification_pool.max_queue = max(count, firebase_auth.verification_pool.max_queue)
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    base_url = f"http://127.0.0.1:{port}"
+
+    for label, path in [("none", "/none"), ("inline", "/inline"), ("pool", "/pooled")]:
+        # Fresh verifier per run: cold key cache, empty claims cache
+        firebase_auth.token_verifier = make_verifier(private_key, key_fetch_ms)
+        elapsed, lags, failures = await measure(base_url, path, make_tokens(private_key, count))
+        print(
+            f"{label:>6}: {count} requests in {elapsed * 1000:.0f} ms, failures {failures} | "
+            f"loop lag p50 {percentile(lags, 50):.1f} ms, p99 {percentile(lags, 99):.1f} ms, "
+            f"max {max(lags):.1f} ms"
+        )
+    print(f"pool metrics: {firebase_auth.verification_pool.to_dict()}")
+
+    server.should_exit = True
+    await serving
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--key-fetch-ms", type=float, default=100.0, help="Simulated signing-key fetch latency")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.key_fetch_ms))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark: picking a random legacy question as the questions table grows.
+
+Seeds a throwaway SQLite database with N questions (prompts of realistic
+size) and times the old fallback in issue_api_keys - load every Question
+row, then random.choice - against QuestionSampler, which keeps only the
+ids and confirms a pick with one primary-key lookup.
+
+Usage:
+    python bench_questions.py --sizes 1000 10000 100000 --picks 200
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from models import Base, Question
+from question_sampler import QuestionSampler
+
+PROMPT = "All bloops are razzies and all razzies are lazzies. " * 10
+
+
+async def bench(size, picks, old_limit):
+    path = os.path.join(tempfile.mkdtemp(), "bench_questions.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for start in range(0, size, 10000):
+            await conn.execute(insert(Question), [
+                {"prompt": f"{i}: {PROMPT}", "golden_label": "yes"}
+                for i in range(start, min(size, start + 10000))
+            ])
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+    rng = random.Random(42)
+
+    async with sessions() as db:
+        sampler = QuestionSampler()
+        started = time.perf_counter()
+        await sampler.refresh(db)
+        refresh_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        for _ in range(picks):
+            await sampler.pick(db, rng)
+        pick_us = (time.perf_counter() - started) / picks * 1e6
+        sampler.close()
+
+        old_text = "skipped"
+        if size <= old_limit:
+            rounds = max(1, min(picks, 20))
+            started = time.perf_counter()
+            for _ in range(rounds):
+                questions = (await db.scalars(select(Question))).all()
+                rng.choice(questions).id
+                db.expunge_all()
+            old_text = f"{(time.perf_counter() - started) / rounds * 1000:8.1f} ms"
+    await engine.dispose()
+    os.remove(path)
+
+    print(
+        f"{size:>8} questions | sampler: ids {len(sampler) * 8 / 1024:7.0f} KiB, "
+        f"refresh {refresh_ms:6.1f} ms, pick {pick_us:6.1f} us | load-all + choice {old_text}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--picks", type=int, default=200)
+    parser.add_argument("--old-limit", type=int, default=100000, help="Largest size to time the old approach for")
+    args = parser.parse_args()
+    for size in args.sizes:
+        asyncio.run(bench(size, args.picks, args.old_limit))
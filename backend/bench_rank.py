@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark: "where do I stand" lookups as the ranked population grows.
+
+Fills a LeaderboardIndex with N random users and times what
+GET /api/users/{username}/rank does per request (position plus neighbours
+above and below), next to what the old approach cost: sorting every
+ranked user on each request. Also times a resync's bulk build (sorted
+input, done off the event loop) against N one-by-one inserts. Runs in
+memory, no database needed.
+
+Usage:
+    python bench_rank.py --sizes 1000 10000 100000 1000000 --neighbors 5
+"""
+
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+from leaderboard import LeaderboardIndex, RankedUser, _build_views
+
+LOOKUPS = 2000
+
+
+def random_users(count, rng):
+    for user_id in range(1, count + 1):
+        wins, losses, draws = rng.randint(0, 150), rng.randint(0, 150), rng.randint(0, 30)
+        yield RankedUser(user_id, f"user{user_id}", wins, losses, draws, wins + losses + draws or 1)
+
+
+def bench(size, neighbors, rng, sort_limit):
+    users = list(random_users(size, rng))
+    index = LeaderboardIndex(session_factory=None)
+    started = time.perf_counter()
+    for user in users:
+        index.upsert(user)
+    build_s = time.perf_counter() - started
+
+    rows = [
+        SimpleNamespace(id=u.user_id, username=u.username, wins=u.wins, losses=u.losses, draws=u.draws, total_combats=u.total_combats)
+        for u in users
+    ]
+    started = time.perf_counter()
+    _build_views(rows)
+    bulk_s = time.perf_counter() - started
+
+    targets = [f"user{rng.randint(1, size)}" for _ in range(LOOKUPS)]
+    started = time.perf_counter()
+    for username in targets:
+        user = index.get_by_username(username)
+        index.position(user.user_id)
+        index.neighbours(user.user_id, neighbors)
+    lookup_us = (time.perf_counter() - started) / LOOKUPS * 1e6
+
+    started = time.perf_counter()
+    for _ in range(5):
+        index.upsert(RankedUser(1, "user1", rng.randint(0, 150), 0, 0, 1))
+    update_us = (time.perf_counter() - started) / 5 * 1e6
+
+    sort_ms = None
+    if size <= sort_limit:
+        users = list(index._users.values())
+        started = time.perf_counter()
+        ranked = sorted(users, key=lambda u: u.sort_key)
+        [u.user_id for u in ranked].index(1)
+        sort_ms = (time.perf_counter() - started) * 1000
+
+    sort_text = f"{sort_ms:.1f} ms" if sort_ms is not None else "skipped"
+    print(
+        f"{size:>9} users | inserts {build_s:6.1f} s, bulk build {bulk_s:6.2f} s | rank+neighbours {lookup_us:6.1f} us/request | "
+        f"update {update_us:6.1f} us | full sort per request {sort_text}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--neighbors", type=int, default=5)
+    parser.add_argument("--sort-limit", type=int, default=1000000, help="Largest size to time the full sort for")
+    args = parser.parse_args()
+    rng = random.Random(42)
+    for size in args.sizes:
+        bench(size, args.neighbors, rng, args.sort_limit)
@@ -0,0 +1,166 @@
+"""
+Small in-process caches for hot read paths.
+
+`TTLCache` is a bounded LRU whose entries also expire after a fixed TTL.
+It is not shared between uvicorn workers, so anything cached here must be
+safe to serve slightly stale for up to `ttl_seconds`; writers invalidate
+their own worker's entries. Operations take a lock so a cache can also be
+used from worker threads.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache with per-entry time-to-live and hit/miss/eviction counters"""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._removed(key, value)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            old = self._data.get(key, _MISSING)
+            if old is not _MISSING:
+                self._removed(key, old[1])
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            self._added(key, value)
+            while len(self._data) > self.maxsize:
+                evicted_key, (_, evicted) = self._data.popitem(last=False)
+                self._removed(evicted_key, evicted)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            for key, (_, value) in self._data.items():
+                self._removed(key, value)
+            self._data.clear()
+
+    def _pop(self, key: Hashable):
+        entry = self._data.pop(key, _MISSING)
+        if entry is not _MISSING:
+            self._removed(key, entry[1])
+            self.invalidations += 1
+
+    # Called under the lock whenever an entry is stored or leaves the cache
+    # (invalidated, evicted, expired, replaced), for subclasses that index entries
+    def _added(self, key: Hashable, value: Any):
+        pass
+
+    def _removed(self, key: Hashable, value: Any):
+        pass
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+# token hash -> (user_id, combat_id, revoked)
+api_key_cache = TTLCache(
+    maxsize=int(os.getenv("API_KEY_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("API_KEY_CACHE_TTL_SECONDS", "60"))
+)
+
+# combat id -> (code, state, expires_at); invalidated on every transition
+combat_state_cache = TTLCache(
+    maxsize=int(os.getenv("COMBAT_STATE_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("COMBAT_STATE_CACHE_TTL_SECONDS", "1.0"))
+)
+
+
+class IdentityCache(TTLCache):
+    """
+    TTLCache of firebase uid -> UserIdentity that can also drop an entry by
+    user id, for writers that only know user ids. The user id index lives
+    and dies with the entries themselves, so it can't miss a cached one.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        super().__init__(maxsize, ttl_seconds)
+        self._uids = {}
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            uid = self._uids.get(user_id)
+            if uid is not None:
+                self._pop(uid)
+
+    def _added(self, key, identity):
+        self._uids[identity.id] = key
+
+    def _removed(self, key, identity):
+        if self._uids.get(identity.id) == key:
+            del self._uids[identity.id]
+
+
+# firebase uid -> UserIdentity (id + profile); invalidated on username/stat changes
+identity_cache = IdentityCache(
+    maxsize=int(os.getenv("IDENTITY_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "60"))
+)
+
+
+def cache_identity(identity):
+    identity_cache.set(identity.firebase_uid, identity)
+
+
+def invalidate_identities(*user_ids):
+    """Drop cached identities of the given users (this worker only)"""
+    for user_id in user_ids:
+        identity_cache.invalidate_user(user_id)
+
+
+def cache_metrics() -> dict:
+    return {
+        "apiKeys": api_key_cache.to_dict(),
+        "combatState": combat_state_cache.to_dict(),
+        "identities": identity_cache.to_dict(),
+    }
@@ -0,0 +1,160 @@
+"""
+Circuit breaker with a per-call timeout budget, for remote dependencies.
+
+Every call gets at most `timeout_seconds`; a slow call counts as a failure
+and the caller gets CircuitTimeoutError instead of waiting it out. Outcomes
+of the last `window_seconds` (at most `window_size` calls) are tracked, and
+once at least `min_calls` of them show an error rate of `error_rate` or
+more, the breaker opens: calls fail at once with CircuitOpenError, so
+callers go straight to their fallback. After `open_seconds` one probe call
+is let through (half-open); its success closes the breaker, its failure
+opens it for another `open_seconds`.
+
+Blocking functions run in the threadpool. A timed-out thread can't be
+interrupted and finishes in the background, but while the breaker is open
+no new ones are started.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """The breaker is open; the call was not attempted"""
+
+
+class CircuitTimeoutError(Exception):
+    """The call ran past its timeout budget"""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        timeout_seconds: float = 3.0,
+        error_rate: float = 0.5,
+        min_calls: int = 5,
+        window_size: int = 20,
+        window_seconds: float = 60.0,
+        open_seconds: float = 30.0
+    ):
+        self.name = name
+        self.timeout_seconds = timeout_seconds
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._outcomes: deque = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._probing = False
+        # Metrics
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.short_circuited = 0
+        self.opens = 0
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def current_error_rate(self) -> float:
+        self._prune(time.monotonic())
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def _admit(self) -> bool:
+        """Whether a call may go through now; moves open -> half-open when due"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            logger.info("Circuit %s half-open, probing", self.name)
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self._opened_at = now
+        self.opens += 1
+        logger.warning(
+            "Circuit %s opened (error rate %.0f%%); failing fast for %.0fs",
+            self.name, self.current_error_rate() * 100, self.open_seconds
+        )
+
+    def _record(self, ok: bool, probe: bool):
+        now = time.monotonic()
+        if probe:
+            self._probing = False
+            if ok:
+                self.state = CLOSED
+                self._outcomes.clear()
+                logger.info("Circuit %s closed after a successful probe", self.name)
+            else:
+                self._open(now)
+            return
+        self._outcomes.append((now, ok))
+        self._prune(now)
+        if (
+            self.state == CLOSED
+            and len(self._outcomes) >= self.min_calls
+            and self.current_error_rate() >= self.error_rate
+        ):
+            self._open(now)
+
+    async def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run blocking `fn` in the threadpool within the timeout budget"""
+        if not self._admit():
+            self.short_circuited += 1
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        probe = self.state == HALF_OPEN
+        self.calls += 1
+        try:
+            result = await asyncio.wait_for(run_in_threadpool(fn, *args, **kwargs), self.timeout_seconds)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.failures += 1
+            self._record(False, probe)
+            raise CircuitTimeoutError(f"{self.name} call exceeded {self.timeout_seconds}s")
+        except asyncio.CancelledError:
+            # The caller went away; that says nothing about the dependency
+            if probe:
+                self._probing = False
+            raise
+        except Exception:
+            self.failures += 1
+            self._record(False, probe)
+            raise
+        self.successes += 1
+        self._record(True, probe)
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "errorRate": round(self.current_error_rate(), 3),
+            "windowCalls": len(self._outcomes),
+            "calls": self.calls,
+            "successes": self.successes,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "shortCircuited": self.short_circuited,
+            "opens": self.opens,
+            "openForSeconds": round(time.monotonic() - self._opened_at, 1) if self.state != CLOSED else None,
+        }
@@ -0,0 +1,310 @@
+"""
+Live combat status feeds for Server-Sent Events and agent WebSockets.
+
+`publish(code, event_type)` is called for every committed state change
+(from the combat event bus, so changes made by other workers arrive too).
+If any stream in this worker follows that combat, its feed reloads the
+combat once, diffs the rendered CombatStatusResponse against the last one
+and fans only the changed fields out to every subscriber - so a lobby open
+in N tabs costs one query per change instead of N queries every 2 seconds.
+Feeds nobody follows are never loaded.
+
+Each feed keeps its last few events, so a reconnecting EventSource that
+sends Last-Event-ID gets exactly the events it missed; when that is not
+possible (feed restarted, gap longer than the history) it gets a fresh
+snapshot instead. Streams send a heartbeat comment while idle, and an idle
+feed re-checks the database at most once per heartbeat interval in case
+an event was lost.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Events kept per combat for Last-Event-ID resume
+SSE_HISTORY_SIZE = int(os.getenv("SSE_HISTORY_SIZE", "64"))
+# Undelivered events per stream before it is resynced with a snapshot
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "32"))
+# How long a feed outlives its last subscriber, so reconnects can resume
+SSE_FEED_LINGER_SECONDS = float(os.getenv("SSE_FEED_LINGER_SECONDS", "30"))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "2000"))
+
+TERMINAL_STATES = ("COMPLETED", "EXPIRED")
+# Changes every second; clients count it down locally between events
+_VOLATILE_FIELDS = ("countdownSeconds",)
+
+
+@dataclass(frozen=True)
+class FeedEvent:
+    id: str
+    type: str
+    data: dict
+
+    @property
+    def seq(self) -> int:
+        return int(self.id.rpartition("-")[2])
+
+    def encode(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+def status_delta(previous: dict, current: dict) -> dict:
+    """Fields of `current` that differ from `previous`, plus the live countdown"""
+    delta = {
+        key: value for key, value in current.items()
+        if key not in _VOLATILE_FIELDS and previous.get(key) != value
+    }
+    if delta:
+        for key in _VOLATILE_FIELDS:
+            if current.get(key) is not None:
+                delta[key] = current[key]
+    return delta
+
+
+class Subscription:
+    """One open stream's bounded queue of pending events"""
+
+    def __init__(self, feed: "CombatFeed", maxsize: int):
+        self.feed = feed
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def push(self, event: FeedEvent) -> bool:
+        if self.overflowed:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            # Slow reader: stop queueing, the stream resyncs from a snapshot
+            self.overflowed = True
+            return False
+
+
+class CombatFeed:
+    """Last rendered status, recent events and subscribers for one combat"""
+
+    def __init__(self, code: str, history_size: int):
+        self.code = code
+        # Distinguishes event ids from an earlier feed for the same combat
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.status: Optional[dict] = None
+        self.history: deque = deque(maxlen=history_size)
+        self.subscribers: Set[Subscription] = set()
+        self.lock = asyncio.Lock()
+        self.last_refresh = 0.0
+        self.linger: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def last_event_id(self) -> str:
+        return f"{self.epoch}-{self.seq}"
+
+    def next_event(self, event_type: str, data: dict) -> FeedEvent:
+        self.seq += 1
+        return FeedEvent(self.last_event_id, event_type, data)
+
+    def events_after(self, last_event_id: str) -> Optional[List[FeedEvent]]:
+        """Events after `last_event_id`, or None if they can't all be replayed"""
+        epoch, _, seq = last_event_id.rpartition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        missed = [event for event in self.history if event.seq > int(seq)]
+        if len(missed) != self.seq - int(seq):
+            return None
+        return missed
+
+
+class CombatFeedHub:
+    """Per-worker registry of combat feeds, keyed by combat code"""
+
+    def __init__(
+        self,
+        session_factory,
+        render: Callable[..., Awaitable[Optional[dict]]],
+        heartbeat_seconds: float = SSE_HEARTBEAT_SECONDS,
+        history_size: int = SSE_HISTORY_SIZE,
+        queue_size: int = SSE_QUEUE_SIZE,
+        linger_seconds: float = SSE_FEED_LINGER_SECONDS,
+        retry_ms: int = SSE_RETRY_MS
+    ):
+        self.session_factory = session_factory
+        # render(db, code) -> CombatStatusResponse as a JSON-ready dict, or None
+        self.render = render
+        self.heartbeat_seconds = heartbeat_seconds
+        self.history_size = history_size
+        self.queue_size = queue_size
+        self.linger_seconds = linger_seconds
+        self.retry_ms = retry_ms
+        self._feeds: Dict[str, CombatFeed] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        # Metrics
+        self.published = 0
+        self.refreshes = 0
+        self.events_sent = 0
+        self.snapshots_sent = 0
+        self.resumes = 0
+        self.overflows = 0
+
+    async def _load(self, code: str) -> Optional[dict]:
+        async with self.session_factory() as db:
+            return await self.render(db, code)
+
+    async def _refresh_locked(self, feed: CombatFeed, event_type: str):
+        """Reload the combat and fan out what changed (caller holds feed.lock)"""
+        status = await self._load(feed.code)
+        feed.last_refresh = time.monotonic()
+        self.refreshes += 1
+        if status is None:
+            return
+        previous, feed.status = feed.status, status
+        if previous is None:
+            return
+        delta = status_delta(previous, status)
+        if not delta:
+            return
+        event = feed.next_event(event_type, delta)
+        feed.history.append(event)
+        for subscription in list(feed.subscribers):
+            if not subscription.push(event):
+                self.overflows += 1
+
+    async def _refresh(self, feed: CombatFeed, event_type: str):
+        try:
+            # Lock waiters run in FIFO order, so events keep publish order
+            async with feed.lock:
+                await self._refresh_locked(feed, event_type)
+        except Exception:
+            logger.exception("Combat feed refresh failed for %s", feed.code)
+
+    def _schedule(self, feed: CombatFeed, event_type: str):
+        task = asyncio.create_task(self._refresh(feed, event_type))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def publish(self, code: str, event_type: str):
+        """Note a committed change to a combat; no-op if no stream here follows it"""
+        feed = self._feeds.get(code)
+        if feed is None:
+            return
+        self.published += 1
+        self._schedule(feed, event_type)
+
+    async def open(self, code: str, last_event_id: Optional[str] = None) -> Optional[Tuple[Subscription, List[FeedEvent]]]:
+        """
+        Subscribe to a combat. Returns the subscription and the events to
+        send first - the missed events when `last_event_id` can be resumed,
+        else a full snapshot - or None if the combat does not exist.
+        """
+        feed = self._feeds.get(code)
+        if feed is None:
+            feed = CombatFeed(code, self.history_size)
+            self._feeds[code] = feed
+        if feed.linger is not None:
+            feed.linger.cancel()
+            feed.linger = None
+
+        async with feed.lock:
+            # Always start from the database, in case another worker changed it
+            await self._refresh_locked(feed, "sync")
+            if feed.status is None:
+                self._release(feed)
+                return None
+            initial = feed.events_after(last_event_id) if last_event_id else None
+            if initial is None:
+                initial = [FeedEvent(feed.last_event_id, "snapshot", feed.status)]
+            else:
+                self.resumes += 1
+            subscription = Subscription(feed, self.queue_size)
+            feed.subscribers.add(subscription)
+        return subscription, initial
+
+    def close(self, subscription: Subscription):
+        feed = subscription.feed
+        feed.subscribers.discard(subscription)
+        self._release(feed)
+
+    def _release(self, feed: CombatFeed):
+        if feed.subscribers or self._feeds.get(feed.code) is not feed:
+            return
+        if feed.linger is not None:
+            feed.linger.cancel()
+        feed.linger = asyncio.get_running_loop().call_later(self.linger_seconds, self._drop, feed)
+
+    def _drop(self, feed: CombatFeed):
+        if not feed.subscribers and self._feeds.get(feed.code) is feed:
+            del self._feeds[feed.code]
+
+    async def next_event(self, subscription: Subscription) -> Optional[FeedEvent]:
+        """
+        Next event for a subscriber, or None after a quiet heartbeat interval.
+        A subscriber that overflowed its queue gets a snapshot instead.
+        """
+        feed = subscription.feed
+        if subscription.overflowed:
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            subscription.overflowed = False
+            return FeedEvent(feed.last_event_id, "snapshot", feed.status)
+        try:
+            return await asyncio.wait_for(subscription.queue.get(), self.heartbeat_seconds)
+        except asyncio.TimeoutError:
+            if time.monotonic() - feed.last_refresh >= self.heartbeat_seconds:
+                self._schedule(feed, "sync")
+            return None
+
+    async def stream(self, subscription: Subscription, initial: List[FeedEvent]) -> AsyncIterator[str]:
+        """SSE body: initial events, then deltas until the combat ends"""
+        feed = subscription.feed
+        try:
+            yield f"retry: {self.retry_ms}\n\n"
+            for event in initial:
+                self._count(event)
+                yield event.encode()
+            if feed.status and feed.status.get("state") in TERMINAL_STATES:
+                return
+            while True:
+                event = await self.next_event(subscription)
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                self._count(event)
+                yield event.encode()
+                if event.data.get("state") in TERMINAL_STATES:
+                    return
+        finally:
+            self.close(subscription)
+
+    def _count(self, event: FeedEvent):
+        if event.type == "snapshot":
+            self.snapshots_sent += 1
+        else:
+            self.events_sent += 1
+
+    def reset(self):
+        """Forget all feeds (tests)"""
+        for feed in self._feeds.values():
+            if feed.linger is not None:
+                feed.linger.cancel()
+        self._feeds.clear()
+
+    def to_dict(self) -> dict:
+        return {
+            "feeds": len(self._feeds),
+            "streams": sum(len(feed.subscribers) for feed in self._feeds.values()),
+            "published": self.published,
+            "refreshes": self.refreshes,
+            "eventsSent": self.events_sent,
+            "snapshotsSent": self.snapshots_sent,
+            "resumes": self.resumes,
+            "overflows": self.overflows,
+        }
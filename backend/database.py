@@ -1,32 +1,224 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from models import Base
+import asyncio
 import os
+import random
+import time
+import weakref
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./combat.db")
 
+def to_async_url(url: str) -> str:
+    """Map a sync database URL to its async driver (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite:///"):
+        return url.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    return url
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# SQLite production profile (applied to every new connection)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Commit retry on "database is locked"
+WRITE_RETRY_ATTEMPTS = int(os.getenv("WRITE_RETRY_ATTEMPTS", "5"))
+WRITE_RETRY_BASE_DELAY = float(os.getenv("WRITE_RETRY_BASE_DELAY", "0.02"))
+
+# Sync engine - used by scripts (init_db.py, seed_questions.py)
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
 )
 
+# Async engine - used by the FastAPI request handlers
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Connect hook: WAL journal, relaxed fsync, larger cache/mmap and a busy timeout"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+if IS_SQLITE:
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
 # Create session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
 
-def get_db():
+async def get_db():
     """Dependency for FastAPI routes"""
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+# ============================================================================
+# WRITE SERIALIZATION
+# ============================================================================
+
+class WriteLockMetrics:
+    """Counters for time spent waiting on the writer lock and SQLite busy retries"""
+
+    def __init__(self):
+        self.writes = 0
+        self.lock_waits = 0
+        self.lock_wait_ms_total = 0.0
+        self.lock_wait_ms_max = 0.0
+        self.busy_retries = 0
+        self.busy_failures = 0
+
+    def record_wait(self, wait_ms: float):
+        self.writes += 1
+        if wait_ms >= 1.0:
+            self.lock_waits += 1
+        self.lock_wait_ms_total += wait_ms
+        self.lock_wait_ms_max = max(self.lock_wait_ms_max, wait_ms)
+
+    def to_dict(self) -> dict:
+        return {
+            "writes": self.writes,
+            "lockWaits": self.lock_waits,
+            "lockWaitMsTotal": round(self.lock_wait_ms_total, 2),
+            "lockWaitMsMax": round(self.lock_wait_ms_max, 2),
+            "busyRetries": self.busy_retries,
+            "busyFailures": self.busy_failures,
+        }
+
+write_metrics = WriteLockMetrics()
+
+# One writer per worker process - SQLite only allows a single writer anyway,
+# so queueing here is cheaper than contending for the file lock.
+# Keyed by event loop so the lock is never shared across loops (tests).
+_write_locks = weakref.WeakKeyDictionary()
+
+def get_write_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _write_locks.get(loop)
+    if lock is None:
+        lock = _write_locks[loop] = asyncio.Lock()
+    return lock
+
+def is_lock_error(error: OperationalError) -> bool:
+    """True for SQLite 'database is locked' / 'busy' errors"""
+    message = str(error.orig).lower() if error.orig else str(error).lower()
+    return "locked" in message or "busy" in message
+
+async def run_serialized_write(db: AsyncSession, work, refresh=()):
+    """
+    Run `await work()` and commit it as a single write.
+    
+    On SQLite the write holds the per-process writer lock, and a commit that
+    fails with "database is locked" is rolled back and retried with jittered
+    exponential backoff. `work` must be safe to re-run; objects listed in
+    `refresh` are reloaded after a rollback.
+    """
+    if not IS_SQLITE:
+        result = await work()
+        await db.commit()
+        return result
+    
+    for attempt in range(WRITE_RETRY_ATTEMPTS):
+        started = time.perf_counter()
+        async with get_write_lock():
+            write_metrics.record_wait((time.perf_counter() - started) * 1000)
+            try:
+                result = await work()
+                await db.commit()
+                return result
+            except OperationalError as e:
+                await db.rollback()
+                if not is_lock_error(e):
+                    raise
+                if attempt == WRITE_RETRY_ATTEMPTS - 1:
+                    write_metrics.busy_failures += 1
+                    raise
+                write_metrics.busy_retries += 1
+        # Back off outside the lock so other writers can proceed
+        delay = WRITE_RETRY_BASE_DELAY * (2 ** attempt)
+        await asyncio.sleep(random.uniform(0, delay))
+        for obj in refresh:
+            await db.refresh(obj)
+
+def add_missing_computed_columns(connection):
+    """
+    ALTER existing tables to add generated columns declared since they were created.
+    
+    SQLite can only add VIRTUAL generated columns to an existing table (they
+    can still be indexed); PostgreSQL only supports STORED ones.
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    storage = "VIRTUAL" if connection.dialect.name == "sqlite" else "STORED"
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.computed is None or column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} "
+                f"GENERATED ALWAYS AS ({column.computed.sqltext}) {storage}"
+            )
+            print(f"Added generated column {table.name}.{column.name}")
+
+def add_missing_nullable_columns(connection):
+    """ALTER existing tables to add plain nullable columns declared since they were created"""
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or column.computed is not None or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            print(f"Added column {table.name}.{column.name}")
+
+def create_schema(connection):
+    """Create missing tables, plus columns and indexes added to tables that already exist"""
+    Base.metadata.create_all(bind=connection)
+    add_missing_nullable_columns(connection)
+    add_missing_computed_columns(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
 
 def init_database():
     """Initialize the database - create all tables"""
-    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        create_schema(conn)
+    print("Database initialized successfully!")
+
+async def init_database_async():
+    """Initialize the database from inside the event loop"""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(create_schema)
     print("Database initialized successfully!")
 
 if __name__ == "__main__":
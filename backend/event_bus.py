@@ -0,0 +1,279 @@
+"""
+Combat event bus: typed state-change events fanned out to every worker.
+
+Handlers call `await combat_bus.emit(db, event)` inside the transaction
+that makes the change. The event is delivered only if that transaction
+commits, and in commit order - which for a single combat is the order of
+its transitions, since each one is a conditional UPDATE on the same row.
+
+Two transports:
+
+- local (single worker, SQLite): events are staged on the session and
+  handed to subscribers from an after_commit hook.
+- postgres (several uvicorn workers): `emit` runs pg_notify() in the same
+  transaction and every worker - including the emitting one - receives it
+  through a LISTEN connection. Postgres delivers notifications in commit
+  order, so per-combat ordering holds across workers too.
+
+Subscribers are either listeners (called inline; must not block - e.g.
+schedule a task) or bounded queues for consumers that do real work; a
+queue that fills up drops events and is flagged so its consumer can
+resync from the database instead of growing without limit.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+from typing import Callable, List, Optional
+
+from sqlalchemy import event as sa_event, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# auto: postgres when DATABASE_URL is Postgres, else local
+COMBAT_EVENT_BUS = os.getenv("COMBAT_EVENT_BUS", "auto")
+COMBAT_EVENT_CHANNEL = os.getenv("COMBAT_EVENT_CHANNEL", "combat_events")
+COMBAT_EVENT_QUEUE_SIZE = int(os.getenv("COMBAT_EVENT_QUEUE_SIZE", "1000"))
+# Delay between LISTEN reconnect attempts
+COMBAT_EVENT_RECONNECT_SECONDS = float(os.getenv("COMBAT_EVENT_RECONNECT_SECONDS", "2"))
+
+_STAGED_KEY = "combat_events"
+
+
+class CombatEventType(str, Enum):
+    ACCEPTED = "accepted"
+    KEYS_ISSUED = "keys_issued"
+    READY = "ready"
+    STARTED = "started"
+    SUBMISSION = "submission"
+    COMPLETED = "completed"
+    EXPIRED = "expired"
+    # Not a state change: the combat's API keys were revoked (data: token_hashes)
+    KEYS_REVOKED = "keys_revoked"
+
+
+@dataclass(frozen=True)
+class CombatEvent:
+    type: CombatEventType
+    combat_id: str
+    code: str
+    state: str
+    user_id: Optional[int] = None
+    at: float = field(default_factory=time.time)
+    # Small JSON-safe payload for listeners on other workers
+    data: Optional[dict] = None
+
+    def encode(self) -> str:
+        payload = asdict(self)
+        payload["type"] = self.type.value
+        return json.dumps(payload, separators=(",", ":"))
+
+    @classmethod
+    def decode(cls, payload: str) -> "CombatEvent":
+        data = json.loads(payload)
+        data["type"] = CombatEventType(data["type"])
+        return cls(**data)
+
+
+class EventSubscription:
+    """Bounded queue of events for one consumer"""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+        self.dropped = 0
+
+    def push(self, event: CombatEvent):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The consumer fell behind; it should resync from the database
+            self.overflowed = True
+            self.dropped += 1
+
+    async def get(self) -> CombatEvent:
+        return await self.queue.get()
+
+
+class CombatEventBus:
+    """In-process broker; also the delivery end of the Postgres transport"""
+
+    transport = "local"
+
+    def __init__(self, queue_size: int = COMBAT_EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._listeners: List[Callable[[CombatEvent], None]] = []
+        self._subscriptions: List[EventSubscription] = []
+        # Metrics
+        self.emitted = 0
+        self.delivered = 0
+        self.listener_errors = 0
+
+    def add_listener(self, listener: Callable[[CombatEvent], None]):
+        self._listeners.append(listener)
+
+    def subscribe(self, maxsize: Optional[int] = None) -> EventSubscription:
+        subscription = EventSubscription(maxsize or self.queue_size)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    async def emit(self, db: AsyncSession, event: CombatEvent):
+        """Deliver `event` when (and if) the session's transaction commits"""
+        self.emitted += 1
+        # Begin the transaction now, so a rollback before any write discards it
+        await db.connection()
+        db.sync_session.info.setdefault(_STAGED_KEY, []).append((self, event))
+
+    def deliver(self, event: CombatEvent):
+        self.delivered += 1
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception:
+                self.listener_errors += 1
+                logger.exception("Combat event listener failed on %s", event.type.value)
+        for subscription in list(self._subscriptions):
+            subscription.push(event)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def to_dict(self) -> dict:
+        return {
+            "transport": self.transport,
+            "emitted": self.emitted,
+            "delivered": self.delivered,
+            "listenerErrors": self.listener_errors,
+            "subscriptions": len(self._subscriptions),
+            "dropped": sum(s.dropped for s in self._subscriptions),
+        }
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _deliver_staged(session: Session):
+    staged = session.info.pop(_STAGED_KEY, None)
+    for bus, event in staged or ():
+        bus.deliver(event)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_staged(session: Session):
+    session.info.pop(_STAGED_KEY, None)
+
+
+def asyncpg_dsn(database_url: str) -> str:
+    """Plain postgresql:// DSN for asyncpg from a SQLAlchemy URL, whatever its driver"""
+    url = make_url(database_url).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+class PostgresCombatEventBus(CombatEventBus):
+    """Cross-worker bus over Postgres LISTEN/NOTIFY"""
+
+    transport = "postgres"
+
+    def __init__(
+        self,
+        dsn: str,
+        channel: str = COMBAT_EVENT_CHANNEL,
+        queue_size: int = COMBAT_EVENT_QUEUE_SIZE,
+        reconnect_seconds: float = COMBAT_EVENT_RECONNECT_SECONDS
+    ):
+        super().__init__(queue_size)
+        self.dsn = dsn
+        self.channel = channel
+        self.reconnect_seconds = reconnect_seconds
+        # Identifies this worker in metrics and logs
+        self.worker_id = uuid.uuid4().hex[:8]
+        self._connection = None
+        self._task: Optional[asyncio.Task] = None
+        self._lost: Optional[asyncio.Event] = None
+        # Metrics
+        self.reconnects = 0
+        self.decode_errors = 0
+
+    async def emit(self, db: AsyncSession, event: CombatEvent):
+        """NOTIFY inside the caller's transaction; delivered to all workers on commit"""
+        self.emitted += 1
+        await db.execute(select(func.pg_notify(self.channel, event.encode())))
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = CombatEvent.decode(payload)
+        except (ValueError, TypeError, KeyError) as e:
+            self.decode_errors += 1
+            logger.warning("Ignoring malformed combat event: %s", e)
+            return
+        self.deliver(event)
+
+    def _on_termination(self, connection):
+        if self._lost is not None:
+            self._lost.set()
+
+    async def _run(self):
+        import asyncpg
+        while True:
+            self._lost = asyncio.Event()
+            try:
+                self._connection = await asyncpg.connect(self.dsn)
+                self._connection.add_termination_listener(self._on_termination)
+                await self._connection.add_listener(self.channel, self._on_notify)
+                await self._lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Combat event LISTEN connection failed: %s", e)
+            finally:
+                if self._connection is not None and not self._connection.is_closed():
+                    await self._connection.close()
+                self._connection = None
+            # Events sent while disconnected are lost; feeds resync on their heartbeat
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_seconds)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def to_dict(self) -> dict:
+        metrics = super().to_dict()
+        metrics.update({
+            "workerId": self.worker_id,
+            "listening": self._connection is not None,
+            "reconnects": self.reconnects,
+            "decodeErrors": self.decode_errors,
+        })
+        return metrics
+
+
+def create_event_bus(database_url: str, mode: str = COMBAT_EVENT_BUS) -> CombatEventBus:
+    """Bus for this deployment: Postgres LISTEN/NOTIFY or in-process"""
+    is_postgres = database_url.startswith(("postgresql", "postgres://"))
+    if mode == "postgres" or (mode == "auto" and is_postgres):
+        return PostgresCombatEventBus(asyncpg_dsn(database_url))
+    return CombatEventBus()
@@ -10,10 +10,16 @@ Setup:
 """
 
 import os
+import json
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import firebase_admin
 from firebase_admin import credentials, auth
 from fastapi import HTTPException, Header, Depends
 from functools import lru_cache
+from token_verifier import FirebaseTokenVerifier, InvalidTokenError, ExpiredTokenError
 
 # Initialize Firebase Admin SDK
 _firebase_app = None
@@ -48,6 +54,118 @@ def get_firebase_app():
     return _firebase_app
 
 
+def get_firebase_project_id() -> str | None:
+    """Project id from FIREBASE_PROJECT_ID or the service account file"""
+    project_id = os.getenv("FIREBASE_PROJECT_ID")
+    if project_id:
+        return project_id
+    
+    service_account_path = os.getenv(
+        "FIREBASE_SERVICE_ACCOUNT_PATH", 
+        os.path.join(os.path.dirname(__file__), "firebase-service-account.json")
+    )
+    try:
+        with open(service_account_path) as f:
+            return json.load(f).get("project_id")
+    except (OSError, ValueError):
+        return os.getenv("GOOGLE_CLOUD_PROJECT")
+
+
+# Offline verifier (cached signing keys + decoded-claims cache); without a
+# known project id we fall back to firebase_admin's verify_id_token
+_project_id = get_firebase_project_id()
+token_verifier = FirebaseTokenVerifier(_project_id) if _project_id else None
+
+
+# ============================================================================
+# VERIFICATION POOL
+# ============================================================================
+
+FIREBASE_VERIFY_WORKERS = int(os.getenv("FIREBASE_VERIFY_WORKERS", "4"))
+FIREBASE_VERIFY_MAX_QUEUE = int(os.getenv("FIREBASE_VERIFY_MAX_QUEUE", "256"))
+
+
+class VerificationPool:
+    """
+    Dedicated, bounded thread pool for token verification.
+    
+    RSA checks and signing-key fetches are blocking, so they run here instead
+    of on the event loop (or in Starlette's shared threadpool, where they
+    would compete with sync endpoints). Requests beyond `max_queue` waiting
+    verifications are rejected with 503 rather than queued without limit.
+    """
+    
+    def __init__(self, workers: int = FIREBASE_VERIFY_WORKERS, max_queue: int = FIREBASE_VERIFY_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="firebase-verify")
+        self._lock = threading.Lock()
+        # Metrics
+        self.in_flight = 0
+        self.running = 0
+        self.max_queued = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.queue_wait_ms_total = 0.0
+        self.queue_wait_ms_max = 0.0
+        self.run_ms_total = 0.0
+    
+    @property
+    def queued(self) -> int:
+        return self.in_flight - self.running
+    
+    def _call(self, fn, args, enqueued_at):
+        started = time.perf_counter()
+        wait_ms = (started - enqueued_at) * 1000
+        with self._lock:
+            self.running += 1
+            self.queue_wait_ms_total += wait_ms
+            self.queue_wait_ms_max = max(self.queue_wait_ms_max, wait_ms)
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.run_ms_total += (time.perf_counter() - started) * 1000
+    
+    def _done(self, future):
+        # Also runs for a job cancelled while queued, which never reaches _call
+        with self._lock:
+            self.in_flight -= 1
+    
+    async def run(self, fn, *args):
+        """Run `fn(*args)` on the pool and await its result"""
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Authentication service busy, retry shortly")
+            self.in_flight += 1
+            self.submitted += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        future = self._executor.submit(self._call, fn, args, time.perf_counter())
+        future.add_done_callback(self._done)
+        # Cancelling the await (client gone, timeout) cancels the job if it hasn't started
+        return await asyncio.wrap_future(future)
+    
+    def to_dict(self) -> dict:
+        completed = self.submitted - self.in_flight
+        return {
+            "workers": self.workers,
+            "maxQueue": self.max_queue,
+            "running": self.running,
+            "queued": self.queued,
+            "maxQueued": self.max_queued,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "queueWaitMsAvg": round(self.queue_wait_ms_total / completed, 2) if completed else 0.0,
+            "queueWaitMsMax": round(self.queue_wait_ms_max, 2),
+            "runMsAvg": round(self.run_ms_total / completed, 2) if completed else 0.0,
+        }
+
+
+verification_pool = VerificationPool()
+
+
 def verify_firebase_token(id_token: str) -> dict:
     """
     Verify a Firebase ID token and return the decoded token.
@@ -61,6 +179,16 @@ def verify_firebase_token(id_token: str) -> dict:
     Raises:
         HTTPException: If token is invalid
     """
+    if token_verifier is not None:
+        try:
+            return token_verifier.verify(id_token)
+        except ExpiredTokenError:
+            raise HTTPException(status_code=401, detail="Token has expired")
+        except InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        except Exception as e:
+            raise HTTPException(status_code=401, detail=f"Authentication failed: {str(e)}")
+    
     app = get_firebase_app()
     
     if app is None:
@@ -82,6 +210,27 @@ def verify_firebase_token(id_token: str) -> dict:
         raise HTTPException(status_code=401, detail=f"Authentication failed: {str(e)}")
 
 
+async def verify_firebase_token_async(id_token: str) -> dict:
+    """
+    Verify a token without blocking the event loop.
+    
+    Tokens already in the claims cache are answered inline; everything else
+    goes through the verification pool.
+    """
+    if token_verifier is not None:
+        claims = token_verifier.cached_claims(id_token)
+        if claims is not None:
+            return claims
+    return await verification_pool.run(verify_firebase_token, id_token)
+
+
+def firebase_auth_metrics() -> dict:
+    return {
+        "verifier": token_verifier.to_dict() if token_verifier else None,
+        "pool": verification_pool.to_dict(),
+    }
+
+
 async def get_current_firebase_user(authorization: str = Header(None)) -> dict:
     """
     FastAPI dependency to get current authenticated Firebase user.
@@ -98,7 +247,7 @@ async def get_current_firebase_user(authorization: str = Header(None)) -> dict:
         raise HTTPException(status_code=401, detail="Invalid authorization format. Use: Bearer <token>")
     
     token = authorization.replace("Bearer ", "")
-    return verify_firebase_token(token)
+    return await verify_firebase_token_async(token)
 
 
 async def get_optional_firebase_user(authorization: str = Header(None)) -> dict | None:
@@ -111,7 +260,7 @@ async def get_optional_firebase_user(authorization: str = Header(None)) -> dict
     
     try:
         token = authorization.replace("Bearer ", "")
-        return verify_firebase_token(token)
+        return await verify_firebase_token_async(token)
     except HTTPException:
         return None
 
@@ -0,0 +1,395 @@
+"""
+In-memory ranked leaderboard.
+
+Every user with at least one combat sits in an indexable skip list ordered
+by the leaderboard sort (score desc, wins desc, win rate desc, then user id
+for a stable order), plus one skip list per rank tier. Each skip-list link
+records how many entries it jumps over, so inserts, removals, "position of
+user X" and "entries from position k" are all O(log n) expected.
+
+The index is built from the users table once, at startup. After that it
+is updated in O(log n) per player from the combat event bus: the
+COMPLETED / EXPIRED event of a scored combat carries both players' new
+counters, and every worker applies them to its own copy.
+
+A resync every LEADERBOARD_REBUILD_SECONDS (0 disables it) picks up what
+events don't carry - renames on other workers, events lost while a LISTEN
+connection was down. It loads the rows, builds the new skip lists on a
+worker thread in O(n) from sorted input, and swaps them in at once; updates
+that arrive during the build are replayed onto the new copy.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from models import RANK_TIERS, User, rank_for_wins
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_REBUILD_SECONDS = float(os.getenv("LEADERBOARD_REBUILD_SECONDS", "600"))
+
+_MAX_LEVEL = 32
+
+
+@dataclass(frozen=True)
+class RankedUser:
+    user_id: int
+    username: str
+    wins: int
+    losses: int
+    draws: int
+    total_combats: int
+
+    @property
+    def score(self) -> int:
+        return (self.wins * 3) + self.draws
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.total_combats if self.total_combats > 0 else 0.0
+
+    @property
+    def rank(self) -> str:
+        return rank_for_wins(self.wins)
+
+    @property
+    def sort_key(self) -> Tuple:
+        return (-self.score, -self.wins, -self.win_rate, self.user_id)
+
+
+def _ranked_from_row(row) -> RankedUser:
+    return RankedUser(
+        user_id=row.id,
+        username=row.username,
+        wins=row.wins,
+        losses=row.losses,
+        draws=row.draws,
+        total_combats=row.total_combats,
+    )
+
+
+class _Node:
+    __slots__ = ("key", "value", "next", "width")
+
+    def __init__(self, key, value, level: int):
+        self.key = key
+        self.value = value
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+class IndexedSkipList:
+    """Sorted skip list with O(log n) insert, remove, rank-of and select-at"""
+
+    def __init__(self):
+        self._head = _Node(None, None, _MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def from_sorted(cls, items: Iterable[Tuple]) -> "IndexedSkipList":
+        """Build from (key, value) pairs already in key order, in O(n)"""
+        skiplist = cls()
+        tails = [skiplist._head] * _MAX_LEVEL
+        tail_positions = [0] * _MAX_LEVEL
+        position = 0
+        for key, value in items:
+            position += 1
+            level = cls._random_level()
+            node = _Node(key, value, level)
+            for i in range(level):
+                tails[i].next[i] = node
+                tails[i].width[i] = position - tail_positions[i]
+                tails[i] = node
+                tail_positions[i] = position
+            skiplist._level = max(skiplist._level, level)
+        # The last node on each level spans to the end
+        for i in range(skiplist._level):
+            tails[i].width[i] = position + 1 - tail_positions[i]
+        skiplist._size = position
+        return skiplist
+
+    @staticmethod
+    def _random_level() -> int:
+        level = 1
+        while level < _MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def _search(self, key):
+        """Rightmost node before `key` on every level, with its position"""
+        update = [self._head] * _MAX_LEVEL
+        positions = [0] * _MAX_LEVEL
+        node = self._head
+        position = 0
+        for level in range(self._level - 1, -1, -1):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            update[level] = node
+            positions[level] = position
+        return update, positions
+
+    def insert(self, key, value):
+        update, positions = self._search(key)
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                update[i] = self._head
+                positions[i] = 0
+                self._head.width[i] = self._size + 1
+            self._level = level
+
+        node = _Node(key, value, level)
+        position = positions[0] + 1
+        for i in range(level):
+            prev = update[i]
+            node.next[i] = prev.next[i]
+            prev.next[i] = node
+            # Split the previous span around the new node
+            node.width[i] = prev.width[i] - (position - positions[i]) + 1
+            prev.width[i] = position - positions[i]
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key) -> bool:
+        update, _ = self._search(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return False
+        for i in range(self._level):
+            if update[i].next[i] is node:
+                update[i].width[i] += node.width[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+
+    def index_of(self, key) -> Optional[int]:
+        """0-based position of `key`, or None if absent"""
+        update, positions = self._search(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return None
+        return positions[0]
+
+    def iter_from(self, index: int) -> Iterator:
+        """Values starting at 0-based `index`, in order"""
+        if index < 0 or index >= self._size:
+            return
+        node = self._head
+        remaining = index + 1
+        for level in range(self._level - 1, -1, -1):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        while node is not None:
+            yield node.value
+            node = node.next[0]
+
+
+def _build_views(rows) -> Tuple:
+    """(users, by_username, all, tiers) for the given user rows"""
+    # (sort key, user) pairs; keys are unique, so users are never compared.
+    # Rows arrive in leaderboard order, so the sort is one linear pass that
+    # only guards against float ties ordered differently by the database
+    ranked = [(user.sort_key, user) for user in map(_ranked_from_row, rows) if user.total_combats > 0]
+    ranked.sort()
+    by_tier = {name: [] for name, _ in RANK_TIERS}
+    for pair in ranked:
+        by_tier[pair[1].rank].append(pair)
+    return (
+        {user.user_id: user for _, user in ranked},
+        {user.username: user.user_id for _, user in ranked},
+        IndexedSkipList.from_sorted(ranked),
+        {name: IndexedSkipList.from_sorted(pairs) for name, pairs in by_tier.items()},
+    )
+
+
+class LeaderboardIndex:
+    """Global and per-tier ranked views over users with at least one combat"""
+
+    def __init__(self, session_factory, rebuild_seconds: float = LEADERBOARD_REBUILD_SECONDS):
+        self.session_factory = session_factory
+        self.rebuild_seconds = rebuild_seconds
+        self._users: Dict[int, RankedUser] = {}
+        self._by_username: Dict[str, int] = {}
+        self._all = IndexedSkipList()
+        self._tiers = {name: IndexedSkipList() for name, _ in RANK_TIERS}
+        self._task: Optional[asyncio.Task] = None
+        # Updates made while a rebuild is in flight, replayed onto its result
+        self._replay: Optional[List[RankedUser]] = None
+        # Metrics
+        self.updates = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+
+    def __len__(self) -> int:
+        return len(self._all)
+
+    def _remove(self, user_id: int):
+        current = self._users.pop(user_id, None)
+        if current is not None:
+            self._by_username.pop(current.username, None)
+            self._all.remove(current.sort_key)
+            self._tiers[current.rank].remove(current.sort_key)
+
+    def _insert(self, user: RankedUser):
+        if user.total_combats > 0:
+            self._users[user.user_id] = user
+            self._by_username[user.username] = user.user_id
+            self._all.insert(user.sort_key, user)
+            self._tiers[user.rank].insert(user.sort_key, user)
+
+    def upsert(self, user: RankedUser):
+        """Insert or move a user; users without combats are not ranked"""
+        self._remove(user.user_id)
+        self._insert(user)
+        if self._replay is not None:
+            self._replay.append(user)
+        self.updates += 1
+
+    def update_from_rows(self, rows: Iterable):
+        """Apply rows carrying id, username, wins, losses, draws, total_combats"""
+        for row in rows:
+            self.upsert(_ranked_from_row(row))
+
+    def rename(self, user_id: int, username: str):
+        current = self._users.get(user_id)
+        if current is not None and current.username != username:
+            self.upsert(RankedUser(
+                user_id=user_id,
+                username=username,
+                wins=current.wins,
+                losses=current.losses,
+                draws=current.draws,
+                total_combats=current.total_combats,
+            ))
+
+    def get(self, user_id: int) -> Optional[RankedUser]:
+        return self._users.get(user_id)
+
+    def get_by_username(self, username: str) -> Optional[RankedUser]:
+        user_id = self._by_username.get(username)
+        return self._users.get(user_id) if user_id is not None else None
+
+    def total(self, tier: Optional[str] = None) -> int:
+        view = self._view(tier)
+        return len(view) if view is not None else 0
+
+    def _view(self, tier: Optional[str]) -> Optional[IndexedSkipList]:
+        if tier is None:
+            return self._all
+        for name, skiplist in self._tiers.items():
+            if name.lower() == tier.lower():
+                return skiplist
+        return None
+
+    def top(self, limit: int, offset: int = 0, tier: Optional[str] = None) -> List[RankedUser]:
+        """Entries at 0-based positions [offset, offset + limit) of a view"""
+        view = self._view(tier)
+        if view is None or limit <= 0:
+            return []
+        entries = []
+        for user in view.iter_from(offset):
+            entries.append(user)
+            if len(entries) >= limit:
+                break
+        return entries
+
+    def position(self, user_id: int, tier: Optional[str] = None) -> Optional[int]:
+        """1-based leaderboard position of a user, or None if unranked"""
+        user = self._users.get(user_id)
+        view = self._view(tier)
+        if user is None or view is None:
+            return None
+        index = view.index_of(user.sort_key)
+        return index + 1 if index is not None else None
+
+    def neighbours(self, user_id: int, count: int, tier: Optional[str] = None) -> Tuple[List[RankedUser], List[RankedUser]]:
+        """Up to `count` entries directly above and below a user"""
+        position = self.position(user_id, tier)
+        if position is None:
+            return [], []
+        above_start = max(position - 1 - count, 0)
+        above = self.top(position - 1 - above_start, offset=above_start, tier=tier)
+        below = self.top(count, offset=position, tier=tier)
+        return above, below
+
+    async def rebuild(self):
+        """
+        Reload the whole index from the users table.
+        
+        The new views are built off the event loop and swapped in with no
+        await in between, so readers see either the old index or the new one.
+        """
+        started = time.perf_counter()
+        self._replay = []
+        try:
+            async with self.session_factory() as db:
+                rows = (await db.execute(
+                    select(User.id, User.username, User.wins, User.losses, User.draws, User.total_combats)
+                    .where(User.total_combats > 0)
+                    .order_by(User.points.desc(), User.wins.desc(), User.win_rate.desc(), User.id)
+                )).all()
+            views = await asyncio.to_thread(_build_views, rows)
+            self._users, self._by_username, self._all, self._tiers = views
+            # The rows may predate updates applied while they were loaded
+            for user in self._replay:
+                self._remove(user.user_id)
+                self._insert(user)
+        finally:
+            self._replay = None
+        self.rebuilds += 1
+        self.last_rebuild_ms = (time.perf_counter() - started) * 1000
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.rebuild_seconds)
+            try:
+                await self.rebuild()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Leaderboard rebuild failed")
+
+    async def start(self):
+        """Build from the database and start the periodic re-sync"""
+        if self._task is not None:
+            return
+        await self.rebuild()
+        if self.rebuild_seconds > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def to_dict(self) -> dict:
+        return {
+            "users": len(self._all),
+            "tiers": {name: len(skiplist) for name, skiplist in self._tiers.items()},
+            "updates": self.updates,
+            "rebuilds": self.rebuilds,
+            "lastRebuildMs": round(self.last_rebuild_ms, 2),
+        }
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Load test: N concurrent pollers against GET /api/combats/{code}.
+
+Mimics the frontend lobby, which polls combat status every 2 seconds per
+open tab, and reports latency percentiles. Run it against a server started
+from this tree and from a tree with the old sync handlers to compare p99.
+
+Usage:
+    python loadtest.py --code ABC123 --pollers 500 --duration 30
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from metrics import percentile
+
+
+async def poller(client, url, interval, deadline, latencies, errors):
+    """Poll a URL at a fixed interval until the deadline, recording latency"""
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.get(url)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+async def run(base_url, code, pollers, duration, interval):
+    latencies = []
+    errors = []
+    url = f"{base_url}/api/combats/{code}"
+    limits = httpx.Limits(max_connections=pollers, max_keepalive_connections=pollers)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[
+            poller(client, url, interval, deadline, latencies, errors)
+            for _ in range(pollers)
+        ])
+
+    if not latencies:
+        print("No requests completed")
+        return
+
+    print(f"Pollers:  {pollers}  (every {interval}s for {duration}s)")
+    print(f"Requests: {len(latencies)}  errors: {len(errors)}")
+    print(f"p50: {percentile(latencies, 50):.1f} ms")
+    print(f"p95: {percentile(latencies, 95):.1f} ms")
+    print(f"p99: {percentile(latencies, 99):.1f} ms")
+    print(f"max: {max(latencies):.1f} ms  mean: {statistics.mean(latencies):.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Combat status polling load test")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--code", required=True, help="Combat code to poll")
+    parser.add_argument("--pollers", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--interval", type=float, default=2.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.base_url, args.code, args.pollers, args.duration, args.interval))
+
+
+if __name__ == "__main__":
+    main()
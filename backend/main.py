@@ -1,30 +1,55 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, insert, func, case, literal, exists, or_
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 from typing import List, Optional
+import asyncio
 import uuid
 import os
-import random
+import secrets
+import logging
 import json
 
-from database import get_db
+from database import get_db, run_serialized_write, write_metrics, AsyncSessionLocal, DATABASE_URL, async_engine
 from models import User, Combat, ApiKey, Question, Submission, CombatState, SubmissionStatus, CombatQuestion, TempApiKey
 from schemas import (
     CreateCombatRequest, CreateCombatResponse,
     AcceptCombatRequest, AcceptCombatResponse,
     CombatStatusResponse, IssueKeysResponse,
     AgentMeResponse, AgentSubmitResponse, AgentResultResponse,
-    SubmitAnswerRequest, HealthResponse,
+    SubmitAnswerRequest, AgentWebhookRequest, AgentWebhookResponse, HealthResponse,
     QuestionResponse, AdminCombatResponse,
-    UserProfileResponse, LeaderboardEntryResponse, LeaderboardResponse,
+    UserProfileResponse, LeaderboardEntryResponse, LeaderboardResponse, UserRankResponse,
     CombatResultResponse, RegisterRequest, AuthUserResponse, UpdateUsernameRequest
 )
 from auth import generate_combat_code, generate_api_token, hash_token
-from middleware import verify_admin_token, get_current_user_from_token
-from firebase_auth import get_current_firebase_user, get_optional_firebase_user, get_firebase_user_record
+from middleware import verify_admin_token, get_current_user_from_token, get_current_identity, resolve_api_key
+from firebase_auth import get_current_firebase_user, get_optional_firebase_user, get_firebase_user_record, token_verifier, firebase_auth_metrics
 from hf_datasets import question_service, verify_answer
+from repository import CombatSnapshot, UserIdentity, LeaderboardCursor, load_combat_snapshot, load_leaderboard_page, count_ranked_users
+from scheduler import DeadlineScheduler, claim_expired_combats
+from reaper import CombatReaper
+from leaderboard import LeaderboardIndex, RankedUser
+from period_stats import (
+    LEADERBOARD_WINDOWS, ALL_MODES,
+    check_upsert_support, record_combat_result, load_period_leaderboard_page, count_period_users, rebuild_period_stats
+)
+from models import QUESTION_MODES, RANK_TIERS
+from cache import api_key_cache, combat_state_cache, cache_metrics, invalidate_identities, identity_cache
+from combat_feeds import CombatFeedHub
+from agent_channel import AgentChannel
+from event_bus import CombatEvent, CombatEventType, create_event_bus
+from webhooks import WebhookDispatcher, CallbackTargetError, is_valid_callback_url, resolve_callback_target
+from question_pool import QuestionPool
+from question_bank import open_banks
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from question_sampler import QuestionSampler
+from seen_filter import ParticipantsSeen, SEEN_MAX_ATTEMPTS, question_key, legacy_question_key, seen_metrics
 
 app = FastAPI(title="Agent Fight Club API")
 
@@ -38,15 +63,26 @@ app.add_middleware(
 )
 
 TIME_LIMIT_SECONDS = int(os.getenv("TIME_LIMIT_SECONDS", "180"))
+LEADERBOARD_MAX_PAGE_SIZE = 500
+# Longest ?wait= accepted by the long-polling agent endpoints
+AGENT_LONG_POLL_MAX_SECONDS = float(os.getenv("AGENT_LONG_POLL_MAX_SECONDS", "60"))
 BASE_URL = os.getenv("BASE_URL", "http://localhost:3000")
+# HuggingFace question fetch: per-call budget and circuit breaker tuning
+HF_TIMEOUT_SECONDS = float(os.getenv("HF_TIMEOUT_SECONDS", "3"))
+HF_BREAKER_ERROR_RATE = float(os.getenv("HF_BREAKER_ERROR_RATE", "0.5"))
+HF_BREAKER_MIN_CALLS = int(os.getenv("HF_BREAKER_MIN_CALLS", "5"))
+HF_BREAKER_WINDOW_SECONDS = float(os.getenv("HF_BREAKER_WINDOW_SECONDS", "60"))
+HF_BREAKER_OPEN_SECONDS = float(os.getenv("HF_BREAKER_OPEN_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
 
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
 
-def get_or_create_user_from_firebase(firebase_user: dict, db: Session) -> User:
+async def get_or_create_user_from_firebase(firebase_user: dict, db: AsyncSession) -> User:
     """Get existing user or create new one from Firebase auth."""
-    user = db.query(User).filter(User.firebase_uid == firebase_user["uid"]).first()
+    user = await db.scalar(select(User).where(User.firebase_uid == firebase_user["uid"]))
     if user:
         return user
     return None  # User needs to register with a handle first
@@ -74,10 +110,13 @@ def check_answer_correct(submission_answer: str, golden_label: str) -> bool:
     # Fallback to direct string comparison (old format)
     return normalize_answer(submission_answer) == normalize_answer(golden_label)
 
-def check_answer_correct_hashed(submission_answer: str, answer_hash: str, combat_id: str) -> bool:
+def check_answer_correct_hashed(submission_answer: str, answer_hash: str, combat_id: str, salt: Optional[int] = None) -> bool:
     """Check if submission answer matches using secure hash verification"""
     if not submission_answer or not answer_hash:
         return False
+    if salt is not None:
+        # Pre-fetched questions are hashed with their own salt
+        return verify_answer(submission_answer, answer_hash, salt)
     # Convert combat_id to int for hash verification
     try:
         uuid_int = int(uuid.UUID(combat_id).int)
@@ -86,7 +125,13 @@ def check_answer_correct_hashed(submission_answer: str, answer_hash: str, combat
         combat_id_int = hash(combat_id) % (10**9)
     return verify_answer(submission_answer, answer_hash, combat_id_int)
 
-def determine_winner_and_update_stats(combat: Combat, db: Session):
+async def get_legacy_question(combat: Combat, db: AsyncSession) -> Optional[Question]:
+    """Load the legacy Question for a combat (AsyncSession cannot lazy-load combat.question)"""
+    if not combat.question_id:
+        return None
+    return await db.get(Question, combat.question_id)
+
+async def determine_winner_and_update_stats(combat: Combat, db: AsyncSession):
     """
     Determine the winner of a combat and update user stats.
     Winner is determined by:
@@ -94,79 +139,169 @@ def determine_winner_and_update_stats(combat: Combat, db: Session):
     2. If both correct, earlier submission wins
     3. If neither correct, it's a draw
     4. If only one submitted, that person wins if correct, otherwise draw
+    
+    The outcome is claimed with a conditional UPDATE on the combat and the
+    counters are incremented in SQL (wins = wins + 1), in one transaction, so
+    concurrent completions that share a player never lose updates and a
+    combat is never scored twice.
     """
-    if combat.winner_id is not None or combat.is_draw:
+    snapshot = await load_combat_snapshot(db, combat.code)
+    if not snapshot or snapshot.winner_id is not None or snapshot.is_draw:
         # Already determined
         return
-    
-    user_a = db.query(User).filter(User.id == combat.user_a_id).first()
-    user_b = db.query(User).filter(User.id == combat.user_b_id).first()
-    
-    if not user_a or not user_b:
+    if not snapshot.user_a_id or not snapshot.user_b_id:
         return
     
-    # Check for new HF-based combat question first
-    combat_question = db.query(CombatQuestion).filter(CombatQuestion.combat_id == combat.id).first()
-    
-    sub_a = db.query(Submission).filter(
-        Submission.combat_id == combat.id,
-        Submission.user_id == combat.user_a_id
-    ).first()
-    
-    sub_b = db.query(Submission).filter(
-        Submission.combat_id == combat.id,
-        Submission.user_id == combat.user_b_id
-    ).first()
+    winner_id = resolve_winner(snapshot)
+    # Every worker updates its identity cache and leaderboard index from the
+    # players' counters carried by the COMPLETED / EXPIRED event
+    await run_serialized_write(db, lambda: _apply_winner_and_stats(snapshot, winner_id, db))
+
+def resolve_winner(snapshot: CombatSnapshot) -> Optional[int]:
+    """Winning user id for a finished combat, or None for a draw"""
+    sub_a = snapshot.submission_for(snapshot.user_a_id)
+    sub_b = snapshot.submission_for(snapshot.user_b_id)
     
-    if combat_question:
+    if snapshot.has_combat_question:
         # Use secure hash verification for HF questions
-        a_correct = sub_a and check_answer_correct_hashed(sub_a.answer, combat_question.answer_key_hash, combat.id)
-        b_correct = sub_b and check_answer_correct_hashed(sub_b.answer, combat_question.answer_key_hash, combat.id)
+        a_correct = sub_a and check_answer_correct_hashed(sub_a.answer, snapshot.answer_key_hash, snapshot.id, snapshot.answer_salt)
+        b_correct = sub_b and check_answer_correct_hashed(sub_b.answer, snapshot.answer_key_hash, snapshot.id, snapshot.answer_salt)
     else:
         # Legacy: use golden_label from old Question table
-        golden_label = combat.question.golden_label if combat.question else ""
+        golden_label = snapshot.golden_label or ""
         a_correct = sub_a and check_answer_correct(sub_a.answer, golden_label)
         b_correct = sub_b and check_answer_correct(sub_b.answer, golden_label)
     
-    winner = None
-    is_draw = False
-    
     if a_correct and b_correct:
         # Both correct - earlier submission wins
         if sub_a.submitted_at <= sub_b.submitted_at:
-            winner = user_a
-        else:
-            winner = user_b
+            return snapshot.user_a_id
+        return snapshot.user_b_id
     elif a_correct and not b_correct:
-        winner = user_a
+        return snapshot.user_a_id
     elif b_correct and not a_correct:
-        winner = user_b
-    else:
-        # Neither correct - it's a draw
-        is_draw = True
-    
-    # Update combat
-    if winner:
-        combat.winner_id = winner.id
-        combat.is_draw = 0
-    else:
-        combat.is_draw = 1
-    
-    # Update user stats
-    user_a.total_combats += 1
-    user_b.total_combats += 1
-    
-    if is_draw:
-        user_a.draws += 1
-        user_b.draws += 1
-    elif winner.id == user_a.id:
-        user_a.wins += 1
-        user_b.losses += 1
-    else:
-        user_b.wins += 1
-        user_a.losses += 1
+        return snapshot.user_b_id
+    # Neither correct - it's a draw
+    return None
+
+async def _apply_winner_and_stats(snapshot: CombatSnapshot, winner_id: Optional[int], db: AsyncSession):
+    """
+    Write half of determine_winner_and_update_stats (committed by the caller).
     
-    db.commit()
+    Returns both players' updated counters, or None if the combat had
+    already been scored.
+    """
+    is_draw = winner_id is None
+    
+    # Claim the outcome - only the first writer for this combat gets a row back
+    claimed = await db.execute(
+        update(Combat)
+        .where(
+            Combat.id == snapshot.id,
+            Combat.state.in_([CombatState.COMPLETED, CombatState.EXPIRED]),
+            Combat.winner_id.is_(None),
+            Combat.is_draw == 0
+        )
+        .values(winner_id=winner_id, is_draw=1 if is_draw else 0)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount == 0:
+        return None
+    
+    # Update user stats - both players in one set-based statement
+    loser_id = None
+    if not is_draw:
+        loser_id = snapshot.user_b_id if winner_id == snapshot.user_a_id else snapshot.user_a_id
+    updated = await db.execute(
+        update(User)
+        .where(User.id.in_([snapshot.user_a_id, snapshot.user_b_id]))
+        .values(
+            total_combats=User.total_combats + 1,
+            wins=User.wins + case((User.id == winner_id, 1), else_=0),
+            losses=User.losses + case((User.id == loser_id, 1), else_=0),
+            draws=User.draws + (1 if is_draw else 0)
+        )
+        .returning(User.id, User.username, User.wins, User.losses, User.draws, User.total_combats)
+        .execution_options(synchronize_session=False)
+    )
+    rows = updated.all()
+    
+    # The finished state is announced once the outcome is final, with both
+    # players' new counters for every worker's leaderboard index
+    await combat_bus.emit(db, CombatEvent(
+        CombatEventType.EXPIRED if snapshot.state == CombatState.EXPIRED else CombatEventType.COMPLETED,
+        snapshot.id, snapshot.code, snapshot.state.value,
+        data={"users": [dict(row._mapping) for row in rows]}
+    ))
+    
+    # Weekly / monthly / per-mode buckets, in the same transaction
+    await record_combat_result(
+        db,
+        (snapshot.user_a_id, snapshot.user_b_id),
+        winner_id,
+        snapshot.question_mode or "formal_logic",
+        snapshot.completed_at or datetime.utcnow()
+    )
+    return rows
+
+async def score_combats(db: AsyncSession, combat_ids: List[str]):
+    """Determine winners for combats that have just finished"""
+    for combat_id in combat_ids:
+        combat = await db.get(Combat, combat_id)
+        if combat:
+            await determine_winner_and_update_stats(combat, db)
+
+# Expires RUNNING combats at their deadline and scores them off the request path
+deadline_scheduler = DeadlineScheduler(AsyncSessionLocal, on_expired=score_combats)
+
+# Ranked view of all users with combats, kept current as combats are scored
+leaderboard_index = LeaderboardIndex(AsyncSessionLocal)
+
+# Combat state changes, delivered to every worker after commit
+combat_bus = create_event_bus(DATABASE_URL)
+
+# Expires abandoned lobbies, deletes stale temp keys, revokes finished combats' keys
+combat_reaper = CombatReaper(AsyncSessionLocal, combat_bus)
+
+# Offline snapshots (question_bank.py build); modes without one use HF
+question_banks = open_banks()
+
+# Fails fast while HF is slow or down, so callers fall back right away
+hf_breaker = CircuitBreaker(
+    "huggingface",
+    timeout_seconds=HF_TIMEOUT_SECONDS,
+    error_rate=HF_BREAKER_ERROR_RATE,
+    min_calls=HF_BREAKER_MIN_CALLS,
+    window_seconds=HF_BREAKER_WINDOW_SECONDS,
+    open_seconds=HF_BREAKER_OPEN_SECONDS
+)
+
+def bank_question(mode: str):
+    """(normalized question, answer hash, salt) from the local bank, or None without one"""
+    bank = question_banks.get(mode)
+    if bank is not None and len(bank):
+        return bank.random()
+    return None
+
+async def fetch_question(mode: str):
+    """
+    (normalized question, answer hash, salt) from the local bank, else from
+    HF through hf_breaker - which raises CircuitOpenError / CircuitTimeoutError.
+    """
+    local = bank_question(mode)
+    if local is not None:
+        return local
+    salt = secrets.randbelow(10**9)
+    normalized_question, answer_hash = await hf_breaker.call(
+        question_service.create_combat_question, combat_id=salt, mode=mode
+    )
+    return normalized_question, answer_hash, salt
+
+# Legacy fallback: random Question id without loading the table
+question_sampler = QuestionSampler()
+
+# Ready-made questions per mode, so issuing keys doesn't wait on a fetch
+question_pool = QuestionPool(fetch_question)
 
 # ============================================================================
 # AUTH API
@@ -176,27 +311,29 @@ def determine_winner_and_update_stats(combat: Combat, db: Session):
 async def register_user(
     request: RegisterRequest,
     firebase_user: dict = Depends(get_current_firebase_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Register/update username for authenticated Firebase user."""
-    user = db.query(User).filter(User.firebase_uid == firebase_user["uid"]).first()
+    user = await db.scalar(select(User).where(User.firebase_uid == firebase_user["uid"]))
     
     if user:
         # User exists, update username if provided and different
         if request.username and request.username != user.username:
             # Check if new username is taken by another user
-            username_taken = db.query(User).filter(
+            username_taken = await db.scalar(select(User).where(
                 User.username == request.username,
                 User.id != user.id
-            ).first()
+            ))
             if username_taken:
                 raise HTTPException(status_code=400, detail="Username already taken")
             user.username = request.username
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            await db.refresh(user)
+            invalidate_identities(user.id)
+            leaderboard_index.rename(user.id, user.username)
     else:
         # Check if username is taken
-        username_taken = db.query(User).filter(User.username == request.username).first()
+        username_taken = await db.scalar(select(User).where(User.username == request.username))
         if username_taken:
             raise HTTPException(status_code=400, detail="Username already taken")
         
@@ -207,8 +344,8 @@ async def register_user(
             username=request.username
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     
     return AuthUserResponse(
         id=user.id,
@@ -226,20 +363,22 @@ async def register_user(
 @app.get("/api/auth/me", response_model=AuthUserResponse)
 async def get_current_user(
     firebase_user: dict = Depends(get_current_firebase_user),
-    db: Session = Depends(get_db)
+    identity: Optional[UserIdentity] = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get current authenticated user's profile. Returns 404 if user doesn't exist."""
-    # First try to find by firebase_uid
-    user = db.query(User).filter(User.firebase_uid == firebase_user["uid"]).first()
+    # First try to find by firebase_uid (cached)
+    user = identity
     
     # If not found by firebase_uid, try by email
     if not user and firebase_user.get("email"):
-        user = db.query(User).filter(User.email == firebase_user["email"]).first()
+        user = await db.scalar(select(User).where(User.email == firebase_user["email"]))
         if user:
             # Update the firebase_uid for this existing user
             user.firebase_uid = firebase_user["uid"]
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            await db.refresh(user)
+            invalidate_identities(user.id)
     
     # If user doesn't exist, return 404 - they need to register with a username
     if not user:
@@ -261,28 +400,29 @@ async def get_current_user(
 @app.put("/api/auth/username", response_model=AuthUserResponse)
 async def update_username(
     request: UpdateUsernameRequest,
-    firebase_user: dict = Depends(get_current_firebase_user),
-    db: Session = Depends(get_db)
+    identity: Optional[UserIdentity] = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update the current user's username."""
-    user = db.query(User).filter(User.firebase_uid == firebase_user["uid"]).first()
-    
-    if not user:
+    if not identity:
         raise HTTPException(status_code=404, detail="User not found")
+    user = await db.get(User, identity.id)
     
     # Check if username is already taken by another user
-    existing = db.query(User).filter(
+    existing = await db.scalar(select(User).where(
         User.username == request.username,
         User.id != user.id
-    ).first()
+    ))
     
     if existing:
         raise HTTPException(status_code=400, detail="Username already taken")
     
     # Update username
     user.username = request.username
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    identity_cache.invalidate(identity.firebase_uid)
+    leaderboard_index.rename(user.id, user.username)
     
     return AuthUserResponse(
         id=user.id,
@@ -298,9 +438,9 @@ async def update_username(
     )
 
 @app.get("/api/auth/check-username/{username}")
-async def check_username_available(username: str, db: Session = Depends(get_db)):
+async def check_username_available(username: str, db: AsyncSession = Depends(get_db)):
     """Check if a username is available."""
-    existing = db.query(User).filter(User.username == username).first()
+    existing = await db.scalar(select(User).where(User.username == username))
     return {"available": existing is None}
 
 # ============================================================================
@@ -310,11 +450,10 @@ async def check_username_available(username: str, db: Session = Depends(get_db))
 @app.post("/api/combats", response_model=CreateCombatResponse)
 async def create_combat(
     request: CreateCombatRequest = CreateCombatRequest(),
-    firebase_user: dict = Depends(get_current_firebase_user),
-    db: Session = Depends(get_db)
+    user: Optional[UserIdentity] = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new combat (requires authentication)"""
-    user = db.query(User).filter(User.firebase_uid == firebase_user["uid"]).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not registered. Please register first.")
     
@@ -324,7 +463,7 @@ async def create_combat(
     # Generate unique combat code
     while True:
         code = generate_combat_code()
-        existing = db.query(Combat).filter(Combat.code == code).first()
+        existing = await db.scalar(select(Combat).where(Combat.code == code))
         if not existing:
             break
     
@@ -337,7 +476,7 @@ async def create_combat(
         question_mode=mode
     )
     db.add(combat)
-    db.commit()
+    await db.commit()
     
     invite_url = f"{BASE_URL}/accept/{code}"
     
@@ -350,191 +489,315 @@ async def create_combat(
 @app.post("/api/combats/{code}/accept", response_model=AcceptCombatResponse)
 async def accept_combat(
     code: str,
-    firebase_user: dict = Depends(get_current_firebase_user),
-    db: Session = Depends(get_db)
+    user: Optional[UserIdentity] = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
     """Accept a combat invitation (requires authentication)"""
-    combat = db.query(Combat).filter(Combat.code == code).first()
-    if not combat:
-        raise HTTPException(status_code=404, detail="Combat not found")
-    
-    if combat.state != CombatState.CREATED:
-        raise HTTPException(status_code=400, detail="Combat already accepted or started")
-    
-    # Get authenticated user
-    user = db.query(User).filter(User.firebase_uid == firebase_user["uid"]).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not registered. Please register first.")
     
-    # Check if user is trying to accept their own combat
-    if user.id == combat.user_a_id:
-        raise HTTPException(status_code=400, detail="Cannot accept your own combat")
+    # CREATED -> ACCEPTED in one conditional UPDATE; the row count decides the race
+    accepted = (await db.execute(
+        update(Combat)
+        .where(
+            Combat.code == code,
+            Combat.state == CombatState.CREATED,
+            Combat.user_a_id != user.id
+        )
+        .values(
+            user_b_id=user.id,
+            state=CombatState.ACCEPTED,
+            accepted_at=datetime.utcnow()
+        )
+        .returning(Combat.id)
+    )).first()
+    if accepted:
+        await combat_bus.emit(db, CombatEvent(
+            CombatEventType.ACCEPTED, accepted.id, code, CombatState.ACCEPTED.value, user_id=user.id
+        ))
+    await db.commit()
     
-    combat.user_b_id = user.id
-    combat.state = CombatState.ACCEPTED
-    combat.accepted_at = datetime.utcnow()
-    db.commit()
+    if accepted:
+        combat_state_cache.invalidate(accepted.id)
+    else:
+        combat = await db.scalar(select(Combat).where(Combat.code == code))
+        if not combat:
+            raise HTTPException(status_code=404, detail="Combat not found")
+        if combat.state != CombatState.CREATED:
+            raise HTTPException(status_code=400, detail="Combat already accepted or started")
+        raise HTTPException(status_code=400, detail="Cannot accept your own combat")
     
     return AcceptCombatResponse(
-        combatId=combat.id,
-        state=combat.state
+        combatId=accepted.id,
+        state=CombatState.ACCEPTED
     )
 
 @app.get("/api/combats/{code}", response_model=CombatStatusResponse)
-def get_combat_status(code: str, db: Session = Depends(get_db)):
+async def get_combat_status(
+    code: str,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db)
+):
     """Get combat status"""
-    combat = db.query(Combat).filter(Combat.code == code).first()
-    if not combat:
+    snapshot = await load_combat_snapshot(db, code)
+    if not snapshot:
         raise HTTPException(status_code=404, detail="Combat not found")
     
-    user_a = db.query(User).filter(User.id == combat.user_a_id).first()
-    user_b = db.query(User).filter(User.id == combat.user_b_id).first() if combat.user_b_id else None
-    
-    if combat.state == CombatState.RUNNING and combat.expires_at:
-        if datetime.utcnow() > combat.expires_at:
-            combat.state = CombatState.EXPIRED
-            combat.completed_at = datetime.utcnow()
-            db.commit()
-            # Determine winner on expiration
-            db.refresh(combat)
-            determine_winner_and_update_stats(combat, db)
-    
+    if snapshot.state == CombatState.RUNNING and snapshot.expires_at:
+        now = datetime.utcnow()
+        if now > snapshot.expires_at:
+            # The scheduler normally gets here first; if not, claim the expiry
+            # now and score it after the response is sent
+            claimed = await claim_expired_combats(db, now, limit=1, combat_id=snapshot.id)
+            if claimed:
+                background_tasks.add_task(deadline_scheduler.score, claimed)
+            snapshot = await load_combat_snapshot(db, code)
+    
+    return combat_status_response(snapshot)
+
+def combat_status_response(snapshot: CombatSnapshot) -> CombatStatusResponse:
+    """Public status view of a combat, as polled by the lobby and dashboard"""
     countdown_seconds = None
-    if combat.expires_at:
-        remaining = (combat.expires_at - datetime.utcnow()).total_seconds()
+    if snapshot.expires_at:
+        remaining = (snapshot.expires_at - datetime.utcnow()).total_seconds()
         countdown_seconds = max(0, int(remaining))
     
     question_data = None
-    if combat.state in [CombatState.RUNNING, CombatState.COMPLETED, CombatState.EXPIRED]:
-        # Check for new HF-based combat question first
-        combat_question = db.query(CombatQuestion).filter(CombatQuestion.combat_id == combat.id).first()
-        if combat_question:
-            question_data = {
-                "prompt": combat_question.prompt,
-                "choices": json.loads(combat_question.choices_json)
-            }
-        elif combat.question:
-            # Legacy format - parse JSON golden_label for choices
-            question_data = {"prompt": combat.question.prompt}
-            try:
-                label_data = json.loads(combat.question.golden_label)
-                if isinstance(label_data, dict) and "choices" in label_data:
-                    question_data["choices"] = label_data["choices"]
-            except (json.JSONDecodeError, TypeError):
-                pass
-    
     submissions_status = None
-    if combat.state in [CombatState.RUNNING, CombatState.COMPLETED, CombatState.EXPIRED]:
-        submissions = db.query(Submission).filter(Submission.combat_id == combat.id).all()
+    if snapshot.state in [CombatState.RUNNING, CombatState.COMPLETED, CombatState.EXPIRED]:
+        question_data = snapshot.question_payload()
+        
         submissions_status = {}
-        for sub in submissions:
-            user = db.query(User).filter(User.id == sub.user_id).first()
-            if user:
-                submissions_status[user.username] = sub.status.value
+        for sub in snapshot.submissions:
+            username = snapshot.username_for(sub.user_id)
+            if username:
+                submissions_status[username] = sub.status.value
         
-        if combat.user_a_id and user_a.username not in submissions_status:
-            submissions_status[user_a.username] = "timeout"
-        if combat.user_b_id and user_b and user_b.username not in submissions_status:
-            submissions_status[user_b.username] = "timeout"
+        if snapshot.user_a_username and snapshot.user_a_username not in submissions_status:
+            submissions_status[snapshot.user_a_username] = "timeout"
+        if snapshot.user_b_username and snapshot.user_b_username not in submissions_status:
+            submissions_status[snapshot.user_b_username] = "timeout"
     
     return CombatStatusResponse(
-        combatId=combat.id,
-        code=combat.code,
-        state=combat.state,
-        mode=getattr(combat, 'question_mode', 'formal_logic') or 'formal_logic',
+        combatId=snapshot.id,
+        code=snapshot.code,
+        state=snapshot.state,
+        mode=snapshot.question_mode,
         countdownSeconds=countdown_seconds,
         question=question_data,
         submissionsStatus=submissions_status,
-        userAUsername=user_a.username if user_a else None,
-        userBUsername=user_b.username if user_b else None,
-        userAReady=bool(combat.user_a_ready),
-        userBReady=bool(combat.user_b_ready),
-        createdAt=combat.created_at,
-        acceptedAt=combat.accepted_at,
-        startedAt=combat.started_at,
-        completedAt=combat.completed_at
+        userAUsername=snapshot.user_a_username,
+        userBUsername=snapshot.user_b_username,
+        userAReady=snapshot.user_a_ready,
+        userBReady=snapshot.user_b_ready,
+        createdAt=snapshot.created_at,
+        acceptedAt=snapshot.accepted_at,
+        startedAt=snapshot.started_at,
+        completedAt=snapshot.completed_at
     )
 
-@app.post("/api/combats/{code}/keys", response_model=IssueKeysResponse)
-def issue_api_keys(code: str, db: Session = Depends(get_db)):
-    """Issue API keys for both users (starts the combat)"""
-    combat = db.query(Combat).filter(Combat.code == code).first()
-    if not combat:
+async def render_combat_status(db: AsyncSession, code: str) -> Optional[dict]:
+    """JSON-ready combat status for the event stream, or None if not found"""
+    snapshot = await load_combat_snapshot(db, code)
+    if not snapshot:
+        return None
+    return combat_status_response(snapshot).model_dump(mode="json")
+
+# Live status streams; one reload per change per followed combat
+combat_feeds = CombatFeedHub(AsyncSessionLocal, render_combat_status)
+
+def on_combat_event(event: CombatEvent):
+    """Every worker: drop the cached state and wake the combat's feed"""
+    if event.type == CombatEventType.KEYS_REVOKED:
+        # The combat's state is unchanged; only its key lookups are stale
+        for token_hash in event.data["token_hashes"]:
+            api_key_cache.invalidate(token_hash)
+        return
+    combat_state_cache.invalidate(event.combat_id)
+    if event.data and "users" in event.data:
+        # A scored combat: both players' counters changed
+        users = [SimpleNamespace(**user) for user in event.data["users"]]
+        invalidate_identities(*(user.id for user in users))
+        leaderboard_index.update_from_rows(users)
+    combat_feeds.publish(event.code, event.type.value)
+
+combat_bus.add_listener(on_combat_event)
+
+@app.get("/api/combats/{code}/events")
+async def combat_status_events(code: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events stream of a combat's status: a full snapshot on
+    connect, then only the changed fields on accept, keys issued, ready,
+    start, submission and completion. Reconnects with Last-Event-ID resume
+    where they left off.
+    """
+    opened = await combat_feeds.open(code, last_event_id)
+    if opened is None:
         raise HTTPException(status_code=404, detail="Combat not found")
-    
-    if combat.state != CombatState.ACCEPTED:
-        raise HTTPException(status_code=400, detail="Combat must be accepted first")
-    
-    existing_keys = db.query(ApiKey).filter(ApiKey.combat_id == combat.id).count()
-    if existing_keys:
-        raise HTTPException(status_code=400, detail="API keys already issued")
-    
+    subscription, initial = opened
+    return StreamingResponse(
+        combat_feeds.stream(subscription, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _issue_claimed_keys(db: AsyncSession, claimed, code: str):
+    """Keys, question and deadline for a combat claimed as KEYS_ISSUED; committed"""
     token_a = generate_api_token()
     token_b = generate_api_token()
     api_key_a = ApiKey(
-        combat_id=combat.id,
-        user_id=combat.user_a_id,
+        combat_id=claimed.id,
+        user_id=claimed.user_a_id,
         token_hash=hash_token(token_a)
     )
     api_key_b = ApiKey(
-        combat_id=combat.id,
-        user_id=combat.user_b_id,
+        combat_id=claimed.id,
+        user_id=claimed.user_b_id,
         token_hash=hash_token(token_b)
     )
     db.add(api_key_a)
     db.add(api_key_b)
     
+    question_id = None
+    # Questions either player has already had are skipped (one query, no history scan)
+    seen = await ParticipantsSeen.load(db, (claimed.user_a_id, claimed.user_b_id))
+    
     # Fetch question from HuggingFace datasets
     try:
-        # Get combat_id as int for hashing
-        combat_id_int = int(uuid.UUID(combat.id).int % (10**9))
-        mode = getattr(combat, 'question_mode', 'formal_logic') or 'formal_logic'
-        
-        normalized_question, answer_hash = question_service.create_combat_question(
-            combat_id=combat_id_int,
-            mode=mode
-        )
+        mode = claimed.question_mode or 'formal_logic'
+        fetched = False
+        # Pooled questions these players have seen, held until the loop ends so
+        # each is popped at most once here
+        rejected = []
+        served = None
+        try:
+            for _ in range(SEEN_MAX_ATTEMPTS):
+                pooled = question_pool.pop(mode)
+                if pooled is not None:
+                    candidate = (pooled.question, pooled.answer_hash, pooled.salt)
+                elif not fetched:
+                    # Pool empty (cold start, HF down): fetch inline, within the HF
+                    # breaker's timeout budget - once per request
+                    candidate = await fetch_question(mode)
+                    fetched = True
+                else:
+                    local = bank_question(mode)
+                    if local is None:
+                        # Another HF round trip would only stretch this request
+                        seen_metrics.repeats_served += 1
+                        break
+                    candidate = local
+                if not seen.seen(question_key(candidate[0])):
+                    break
+                if pooled is not None:
+                    rejected.append((candidate, pooled))
+            else:
+                seen_metrics.repeats_served += 1
+            served = candidate
+        finally:
+            # Still new to other players - unless served here after all
+            for tried, pooled in rejected:
+                if tried is not served:
+                    question_pool.push_back(mode, pooled)
+        normalized_question, answer_hash, answer_salt = candidate
+        seen_key = question_key(normalized_question)
         
         # Store the combat question metadata
         combat_question = CombatQuestion(
-            combat_id=combat.id,
+            combat_id=claimed.id,
             dataset=normalized_question.dataset,
             config=normalized_question.config,
             split=normalized_question.split,
             row_offset=normalized_question.row_offset,
             prompt=normalized_question.prompt,
             choices_json=json.dumps(normalized_question.choices),
-            answer_key_hash=answer_hash
+            answer_key_hash=answer_hash,
+            answer_salt=answer_salt
         )
         db.add(combat_question)
         
     except Exception as e:
-        # Fallback to legacy local questions if HF fails
-        print(f"HF question fetch failed: {e}, falling back to local questions")
-        questions = db.query(Question).all()
-        if not questions:
+        # Fallback to legacy local questions if HF fails or its breaker is open
+        if isinstance(e, CircuitOpenError):
+            logger.debug("HF circuit open, using local questions")
+        else:
+            logger.warning("HF question fetch failed (%s), falling back to local questions", e)
+        for _ in range(SEEN_MAX_ATTEMPTS):
+            question_id = await question_sampler.pick(db)
+            if question_id is None or not seen.seen(legacy_question_key(question_id)):
+                break
+        else:
+            seen_metrics.repeats_served += 1
+        seen_key = legacy_question_key(question_id) if question_id is not None else None
+        if question_id is None:
             raise HTTPException(status_code=500, detail=f"No questions available: {str(e)}")
-        question = random.choice(questions)
-        combat.question_id = question.id
     
-    # Start combat
-    combat.state = CombatState.RUNNING
-    combat.started_at = datetime.utcnow()
-    combat.expires_at = datetime.utcnow() + timedelta(seconds=TIME_LIMIT_SECONDS)
+    await seen.mark(db, seen_key)
     
     # Store temporary plaintext keys for retrieval by both users
     temp_keys = TempApiKey(
-        combat_id=combat.id,
+        combat_id=claimed.id,
         key_a=token_a,
         key_b=token_b,
         expires_at=datetime.utcnow() + timedelta(minutes=5)  # Keys expire in 5 minutes
     )
     db.add(temp_keys)
     
-    # Set state to KEYS_ISSUED - waiting for both users to be ready
-    combat.state = CombatState.KEYS_ISSUED
+    # State stays KEYS_ISSUED - waiting for both users to be ready
+    values = {
+        "started_at": datetime.utcnow(),
+        "expires_at": datetime.utcnow() + timedelta(seconds=TIME_LIMIT_SECONDS)
+    }
+    if question_id is not None:
+        values["question_id"] = question_id
+    await db.execute(update(Combat).where(Combat.id == claimed.id).values(**values))
+    await combat_bus.emit(db, CombatEvent(
+        CombatEventType.KEYS_ISSUED, claimed.id, code, CombatState.KEYS_ISSUED.value
+    ))
+    
+    await db.commit()
+    return token_a, token_b
+
+async def release_keys_claim(db: AsyncSession, combat_id: str):
+    """Undo the ACCEPTED -> KEYS_ISSUED claim of a key issue that failed"""
+    await db.rollback()
+    await db.execute(
+        update(Combat)
+        .where(Combat.id == combat_id, Combat.state == CombatState.KEYS_ISSUED)
+        .values(state=CombatState.ACCEPTED)
+    )
+    await db.commit()
+    combat_state_cache.invalidate(combat_id)
+
+@app.post("/api/combats/{code}/keys", response_model=IssueKeysResponse)
+async def issue_api_keys(code: str, db: AsyncSession = Depends(get_db)):
+    """Issue API keys for both users (starts the combat)"""
+    # Claim ACCEPTED -> KEYS_ISSUED first, so concurrent calls never fetch
+    # questions or insert keys twice
+    claimed = (await db.execute(
+        update(Combat)
+        .where(Combat.code == code, Combat.state == CombatState.ACCEPTED)
+        .values(state=CombatState.KEYS_ISSUED)
+        .returning(Combat.id, Combat.user_a_id, Combat.user_b_id, Combat.question_mode)
+    )).first()
+    await db.commit()
+    
+    if claimed:
+        combat_state_cache.invalidate(claimed.id)
+    else:
+        exists_row = await db.scalar(select(Combat.id).where(Combat.code == code))
+        if not exists_row:
+            raise HTTPException(status_code=404, detail="Combat not found")
+        raise HTTPException(status_code=400, detail="Combat must be accepted first")
     
-    db.commit()
+    try:
+        token_a, token_b = await _issue_claimed_keys(db, claimed, code)
+    except BaseException:
+        # Whatever failed (no question, DB error, client gone), hand the combat
+        # back so keys can be issued again - nothing else moves it out of KEYS_ISSUED
+        await release_keys_claim(db, claimed.id)
+        raise
+    combat_state_cache.invalidate(claimed.id)
     
     return IssueKeysResponse(
         keyA=token_a,
@@ -543,60 +806,81 @@ def issue_api_keys(code: str, db: Session = Depends(get_db)):
     )
 
 @app.post("/api/combats/{code}/ready")
-def mark_user_ready(
+async def mark_user_ready(
     code: str,
-    firebase_user = Depends(get_current_firebase_user),
-    db: Session = Depends(get_db)
+    user: Optional[UserIdentity] = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
     """Mark user as ready to start the combat. Timer starts when both are ready."""
-    combat = db.query(Combat).filter(Combat.code == code).first()
-    if not combat:
-        raise HTTPException(status_code=404, detail="Combat not found")
-    
-    if combat.state not in [CombatState.KEYS_ISSUED, CombatState.RUNNING]:
-        raise HTTPException(status_code=400, detail="Combat is not in ready state")
-    
-    # Get the user from our database
-    user = db.query(User).filter(User.firebase_uid == firebase_user["uid"]).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Mark the appropriate user as ready
-    if user.id == combat.user_a_id:
-        combat.user_a_ready = 1
-    elif user.id == combat.user_b_id:
-        combat.user_b_ready = 1
-    else:
+    # Set this player's flag and, if the other one is already set, start the
+    # timer - all in one conditional UPDATE (SET expressions see the old row)
+    a_ready = or_(Combat.user_a_ready == 1, Combat.user_a_id == user.id)
+    b_ready = or_(Combat.user_b_ready == 1, Combat.user_b_id == user.id)
+    starts = (Combat.state == CombatState.KEYS_ISSUED) & a_ready & b_ready
+    now = datetime.utcnow()
+    
+    result = (await db.execute(
+        update(Combat)
+        .where(
+            Combat.code == code,
+            Combat.state.in_([CombatState.KEYS_ISSUED, CombatState.RUNNING]),
+            or_(Combat.user_a_id == user.id, Combat.user_b_id == user.id)
+        )
+        .values(
+            user_a_ready=case((Combat.user_a_id == user.id, 1), else_=Combat.user_a_ready),
+            user_b_ready=case((Combat.user_b_id == user.id, 1), else_=Combat.user_b_ready),
+            state=case((starts, literal(CombatState.RUNNING, Combat.state.type)), else_=Combat.state),
+            started_at=case((starts, now), else_=Combat.started_at),
+            expires_at=case((starts, now + timedelta(seconds=TIME_LIMIT_SECONDS)), else_=Combat.expires_at)
+        )
+        .returning(Combat.id, Combat.user_a_ready, Combat.user_b_ready, Combat.state, Combat.started_at, Combat.expires_at)
+    )).first()
+    just_started = False
+    if result:
+        # started_at == now only on the call that flipped the combat to RUNNING
+        just_started = result.state == CombatState.RUNNING and result.started_at == now
+        await combat_bus.emit(db, CombatEvent(
+            CombatEventType.STARTED if just_started else CombatEventType.READY,
+            result.id, code, result.state.value, user_id=user.id
+        ))
+    await db.commit()
+    
+    if not result:
+        combat = await db.scalar(select(Combat).where(Combat.code == code))
+        if not combat:
+            raise HTTPException(status_code=404, detail="Combat not found")
+        if combat.state not in [CombatState.KEYS_ISSUED, CombatState.RUNNING]:
+            raise HTTPException(status_code=400, detail="Combat is not in ready state")
         raise HTTPException(status_code=403, detail="Not a participant in this combat")
     
-    # If both are ready, start the timer
-    if combat.user_a_ready and combat.user_b_ready and combat.state == CombatState.KEYS_ISSUED:
-        combat.state = CombatState.RUNNING
-        combat.started_at = datetime.utcnow()
-        combat.expires_at = datetime.utcnow() + timedelta(seconds=TIME_LIMIT_SECONDS)
-    
-    db.commit()
+    combat_state_cache.invalidate(result.id)
+    if result.state == CombatState.RUNNING and result.expires_at:
+        deadline_scheduler.schedule(result.id, result.expires_at)
+    if just_started:
+        # Only the request that started the combat sends the webhooks
+        question_webhooks.run_in_background(deliver_question_webhooks(result.id, code))
     
     return {
         "ok": True,
-        "userAReady": bool(combat.user_a_ready),
-        "userBReady": bool(combat.user_b_ready),
-        "state": combat.state.value
+        "userAReady": bool(result.user_a_ready),
+        "userBReady": bool(result.user_b_ready),
+        "state": result.state.value
     }
 
 @app.get("/api/combats/{code}/my-key")
-def get_my_api_key(
+async def get_my_api_key(
     code: str,
-    firebase_user = Depends(get_current_firebase_user),
-    db: Session = Depends(get_db)
+    user: Optional[UserIdentity] = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
     """Retrieve user's API key for a combat (only works once, keys are deleted after retrieval)"""
-    combat = db.query(Combat).filter(Combat.code == code).first()
+    combat = await db.scalar(select(Combat).where(Combat.code == code))
     if not combat:
         raise HTTPException(status_code=404, detail="Combat not found")
     
-    # Get current user
-    user = db.query(User).filter(User.firebase_uid == firebase_user["uid"]).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -605,14 +889,14 @@ def get_my_api_key(
         raise HTTPException(status_code=403, detail="Not authorized for this combat")
     
     # Get temporary keys
-    temp_keys = db.query(TempApiKey).filter(TempApiKey.combat_id == combat.id).first()
+    temp_keys = await db.scalar(select(TempApiKey).where(TempApiKey.combat_id == combat.id))
     if not temp_keys:
         raise HTTPException(status_code=404, detail="API keys not available")
     
     # Check if expired
     if datetime.utcnow() > temp_keys.expires_at:
-        db.delete(temp_keys)
-        db.commit()
+        await db.delete(temp_keys)
+        await db.commit()
         raise HTTPException(status_code=410, detail="API keys expired")
     
     # Return only the user's key
@@ -620,103 +904,196 @@ def get_my_api_key(
     
     return {"key": my_key}
 
+async def wait_for_state_change(code: str, state: CombatState, timeout: float) -> bool:
+    """
+    Park until combat `code` leaves `state` or `timeout` seconds pass.
+    
+    Wakes on the combat's status feed, so a parked request is one idle
+    coroutine - no DB polling and no threadpool worker. Returns True if the
+    state changed.
+    """
+    opened = await combat_feeds.open(code)
+    if opened is None:
+        return False
+    subscription, initial = opened
+    agent_channel.long_polls += 1
+    try:
+        if initial[-1].data.get("state", state.value) != state.value:
+            return True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                agent_channel.long_poll_timeouts += 1
+                return False
+            try:
+                event = await asyncio.wait_for(combat_feeds.next_event(subscription), remaining)
+            except asyncio.TimeoutError:
+                continue
+            if event is not None and event.data.get("state", state.value) != state.value:
+                return True
+    finally:
+        combat_feeds.close(subscription)
+
+async def park_agent(db: AsyncSession, context: dict, wait: float) -> bool:
+    """Long-poll helper for the agent endpoints; True if the combat changed state"""
+    wait = min(max(wait, 0.0), AGENT_LONG_POLL_MAX_SECONDS)
+    if wait <= 0:
+        return False
+    # Don't hold a pooled connection while parked
+    await db.close()
+    return await wait_for_state_change(context["combat_code"], context["state"], wait)
+
 @app.get("/agent/me", response_model=AgentMeResponse)
-def agent_get_assignment(
+async def agent_get_assignment(
+    wait: float = Query(0, description="Seconds to wait for the combat to start (long polling)"),
     context: dict = Depends(get_current_user_from_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get current combat assignment for agent"""
-    combat = context["combat"]
+    """
+    Get current combat assignment for agent.
+    With ?wait=N a not-yet-running combat is held open until it starts or
+    changes state, or N seconds pass.
+    """
+    if context["state"] not in [CombatState.RUNNING, CombatState.COMPLETED, CombatState.EXPIRED]:
+        if await park_agent(db, context, wait):
+            return agent_assignment(await load_combat_snapshot(db, context["combat_code"]))
+    
+    # Waiting agents are answered from the cached combat state alone
+    if context["state"] != CombatState.RUNNING:
+        return AgentMeResponse(
+            combatId=context["combat_id"],
+            state=context["state"]
+        )
     
+    snapshot = await load_combat_snapshot(db, context["combat_code"])
+    return agent_assignment(snapshot)
+
+def agent_assignment(snapshot: CombatSnapshot) -> AgentMeResponse:
+    """Agent's view of its combat; carries the question once it is RUNNING"""
     response = AgentMeResponse(
-        combatId=combat.id,
-        state=combat.state
+        combatId=snapshot.id,
+        state=snapshot.state
     )
-    
-    if combat.state == CombatState.RUNNING:
-        # Check for new HF-based combat question first
-        combat_question = db.query(CombatQuestion).filter(CombatQuestion.combat_id == combat.id).first()
-        if combat_question:
-            response.prompt = combat_question.prompt
-            response.choices = json.loads(combat_question.choices_json)
-        elif combat.question:
-            response.prompt = combat.question.prompt
-            # Parse JSON golden_label for choices
-            try:
-                label_data = json.loads(combat.question.golden_label)
-                if isinstance(label_data, dict) and "choices" in label_data:
-                    response.choices = label_data["choices"]
-            except (json.JSONDecodeError, TypeError):
-                pass
+    if snapshot.state == CombatState.RUNNING:
+        question_data = snapshot.question_payload()
+        if question_data:
+            response.prompt = question_data["prompt"]
+            response.choices = question_data.get("choices")
         
-        response.deadlineTs = int(combat.expires_at.timestamp()) if combat.expires_at else None
+        response.deadlineTs = int(snapshot.expires_at.timestamp()) if snapshot.expires_at else None
     
     return response
 
 @app.post("/agent/submit", response_model=AgentSubmitResponse)
-def agent_submit_answer(
+async def agent_submit_answer(
     request: SubmitAnswerRequest,
     context: dict = Depends(get_current_user_from_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Submit answer to combat"""
-    user = context["user"]
-    combat = context["combat"]
-    
-    if combat.state != CombatState.RUNNING:
+    return await submit_agent_answer(db, context, request.answer)
+
+async def submit_agent_answer(db: AsyncSession, context: dict, answer: str) -> AgentSubmitResponse:
+    """Record an agent's answer and score the combat if it completes it; raises HTTPException"""
+    user_id = context["user_id"]
+    combat_id = context["combat_id"]
+    
+    # The cached state may be a moment old, so it only short-circuits the
+    # terminal states; the conditional INSERT below is the real check
+    if context["state"] in [CombatState.COMPLETED, CombatState.EXPIRED]:
         raise HTTPException(status_code=400, detail="Combat is not running")
     
-    if combat.expires_at and datetime.utcnow() > combat.expires_at:
-        raise HTTPException(status_code=400, detail="Combat time limit expired")
+    async def record_submission():
+        now = datetime.utcnow()
+        # Insert only while the combat is still RUNNING and inside its deadline;
+        # the unique (combat_id, user_id) index rejects a second submission
+        still_running = exists().where(
+            Combat.id == combat_id,
+            Combat.state == CombatState.RUNNING,
+            or_(Combat.expires_at.is_(None), Combat.expires_at >= now)
+        )
+        inserted = await db.execute(
+            insert(Submission).from_select(
+                ["combat_id", "user_id", "answer", "status", "submitted_at"],
+                select(
+                    literal(combat_id),
+                    literal(user_id),
+                    literal(answer, Submission.answer.type),
+                    literal(SubmissionStatus.SUBMITTED, Submission.status.type),
+                    literal(now, Submission.submitted_at.type)
+                ).where(still_running)
+            )
+        )
+        if inserted.rowcount == 0:
+            return None
+        
+        # RUNNING -> COMPLETED once both players have submitted
+        submission_count = (
+            select(func.count(Submission.id))
+            .where(Submission.combat_id == combat_id)
+            .scalar_subquery()
+        )
+        completed = await db.execute(
+            update(Combat)
+            .where(
+                Combat.id == combat_id,
+                Combat.state == CombatState.RUNNING,
+                submission_count >= 2
+            )
+            .values(state=CombatState.COMPLETED, completed_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if completed.rowcount == 0:
+            await combat_bus.emit(db, CombatEvent(
+                CombatEventType.SUBMISSION, combat_id, context["combat_code"], CombatState.RUNNING.value, user_id=user_id
+            ))
+        # A completing submission is announced by the scoring transaction
+        return completed.rowcount > 0
     
-    existing = db.query(Submission).filter(
-        Submission.combat_id == combat.id,
-        Submission.user_id == user.id
-    ).first()
-    if existing:
+    try:
+        completed = await run_serialized_write(db, record_submission)
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Answer already submitted")
     
-    submission = Submission(
-        combat_id=combat.id,
-        user_id=user.id,
-        answer=request.answer,
-        status=SubmissionStatus.SUBMITTED
-    )
-    db.add(submission)
-    
-    all_submissions = db.query(Submission).filter(Submission.combat_id == combat.id).count()
-    if all_submissions + 1 >= 2:
-        combat.state = CombatState.COMPLETED
-        combat.completed_at = datetime.utcnow()
-        db.commit()
-        # Refresh combat to get latest state
-        db.refresh(combat)
+    if completed is None:
+        combat = await db.get(Combat, combat_id)
+        if combat.state == CombatState.RUNNING and combat.expires_at and datetime.utcnow() > combat.expires_at:
+            raise HTTPException(status_code=400, detail="Combat time limit expired")
+        raise HTTPException(status_code=400, detail="Combat is not running")
+    
+    if completed:
+        combat_state_cache.invalidate(combat_id)
+        combat = await db.get(Combat, combat_id)
         # Determine winner and update stats
-        determine_winner_and_update_stats(combat, db)
-    else:
-        db.commit()
+        await determine_winner_and_update_stats(combat, db)
     
     return AgentSubmitResponse(ok=True, status="submitted")
 
 @app.get("/agent/result", response_model=AgentResultResponse)
-def agent_get_result(
+async def agent_get_result(
+    wait: float = Query(0, description="Seconds to wait for the combat to finish (long polling)"),
     context: dict = Depends(get_current_user_from_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get combat result"""
-    user = context["user"]
-    combat = context["combat"]
-    
-    my_submission = db.query(Submission).filter(
-        Submission.combat_id == combat.id,
-        Submission.user_id == user.id
-    ).first()
+    """
+    Get combat result.
+    With ?wait=N an unfinished combat is held open until it changes state
+    or N seconds pass.
+    """
+    if context["state"] not in [CombatState.COMPLETED, CombatState.EXPIRED]:
+        await park_agent(db, context, wait)
+    snapshot = await load_combat_snapshot(db, context["combat_code"])
+    return agent_result(snapshot, context["user_id"])
+
+def agent_result(combat: CombatSnapshot, user_id: int) -> AgentResultResponse:
+    """Agent's view of its own and its opponent's submission"""
+    my_submission = combat.submission_for(user_id)
     
-    opponent_id = combat.user_b_id if user.id == combat.user_a_id else combat.user_a_id
-    opponent_submission = db.query(Submission).filter(
-        Submission.combat_id == combat.id,
-        Submission.user_id == opponent_id
-    ).first()
+    opponent_id = combat.user_b_id if user_id == combat.user_a_id else combat.user_a_id
+    opponent_submission = combat.submission_for(opponent_id)
     
     # Handle timeouts
     my_status = my_submission.status.value if my_submission else "timeout"
@@ -739,27 +1116,187 @@ def agent_get_result(
         completedAt=combat.completed_at
     )
 
+@app.put("/agent/webhook", response_model=AgentWebhookResponse)
+async def agent_set_webhook(
+    request: AgentWebhookRequest,
+    context: dict = Depends(get_current_user_from_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Register this API key's callback URL (or remove it with url=null).
+    The question is POSTed there when the combat starts - right away if it
+    already has. See webhooks.py for retries and the signature header.
+    """
+    if request.url is not None:
+        if not is_valid_callback_url(request.url):
+            raise HTTPException(status_code=400, detail="Callback URL must be an http(s) URL")
+        try:
+            await resolve_callback_target(request.url, question_webhooks.allow_private)
+        except CallbackTargetError:
+            raise HTTPException(status_code=400, detail="Callback URL must resolve to a public address")
+        except OSError:
+            raise HTTPException(status_code=400, detail="Callback URL host could not be resolved")
+    if context["state"] in [CombatState.COMPLETED, CombatState.EXPIRED]:
+        raise HTTPException(status_code=400, detail="Combat is not running")
+    
+    await db.execute(
+        update(ApiKey)
+        .where(ApiKey.token_hash == context["token_hash"])
+        .values(callback_url=request.url)
+    )
+    await db.commit()
+    
+    # Read the state after committing: a start that raced with this request
+    # either saw the URL or is visible here
+    state = await db.scalar(select(Combat.state).where(Combat.id == context["combat_id"]))
+    queued = request.url is not None and state == CombatState.RUNNING
+    if queued:
+        question_webhooks.run_in_background(
+            deliver_question_webhooks(context["combat_id"], context["combat_code"], context["token_hash"])
+        )
+    return AgentWebhookResponse(ok=True, url=request.url, deliveryQueued=queued)
+
+# Question webhooks; delivery happens off the request path
+question_webhooks = WebhookDispatcher(AsyncSessionLocal)
+
+async def deliver_question_webhooks(combat_id: str, code: str, token_hash: Optional[str] = None):
+    """Queue the question for the combat's callback URLs (or one key's)"""
+    stmt = select(ApiKey.callback_url, ApiKey.token_hash).where(
+        ApiKey.combat_id == combat_id,
+        ApiKey.callback_url.is_not(None),
+        ApiKey.revoked_at.is_(None)
+    )
+    if token_hash is not None:
+        stmt = stmt.where(ApiKey.token_hash == token_hash)
+    async with question_webhooks.session_factory() as db:
+        targets = (await db.execute(stmt)).all()
+        if not targets:
+            return
+        snapshot = await load_combat_snapshot(db, code)
+    if snapshot is None or snapshot.state != CombatState.RUNNING:
+        return
+    payload = {"type": "question", **agent_assignment(snapshot).model_dump(mode="json")}
+    for target in targets:
+        question_webhooks.enqueue(target.callback_url, payload, "question", secret=target.token_hash)
+
+# Short-lived sessions and metrics for /agent/ws
+agent_channel = AgentChannel(AsyncSessionLocal)
+
+@app.websocket("/agent/ws")
+async def agent_websocket(websocket: WebSocket, authorization: str = Header(None)):
+    """
+    Push channel for agents, authenticated with the same API key: the
+    question is pushed as soon as the combat is RUNNING, answers are
+    submitted over the socket and the result is pushed at the end.
+    See agent_channel.py for the message protocol.
+    """
+    async with agent_channel.session() as db:
+        try:
+            context = await resolve_api_key(authorization, db)
+        except HTTPException:
+            agent_channel.rejected += 1
+            await websocket.close(code=1008)
+            return
+    
+    opened = await combat_feeds.open(context["combat_code"])
+    if opened is None:
+        await websocket.close(code=1008)
+        return
+    subscription, _ = opened
+    await websocket.accept()
+    agent_channel.connected()
+    
+    last_state = None
+    question_sent = False
+    
+    async def push_state() -> bool:
+        """Send whatever changed for this agent; True once the result is out"""
+        nonlocal last_state, question_sent
+        async with agent_channel.session() as db:
+            snapshot = await load_combat_snapshot(db, context["combat_code"])
+        if snapshot.state in [CombatState.COMPLETED, CombatState.EXPIRED]:
+            result = agent_result(snapshot, context["user_id"])
+            await websocket.send_json({"type": "result", **result.model_dump(mode="json")})
+            agent_channel.results_pushed += 1
+            return True
+        if snapshot.state == CombatState.RUNNING and not question_sent:
+            assignment = agent_assignment(snapshot)
+            await websocket.send_json({"type": "question", **assignment.model_dump(mode="json")})
+            agent_channel.question_pushed(snapshot.started_at)
+            question_sent = True
+        elif snapshot.state != last_state and snapshot.state != CombatState.RUNNING:
+            await websocket.send_json({"type": "state", "combatId": snapshot.id, "state": snapshot.state.value})
+        last_state = snapshot.state
+        return False
+    
+    async def handle(message: dict):
+        if message.get("type") != "submit":
+            await websocket.send_json({"type": "error", "status": 400, "detail": "Unknown message type"})
+            return
+        try:
+            async with agent_channel.session() as db:
+                response = await submit_agent_answer(db, dict(context, state=last_state), str(message.get("answer", "")))
+        except HTTPException as e:
+            await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+            return
+        agent_channel.submissions += 1
+        await websocket.send_json({"type": "submitted", **response.model_dump(mode="json")})
+    
+    receive = asyncio.create_task(websocket.receive_json())
+    wake = asyncio.create_task(combat_feeds.next_event(subscription))
+    try:
+        if await push_state():
+            return
+        while True:
+            done, _ = await asyncio.wait({receive, wake}, return_when=asyncio.FIRST_COMPLETED)
+            if receive in done:
+                try:
+                    message = receive.result()
+                except ValueError:
+                    message = {}
+                await handle(message if isinstance(message, dict) else {})
+                receive = asyncio.create_task(websocket.receive_json())
+            if wake in done:
+                # None is a quiet heartbeat interval; re-check anyway
+                wake.result()
+                if await push_state():
+                    return
+                wake = asyncio.create_task(combat_feeds.next_event(subscription))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receive.cancel()
+        wake.cancel()
+        combat_feeds.close(subscription)
+        agent_channel.disconnected()
+        try:
+            await websocket.close()
+        except Exception:
+            # The agent already hung up
+            pass
+
 # ============================================================================
 # ADMIN API
 # ============================================================================
 
 @app.post("/admin/questions/seed")
-def admin_seed_questions(
+async def admin_seed_questions(
     admin: bool = Depends(verify_admin_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Seed questions (admin only)"""
     from seed_questions import seed_questions
-    seed_questions()
+    await run_in_threadpool(seed_questions)
+    question_sampler.invalidate()
     return {"message": "Questions seeded successfully"}
 
 @app.get("/admin/questions", response_model=List[QuestionResponse])
-def admin_list_questions(
+async def admin_list_questions(
     admin: bool = Depends(verify_admin_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """List all questions (admin only)"""
-    questions = db.query(Question).all()
+    questions = (await db.scalars(select(Question))).all()
     return [
         QuestionResponse(
             id=q.id,
@@ -770,17 +1307,51 @@ def admin_list_questions(
         for q in questions
     ]
 
+@app.get("/admin/metrics")
+async def admin_metrics(admin: bool = Depends(verify_admin_token)):
+    """Runtime metrics (admin only)"""
+    return {
+        "dbWrites": write_metrics.to_dict(),
+        "deadlineScheduler": deadline_scheduler.to_dict(),
+        "reaper": combat_reaper.to_dict(),
+        "caches": cache_metrics(),
+        "firebaseAuth": firebase_auth_metrics(),
+        "leaderboard": leaderboard_index.to_dict(),
+        "combatFeeds": combat_feeds.to_dict(),
+        "agentSockets": agent_channel.to_dict(),
+        "eventBus": combat_bus.to_dict(),
+        "webhooks": question_webhooks.to_dict(),
+        "questionPool": question_pool.to_dict(),
+        "hfBreaker": hf_breaker.to_dict(),
+        "questionSampler": question_sampler.to_dict(),
+        "seenFilter": seen_metrics.to_dict()
+    }
+
+@app.post("/admin/reaper/run")
+async def admin_run_reaper(admin: bool = Depends(verify_admin_token)):
+    """Run one reaper pass now and report rows processed (admin only)"""
+    return await combat_reaper.run_once()
+
+@app.post("/admin/leaderboard/rebuild-periods")
+async def admin_rebuild_period_stats(
+    admin: bool = Depends(verify_admin_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """Recompute weekly / monthly / per-mode leaderboard buckets from scored combats (admin only)"""
+    combats = await run_serialized_write(db, lambda: rebuild_period_stats(db))
+    return {"combats": combats}
+
 @app.get("/admin/combats", response_model=List[AdminCombatResponse])
-def admin_list_combats(
+async def admin_list_combats(
     admin: bool = Depends(verify_admin_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """List all combats (admin only)"""
-    combats = db.query(Combat).all()
+    combats = (await db.scalars(select(Combat))).all()
     result = []
     for combat in combats:
-        user_a = db.query(User).filter(User.id == combat.user_a_id).first()
-        user_b = db.query(User).filter(User.id == combat.user_b_id).first() if combat.user_b_id else None
+        user_a = await db.scalar(select(User).where(User.id == combat.user_a_id))
+        user_b = await db.scalar(select(User).where(User.id == combat.user_b_id)) if combat.user_b_id else None
         
         result.append(AdminCombatResponse(
             id=combat.id,
@@ -797,81 +1368,128 @@ def admin_list_combats(
     return result
 
 @app.get("/admin/combats/{combat_id}")
-def admin_get_combat(
+async def admin_get_combat(
     combat_id: str,
     admin: bool = Depends(verify_admin_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get combat details (admin only)"""
-    combat = db.query(Combat).filter(Combat.id == combat_id).first()
+    combat = await db.scalar(select(Combat).where(Combat.id == combat_id))
     if not combat:
         raise HTTPException(status_code=404, detail="Combat not found")
     
-    submissions = db.query(Submission).filter(Submission.combat_id == combat_id).all()
+    submissions = (await db.scalars(select(Submission).where(Submission.combat_id == combat_id))).all()
     
     return {
         "combat": combat,
         "submissions": submissions,
-        "question": combat.question
+        "question": await get_legacy_question(combat, db)
     }
 
 # ============================================================================
 # PUBLIC API: LEADERBOARD & USER PROFILES
 # ============================================================================
 
+def leaderboard_entry(user: RankedUser, position: int, rank: Optional[str] = None) -> LeaderboardEntryResponse:
+    """Leaderboard row for a ranked user at the given position (rank defaults to the user's tier)"""
+    win_rate = (user.wins / user.total_combats * 100) if user.total_combats > 0 else 0.0
+    return LeaderboardEntryResponse(
+        position=position,
+        username=user.username,
+        wins=user.wins,
+        losses=user.losses,
+        draws=user.draws,
+        totalCombats=user.total_combats,
+        score=user.score,
+        rank=rank or user.rank,
+        winRate=round(win_rate, 1)
+    )
+
 @app.get("/api/leaderboard", response_model=LeaderboardResponse)
-def get_leaderboard(
+async def get_leaderboard(
     limit: int = 50,
     rank: Optional[str] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    window: str = "all",
+    mode: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get the leaderboard with rankings.
+    Get the leaderboard with rankings, one keyset page at a time.
     Optional filter by rank tier: Bronze, Silver, Gold, Diamond, Professional
+    Optional time window (week, month, all) and question mode
+    (formal_logic, argument_logic); windowed and per-mode boards rank by
+    results in the current week / month / mode only.
     """
-    # Query all users with at least 1 combat
-    query = db.query(User).filter(User.total_combats > 0)
-    
-    # Get all users for ranking calculation
-    users = query.all()
-    
-    # Sort by score (wins * 3 + draws), then by wins, then by win rate
-    def sort_key(u):
-        score = u.score
-        win_rate = u.wins / u.total_combats if u.total_combats > 0 else 0
-        return (-score, -u.wins, -win_rate)
-    
-    sorted_users = sorted(users, key=sort_key)
+    if window not in LEADERBOARD_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window must be one of: {', '.join(LEADERBOARD_WINDOWS)}")
+    if mode is not None and mode not in QUESTION_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(QUESTION_MODES)}")
     
-    # Filter by rank if specified
+    tier = None
     if rank:
-        sorted_users = [u for u in sorted_users if u.rank.lower() == rank.lower()]
+        tier = next((name for name, _ in RANK_TIERS if name.lower() == rank.lower()), None)
+        if tier is None:
+            return LeaderboardResponse(entries=[], totalUsers=0)
+    
+    after = None
+    if cursor:
+        try:
+            after = LeaderboardCursor.decode(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    # Sorted by score (wins * 3 + draws), then by wins, then by win rate
+    limit = max(1, min(limit, LEADERBOARD_MAX_PAGE_SIZE))
+    windowed = window != "all" or mode is not None
+    if windowed:
+        now = datetime.utcnow()
+        rows = await load_period_leaderboard_page(db, window, mode or ALL_MODES, limit, tier=tier, after=after, at=now)
+    else:
+        rows = await load_leaderboard_page(db, limit, tier=tier, after=after)
     
     # Build response with positions
+    first_position = after.position + 1 if after else 1
     entries = []
-    for idx, user in enumerate(sorted_users[:limit], start=1):
-        win_rate = (user.wins / user.total_combats * 100) if user.total_combats > 0 else 0.0
-        entries.append(LeaderboardEntryResponse(
-            position=idx,
-            username=user.username,
-            wins=user.wins,
-            losses=user.losses,
-            draws=user.draws,
-            totalCombats=user.total_combats,
-            score=user.score,
-            rank=user.rank,
-            winRate=round(win_rate, 1)
-        ))
+    for idx, row in enumerate(rows, start=first_position):
+        entries.append(leaderboard_entry(RankedUser(
+            user_id=row.id,
+            username=row.username,
+            wins=row.wins,
+            losses=row.losses,
+            draws=row.draws,
+            total_combats=row.total_combats
+        ), idx, rank=row.tier if windowed else None))
+    
+    next_cursor = None
+    if len(rows) == limit and rows:
+        last = rows[-1]
+        next_cursor = LeaderboardCursor(
+            points=last.points,
+            wins=last.wins,
+            win_rate=last.win_rate,
+            user_id=last.id,
+            position=first_position + len(rows) - 1
+        ).encode()
+    
+    # Counted in the page's transaction, so the total always agrees with the
+    # positions above (the per-worker index may lag by an event)
+    if windowed:
+        # Index-only count over one bucket
+        total_users = await count_period_users(db, window, mode or ALL_MODES, tier=tier, at=now)
+    else:
+        total_users = await count_ranked_users(db, tier)
     
     return LeaderboardResponse(
         entries=entries,
-        totalUsers=len(sorted_users)
+        totalUsers=total_users,
+        nextCursor=next_cursor
     )
 
 @app.get("/api/users/{username}", response_model=UserProfileResponse)
-def get_user_profile(username: str, db: Session = Depends(get_db)):
+async def get_user_profile(username: str, db: AsyncSession = Depends(get_db)):
     """Get user profile with stats"""
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -883,52 +1501,76 @@ def get_user_profile(username: str, db: Session = Depends(get_db)):
         totalCombats=user.total_combats,
         score=user.score,
         rank=user.rank,
-        createdAt=user.created_at
+        createdAt=user.created_at,
+        position=leaderboard_index.position(user.id)
+    )
+
+@app.get("/api/users/{username}/rank", response_model=UserRankResponse)
+async def get_user_rank(
+    username: str,
+    neighbors: int = 5,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get a user's leaderboard position plus the users ranked just above and below.
+    Answered from the ranked index in O(log n + neighbors); position, neighbours
+    and totalUsers all come from this worker's index, so they agree with each
+    other. The index trails the database by event delivery (it is updated
+    from the bus as combats are scored) and, for events lost while a LISTEN
+    connection was down, by up to LEADERBOARD_REBUILD_SECONDS.
+    """
+    neighbors = max(0, min(neighbors, 50))
+    ranked = leaderboard_index.get_by_username(username)
+    total_users = leaderboard_index.total()
+    
+    if ranked is None:
+        # Either unknown or not ranked yet (no combats)
+        exists_row = await db.scalar(select(User.id).where(User.username == username))
+        if not exists_row:
+            raise HTTPException(status_code=404, detail="User not found")
+        return UserRankResponse(username=username, totalUsers=total_users, above=[], below=[])
+    
+    position = leaderboard_index.position(ranked.user_id)
+    above, below = leaderboard_index.neighbours(ranked.user_id, neighbors)
+    return UserRankResponse(
+        username=username,
+        position=position,
+        totalUsers=total_users,
+        entry=leaderboard_entry(ranked, position),
+        above=[leaderboard_entry(u, position - len(above) + i) for i, u in enumerate(above)],
+        below=[leaderboard_entry(u, position + 1 + i) for i, u in enumerate(below)]
     )
 
 @app.get("/api/combats/{code}/result", response_model=CombatResultResponse)
-def get_combat_result(code: str, db: Session = Depends(get_db)):
+async def get_combat_result(code: str, db: AsyncSession = Depends(get_db)):
     """Get detailed combat result including winner"""
-    combat = db.query(Combat).filter(Combat.code == code).first()
+    combat = await load_combat_snapshot(db, code)
     if not combat:
         raise HTTPException(status_code=404, detail="Combat not found")
     
     if combat.state not in [CombatState.COMPLETED, CombatState.EXPIRED]:
         raise HTTPException(status_code=400, detail="Combat not finished yet")
     
-    user_a = db.query(User).filter(User.id == combat.user_a_id).first()
-    user_b = db.query(User).filter(User.id == combat.user_b_id).first()
-    winner = db.query(User).filter(User.id == combat.winner_id).first() if combat.winner_id else None
-    
-    sub_a = db.query(Submission).filter(
-        Submission.combat_id == combat.id,
-        Submission.user_id == combat.user_a_id
-    ).first()
-    sub_b = db.query(Submission).filter(
-        Submission.combat_id == combat.id,
-        Submission.user_id == combat.user_b_id
-    ).first()
-    
-    # Check for new HF-based combat question
-    combat_question = db.query(CombatQuestion).filter(CombatQuestion.combat_id == combat.id).first()
+    sub_a = combat.submission_for(combat.user_a_id)
+    sub_b = combat.submission_for(combat.user_b_id)
+    
     correct_answer = None
     
-    if combat_question:
+    if combat.has_combat_question:
         # Use hash verification for HF questions
-        combat_id_int = int(uuid.UUID(combat.id).int % (10**9))
-        a_correct = sub_a and check_answer_correct_hashed(sub_a.answer, combat_question.answer_key_hash, combat.id)
-        b_correct = sub_b and check_answer_correct_hashed(sub_b.answer, combat_question.answer_key_hash, combat.id)
+        a_correct = sub_a and check_answer_correct_hashed(sub_a.answer, combat.answer_key_hash, combat.id, combat.answer_salt)
+        b_correct = sub_b and check_answer_correct_hashed(sub_b.answer, combat.answer_key_hash, combat.id, combat.answer_salt)
         # Reveal the actual correct answer by checking which choice matches the hash
-        choices = json.loads(combat_question.choices_json)
+        choices = list(combat.choices or ())
         for choice in choices:
-            if check_answer_correct_hashed(choice, combat_question.answer_key_hash, combat.id):
+            if check_answer_correct_hashed(choice, combat.answer_key_hash, combat.id, combat.answer_salt):
                 correct_answer = choice
                 break
         if not correct_answer:
             correct_answer = f"One of: {', '.join(choices)}"
     else:
         # Legacy format
-        golden_label = combat.question.golden_label if combat.question else ""
+        golden_label = combat.golden_label or ""
         a_correct = sub_a and check_answer_correct(sub_a.answer, golden_label)
         b_correct = sub_b and check_answer_correct(sub_b.answer, golden_label)
         correct_answer = golden_label
@@ -936,10 +1578,10 @@ def get_combat_result(code: str, db: Session = Depends(get_db)):
     return CombatResultResponse(
         combatId=combat.id,
         winnerId=combat.winner_id,
-        winnerUsername=winner.username if winner else None,
-        isDraw=bool(combat.is_draw),
-        userAUsername=user_a.username if user_a else "unknown",
-        userBUsername=user_b.username if user_b else "unknown",
+        winnerUsername=combat.winner_username,
+        isDraw=combat.is_draw,
+        userAUsername=combat.user_a_username or "unknown",
+        userBUsername=combat.user_b_username or "unknown",
         userACorrect=bool(a_correct),
         userBCorrect=bool(b_correct),
         userAAnswer=sub_a.answer if sub_a else None,
@@ -966,8 +1608,34 @@ def health_check():
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
-    from database import init_database
-    init_database()
+    from database import init_database_async
+    check_upsert_support(async_engine.dialect.name)
+    await init_database_async()
+    await deadline_scheduler.start()
+    combat_reaper.start()
+    await leaderboard_index.start()
+    await combat_bus.start()
+    await question_webhooks.start()
+    await question_pool.start()
+    if token_verifier is not None:
+        # Warm the signing keys so the first request does not fetch them
+        try:
+            await run_in_threadpool(token_verifier.jwks.refresh)
+        except Exception as e:
+            logger.warning("Could not prefetch Firebase signing keys: %s", e)
+        token_verifier.jwks.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks"""
+    await deadline_scheduler.stop()
+    await combat_reaper.stop()
+    await leaderboard_index.stop()
+    await combat_bus.stop()
+    await question_webhooks.stop()
+    await question_pool.stop()
+    if token_verifier is not None:
+        await token_verifier.jwks.stop()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,11 @@
+"""
+Helpers shared by the in-process metrics (/admin/metrics) and the
+benchmark scripts.
+"""
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
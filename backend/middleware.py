@@ -1,9 +1,14 @@
 from fastapi import Header, HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
-from models import ApiKey, Combat, User
+from models import ApiKey, Combat
 from auth import hash_token
+from cache import api_key_cache, combat_state_cache, identity_cache, cache_identity
+from firebase_auth import get_current_firebase_user
+from repository import UserIdentity, load_user_identity
 from datetime import datetime
+from typing import Optional
 import os
 
 def verify_admin_token(authorization: str = Header(None)):
@@ -23,11 +28,37 @@ def verify_admin_token(authorization: str = Header(None)):
     
     return True
 
-def get_current_user_from_token(
+async def get_current_identity(
+    firebase_user: dict = Depends(get_current_firebase_user),
+    db: AsyncSession = Depends(get_db)
+) -> Optional[UserIdentity]:
+    """
+    Resolve the Firebase user to our User row (id + profile).
+    
+    Cached by firebase uid in identity_cache; returns None for users who
+    have not registered a username yet (not cached, they may register next).
+    """
+    identity = identity_cache.get(firebase_user["uid"])
+    if identity is None:
+        identity = await load_user_identity(db, firebase_user["uid"])
+        if identity is not None:
+            cache_identity(identity)
+    return identity
+
+async def get_current_user_from_token(
     authorization: str = Header(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> dict:
-    """Get current user and combat from API key"""
+    """
+    Get current user and combat from API key.
+    
+    Resolved through api_key_cache (token hash -> user/combat/revoked) and
+    combat_state_cache, so an agent polling with a known key costs no queries.
+    """
+    return await resolve_api_key(authorization, db)
+
+async def resolve_api_key(authorization: Optional[str], db: AsyncSession) -> dict:
+    """Agent context for an `Authorization: Bearer <api key>` value; raises 401 if invalid"""
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing authorization header")
     
@@ -37,23 +68,38 @@ def get_current_user_from_token(
     token = authorization.replace("Bearer ", "")
     token_hash_value = hash_token(token)
     
-    # Find API key
-    api_key = db.query(ApiKey).filter(
-        ApiKey.token_hash == token_hash_value,
-        ApiKey.revoked_at.is_(None)
-    ).first()
+    key_entry = api_key_cache.get(token_hash_value)
+    state_entry = combat_state_cache.get(key_entry[1]) if key_entry else None
     
-    if not api_key:
-        raise HTTPException(status_code=401, detail="Invalid or revoked API key")
-    
-    combat = db.query(Combat).filter(Combat.id == api_key.combat_id).first()
-    user = db.query(User).filter(User.id == api_key.user_id).first()
+    if key_entry is None or state_entry is None:
+        # Find API key together with its combat's state in one query
+        row = (await db.execute(
+            select(
+                ApiKey.user_id, ApiKey.combat_id, ApiKey.revoked_at,
+                Combat.code, Combat.state, Combat.expires_at
+            )
+            .join(Combat, Combat.id == ApiKey.combat_id)
+            .where(ApiKey.token_hash == token_hash_value)
+        )).first()
+        
+        if not row:
+            raise HTTPException(status_code=401, detail="Invalid or revoked API key")
+        
+        key_entry = (row.user_id, row.combat_id, row.revoked_at is not None)
+        state_entry = (row.code, row.state, row.expires_at)
+        api_key_cache.set(token_hash_value, key_entry)
+        combat_state_cache.set(row.combat_id, state_entry)
     
-    if not combat or not user:
-        raise HTTPException(status_code=404, detail="Combat or user not found")
+    user_id, combat_id, revoked = key_entry
+    if revoked:
+        raise HTTPException(status_code=401, detail="Invalid or revoked API key")
     
+    code, state, expires_at = state_entry
     return {
-        "user": user,
-        "combat": combat,
-        "api_key": api_key
+        "user_id": user_id,
+        "combat_id": combat_id,
+        "combat_code": code,
+        "state": state,
+        "expires_at": expires_at,
+        "token_hash": token_hash_value
     }
@@ -1,6 +1,6 @@
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, Text, ForeignKey, Enum
+from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime, Text, ForeignKey, Enum, Index, Computed, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred
 from datetime import datetime, timezone
 import enum
 
@@ -19,6 +19,30 @@ class SubmissionStatus(str, enum.Enum):
     TIMEOUT = "timeout"
     INVALID = "invalid"
 
+# Question modes a combat can be played in
+QUESTION_MODES = ("formal_logic", "argument_logic")
+
+# Rank tiers by minimum wins, highest first
+RANK_TIERS = [
+    ("Professional", 100),
+    ("Diamond", 50),
+    ("Gold", 25),
+    ("Silver", 10),
+    ("Bronze", 0),
+]
+
+def rank_for_wins(wins: int) -> str:
+    """Rank tier for a win count"""
+    for name, min_wins in RANK_TIERS:
+        if wins >= min_wins:
+            return name
+    return "Bronze"
+
+# Same tiers as SQL, for the generated users.tier column
+RANK_TIER_SQL = "CASE " + " ".join(
+    f"WHEN wins >= {min_wins} THEN '{name}'" for name, min_wins in RANK_TIERS[:-1]
+) + f" ELSE '{RANK_TIERS[-1][0]}' END"
+
 class User(Base):
     __tablename__ = "users"
     
@@ -34,6 +58,24 @@ class User(Base):
     draws = Column(Integer, default=0, nullable=False)
     total_combats = Column(Integer, default=0, nullable=False)
     
+    # Leaderboard sort columns, computed by the database from the counters above
+    points = Column(Integer, Computed("wins * 3 + draws", persisted=True))
+    win_rate = Column(Float, Computed(
+        "CASE WHEN total_combats > 0 THEN CAST(wins AS DOUBLE PRECISION) / total_combats ELSE 0.0 END",
+        persisted=True
+    ))
+    tier = Column(String, Computed(RANK_TIER_SQL, persisted=True))
+    
+    # Fixed-size filter of questions this user has played (see seen_filter.py);
+    # deferred so loading a User never pulls it in
+    seen_questions = deferred(Column(LargeBinary, nullable=True))
+    
+    __table_args__ = (
+        # Keyset pagination of the leaderboard, globally and within a tier
+        Index("ix_users_leaderboard", points.desc(), wins.desc(), win_rate.desc(), "id"),
+        Index("ix_users_tier_leaderboard", "tier", points.desc(), wins.desc(), win_rate.desc(), "id"),
+    )
+    
     combats_as_a = relationship("Combat", foreign_keys="Combat.user_a_id", back_populates="user_a")
     combats_as_b = relationship("Combat", foreign_keys="Combat.user_b_id", back_populates="user_b")
     api_keys = relationship("ApiKey", back_populates="user")
@@ -47,16 +89,7 @@ class User(Base):
     @property
     def rank(self):
         """Get rank tier based on wins"""
-        if self.wins >= 100:
-            return "Professional"
-        elif self.wins >= 50:
-            return "Diamond"
-        elif self.wins >= 25:
-            return "Gold"
-        elif self.wins >= 10:
-            return "Silver"
-        else:
-            return "Bronze"
+        return rank_for_wins(self.wins)
 
 class Combat(Base):
     __tablename__ = "combats"
@@ -81,6 +114,11 @@ class Combat(Base):
     user_a_ready = Column(Integer, default=0, nullable=False)  # 1 if ready, 0 otherwise
     user_b_ready = Column(Integer, default=0, nullable=False)  # 1 if ready, 0 otherwise
     
+    __table_args__ = (
+        # Deadline scheduler claims: state = 'RUNNING' AND expires_at <= now
+        Index("ix_combats_state_expires_at", "state", "expires_at"),
+    )
+    
     user_a = relationship("User", foreign_keys=[user_a_id], back_populates="combats_as_a")
     user_b = relationship("User", foreign_keys=[user_b_id], back_populates="combats_as_b")
     winner = relationship("User", foreign_keys=[winner_id])
@@ -97,6 +135,8 @@ class ApiKey(Base):
     token_hash = Column(String, unique=True, nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     revoked_at = Column(DateTime, nullable=True)
+    # Agent's webhook; the question is POSTed here when the combat starts
+    callback_url = Column(String, nullable=True)
     
     combat = relationship("Combat", back_populates="api_keys")
     user = relationship("User", back_populates="api_keys")
@@ -113,6 +153,10 @@ class Question(Base):
 
 class Submission(Base):
     __tablename__ = "submissions"
+    __table_args__ = (
+        # One submission per player per combat, enforced by the database
+        Index("uq_submissions_combat_user", "combat_id", "user_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     combat_id = Column(String, ForeignKey("combats.id"), nullable=False)
@@ -148,6 +192,8 @@ class CombatQuestion(Base):
     
     # Secure answer verification
     answer_key_hash = Column(String, nullable=False)  # SHA256 of correct answer + salt
+    # Salt the hash was made with; NULL means derived from combat_id
+    answer_salt = Column(Integer, nullable=True)
     
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     
@@ -167,3 +213,39 @@ class TempApiKey(Base):
     key_b = Column(String, nullable=False)  # Plaintext key for user B
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     expires_at = Column(DateTime, nullable=False)  # Auto-expire after 5 minutes
+
+class UserPeriodStats(Base):
+    """
+    Per-user results bucketed by time window and question mode.
+    
+    One row per (period, period_start, mode, user): period is "week", "month"
+    or "all" (period_start "" for all-time), mode is a question mode or "all".
+    Rows are incremented when a combat is scored, so windowed and per-mode
+    leaderboards read a single bucket instead of scanning combats. The
+    all-time / all-modes board is the users table itself.
+    """
+    __tablename__ = "user_period_stats"
+    
+    period = Column(String, primary_key=True)
+    period_start = Column(String, primary_key=True)  # ISO date of the week's Monday / month's 1st
+    mode = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    
+    wins = Column(Integer, default=0, nullable=False)
+    losses = Column(Integer, default=0, nullable=False)
+    draws = Column(Integer, default=0, nullable=False)
+    total_combats = Column(Integer, default=0, nullable=False)
+    
+    points = Column(Integer, Computed("wins * 3 + draws", persisted=True))
+    win_rate = Column(Float, Computed(
+        "CASE WHEN total_combats > 0 THEN CAST(wins AS DOUBLE PRECISION) / total_combats ELSE 0.0 END",
+        persisted=True
+    ))
+    
+    __table_args__ = (
+        # Keyset pagination within one bucket
+        Index(
+            "ix_user_period_stats_leaderboard",
+            "period", "period_start", "mode", points.desc(), wins.desc(), win_rate.desc(), "user_id"
+        ),
+    )
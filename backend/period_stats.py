@@ -0,0 +1,204 @@
+"""
+Time-windowed and per-mode leaderboards.
+
+When a combat is scored, both players' rows in `user_period_stats` are
+incremented for every bucket the combat falls into: this week, this month
+and all time, each for the combat's question mode and for "all" modes. A
+windowed or per-mode leaderboard page is then a keyset range read of one
+bucket (ix_user_period_stats_leaderboard), so its cost does not grow with
+the number of combats played.
+
+The all-time / all-modes board stays on the users table.
+"""
+
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Combat, CombatState, User, UserPeriodStats
+
+LEADERBOARD_WINDOWS = ("week", "month", "all")
+ALL_MODES = "all"
+
+
+def period_start(window: str, at: datetime) -> str:
+    """ISO date the bucket containing `at` starts on ("" for all time)"""
+    day = at.date() if isinstance(at, datetime) else at
+    if window == "week":
+        return (day - timedelta(days=day.weekday())).isoformat()
+    if window == "month":
+        return day.replace(day=1).isoformat()
+    return ""
+
+
+def buckets_for(mode: str, at: datetime) -> List[Tuple[str, str, str]]:
+    """(window, period_start, mode) buckets a combat completed at `at` counts toward"""
+    buckets = []
+    for window in LEADERBOARD_WINDOWS:
+        start = period_start(window, at)
+        buckets.append((window, start, mode))
+        if window != "all":
+            buckets.append((window, start, ALL_MODES))
+    return buckets
+
+
+# INSERT ... ON CONFLICT DO UPDATE constructs of the supported databases
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def check_upsert_support(dialect: str):
+    """Refuse to start on a database without ON CONFLICT upserts, rather than fail on the first scored combat"""
+    if dialect not in _UPSERT_INSERTS:
+        raise RuntimeError(f"Period leaderboards need SQLite or PostgreSQL, not {dialect}")
+
+
+def _insert(db: AsyncSession):
+    return _UPSERT_INSERTS[db.bind.dialect.name]
+
+
+async def record_combat_result(
+    db: AsyncSession,
+    user_ids: Tuple[int, int],
+    winner_id: Optional[int],
+    mode: str,
+    completed_at: datetime
+):
+    """
+    Add one scored combat to both players' period buckets.
+
+    Runs inside the transaction that claims the outcome, so a combat is
+    counted exactly once. Uses INSERT ... ON CONFLICT DO UPDATE with
+    additive increments, so concurrent completions never lose updates.
+    """
+    is_draw = winner_id is None
+    rows = []
+    for window, start, bucket_mode in buckets_for(mode, completed_at):
+        for user_id in user_ids:
+            won = not is_draw and user_id == winner_id
+            rows.append({
+                "period": window,
+                "period_start": start,
+                "mode": bucket_mode,
+                "user_id": user_id,
+                "wins": 1 if won else 0,
+                "losses": 1 if not is_draw and not won else 0,
+                "draws": 1 if is_draw else 0,
+                "total_combats": 1,
+            })
+
+    stmt = _insert(db)(UserPeriodStats).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["period", "period_start", "mode", "user_id"],
+        set_={
+            "wins": UserPeriodStats.wins + stmt.excluded.wins,
+            "losses": UserPeriodStats.losses + stmt.excluded.losses,
+            "draws": UserPeriodStats.draws + stmt.excluded.draws,
+            "total_combats": UserPeriodStats.total_combats + stmt.excluded.total_combats,
+        }
+    )
+    await db.execute(stmt)
+
+
+def _bucket_filter(window: str, mode: str, at: datetime):
+    return and_(
+        UserPeriodStats.period == window,
+        UserPeriodStats.period_start == period_start(window, at),
+        UserPeriodStats.mode == mode,
+    )
+
+
+def period_leaderboard_page_query(
+    window: str,
+    mode: str,
+    limit: int,
+    tier: Optional[str] = None,
+    after=None,
+    at: Optional[datetime] = None
+):
+    """
+    SELECT for up to `limit` rows of the current `window` / `mode` bucket
+    after the `after` cursor, in leaderboard order. Rows carry the same
+    columns as `load_leaderboard_page` plus the user's lifetime tier. As
+    there, the leading `points <= p` lets the index seek to the cursor.
+    """
+    at = at or datetime.utcnow()
+    stats = UserPeriodStats
+    stmt = (
+        select(
+            stats.user_id.label("id"), User.username, stats.wins, stats.losses, stats.draws,
+            stats.total_combats, stats.points, stats.win_rate, User.tier
+        )
+        .join(User, User.id == stats.user_id)
+        .where(_bucket_filter(window, mode, at))
+    )
+    if tier is not None:
+        stmt = stmt.where(User.tier == tier)
+    if after is not None:
+        stmt = stmt.where(stats.points <= after.points, or_(
+            stats.points < after.points,
+            and_(stats.points == after.points, stats.wins < after.wins),
+            and_(stats.points == after.points, stats.wins == after.wins, stats.win_rate < after.win_rate),
+            and_(
+                stats.points == after.points, stats.wins == after.wins,
+                stats.win_rate == after.win_rate, stats.user_id > after.user_id
+            ),
+        ))
+    return stmt.order_by(stats.points.desc(), stats.wins.desc(), stats.win_rate.desc(), stats.user_id).limit(limit)
+
+
+async def load_period_leaderboard_page(
+    db: AsyncSession,
+    window: str,
+    mode: str,
+    limit: int,
+    tier: Optional[str] = None,
+    after=None,
+    at: Optional[datetime] = None
+) -> List:
+    """Rows of one bucket's leaderboard page (see period_leaderboard_page_query)"""
+    return (await db.execute(period_leaderboard_page_query(window, mode, limit, tier, after, at))).all()
+
+
+async def count_period_users(
+    db: AsyncSession,
+    window: str,
+    mode: str,
+    tier: Optional[str] = None,
+    at: Optional[datetime] = None
+) -> int:
+    """Number of users ranked in the current `window` / `mode` bucket"""
+    stmt = select(func.count()).select_from(UserPeriodStats).where(_bucket_filter(window, mode, at or datetime.utcnow()))
+    if tier is not None:
+        stmt = stmt.join(User, User.id == UserPeriodStats.user_id).where(User.tier == tier)
+    return await db.scalar(stmt) or 0
+
+
+async def rebuild_period_stats(db: AsyncSession) -> int:
+    """
+    Recompute every bucket from scored combats (committed by the caller).
+
+    Only needed once, to backfill combats scored before the table existed;
+    returns the number of combats counted.
+    """
+    combats = (await db.execute(
+        select(Combat.user_a_id, Combat.user_b_id, Combat.winner_id, Combat.question_mode, Combat.completed_at)
+        .where(
+            Combat.state.in_([CombatState.COMPLETED, CombatState.EXPIRED]),
+            Combat.user_b_id.is_not(None),
+            or_(Combat.winner_id.is_not(None), Combat.is_draw == 1),
+        )
+    )).all()
+
+    await db.execute(UserPeriodStats.__table__.delete())
+    for combat in combats:
+        await record_combat_result(
+            db,
+            (combat.user_a_id, combat.user_b_id),
+            combat.winner_id,
+            combat.question_mode or "formal_logic",
+            combat.completed_at or datetime.utcnow()
+        )
+    return len(combats)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Offline question bank: pre-fetched questions in a memory-mapped file.
+
+Build a snapshot once per question mode (needs network):
+
+    python question_bank.py build --mode formal_logic --count 5000 --workers 16
+
+Questions are fetched and normalized through hf_datasets in parallel,
+de-duplicated by (dataset, config, split, row_offset) and written to
+QUESTION_BANK_DIR/<mode>.qbank. Once the file exists, the question pool
+and key issuance draw from it and never touch the network.
+
+File layout (little-endian):
+
+    header   "QBNK", version u32, count u64
+    offsets  (count + 1) x u64  - record i is data[offsets[i]:offsets[i+1]]
+    keys     count x (u64 source, u64 row_offset, u64 record), sorted
+    data     one compact JSON object per record
+
+Opening a bank maps the file and checks the header - nothing is read
+up front, so startup cost and resident memory don't depend on the bank
+size. Access is by record position, 0..count-1 in file order (not a
+dataset row_offset): record_at(i) is one slice of the map, O(1), and is
+what serving uses - random() draws a position. find() looks a question up
+by (dataset, config, split, row_offset) with a binary search over the key
+table (O(log n), read in place); it is for tooling, not the serving path.
+Only the record being returned is decoded.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import random
+import secrets
+import struct
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUESTION_BANK_DIR = os.getenv("QUESTION_BANK_DIR", "./data/question_bank")
+
+_MAGIC = b"QBNK"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIQ")
+_OFFSET = struct.Struct("<Q")
+_KEY = struct.Struct("<QQQ")
+# Same range as the salt derived from a combat id
+_SALT_RANGE = 10**9
+
+
+@dataclass(frozen=True)
+class BankQuestion:
+    """Same fields issue_api_keys reads from an hf_datasets NormalizedQuestion"""
+    dataset: str
+    config: str
+    split: str
+    row_offset: int
+    prompt: str
+    choices: List[str]
+
+
+def source_key(dataset: str, config: str, split: str) -> int:
+    digest = hashlib.blake2b(f"{dataset}/{config}/{split}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def bank_path(mode: str, directory: str = QUESTION_BANK_DIR) -> str:
+    return os.path.join(directory, f"{mode}.qbank")
+
+
+def write_bank(path: str, records: List[dict]) -> int:
+    """Write records (question fields + answer_hash + salt) atomically; returns the count"""
+    blobs = [json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode() for record in records]
+    keys = sorted(
+        (source_key(r["dataset"], r["config"], r["split"]), r["row_offset"], i)
+        for i, r in enumerate(records)
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(blobs)))
+        offset = 0
+        for blob in blobs:
+            f.write(_OFFSET.pack(offset))
+            offset += len(blob)
+        f.write(_OFFSET.pack(offset))
+        for key in keys:
+            f.write(_KEY.pack(*key))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return len(blobs)
+
+
+class QuestionBank:
+    """Read-only view of one .qbank file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {_VERSION} question bank")
+        self._offsets_at = _HEADER.size
+        self._keys_at = self._offsets_at + (self.count + 1) * _OFFSET.size
+        self._data_at = self._keys_at + self.count * _KEY.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self):
+        self._map.close()
+
+    def _record(self, index: int) -> dict:
+        start, = _OFFSET.unpack_from(self._map, self._offsets_at + index * _OFFSET.size)
+        end, = _OFFSET.unpack_from(self._map, self._offsets_at + (index + 1) * _OFFSET.size)
+        return json.loads(self._map[self._data_at + start:self._data_at + end])
+
+    def record_at(self, position: int) -> Tuple[BankQuestion, str, int]:
+        """Record at `position` in file order as (question, answer hash, salt); O(1)"""
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        record = self._record(position)
+        question = BankQuestion(
+            record["dataset"], record["config"], record["split"],
+            record["row_offset"], record["prompt"], record["choices"]
+        )
+        return question, record["answer_hash"], record["salt"]
+
+    def random(self, rng=random) -> Tuple[BankQuestion, str, int]:
+        return self.record_at(rng.randrange(self.count))
+
+    def find(self, dataset: str, config: str, split: str, row_offset: int) -> Optional[Tuple[BankQuestion, str, int]]:
+        """The record for a dataset row, if the bank has it; binary search, O(log n)"""
+        wanted = (source_key(dataset, config, split), row_offset)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if _KEY.unpack_from(self._map, self._keys_at + middle * _KEY.size)[:2] < wanted:
+                low = middle + 1
+            else:
+                high = middle
+        while low < self.count:
+            source, offset, index = _KEY.unpack_from(self._map, self._keys_at + low * _KEY.size)
+            if (source, offset) != wanted:
+                return None
+            found = self.record_at(index)
+            # Guard against a source hash collision
+            if (found[0].dataset, found[0].config, found[0].split) == (dataset, config, split):
+                return found
+            low += 1
+        return None
+
+
+def open_banks(directory: str = QUESTION_BANK_DIR, modes=None) -> Dict[str, QuestionBank]:
+    """Banks found in `directory`, keyed by mode; missing or unreadable ones are skipped"""
+    banks = {}
+    if not os.path.isdir(directory):
+        return banks
+    for name in sorted(os.listdir(directory)):
+        mode, ext = os.path.splitext(name)
+        if ext != ".qbank" or (modes is not None and mode not in modes):
+            continue
+        try:
+            banks[mode] = QuestionBank(os.path.join(directory, name))
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping question bank %s: %s", name, e)
+    return banks
+
+
+def build_bank(
+    path: str,
+    fetch: Callable[[int, str], tuple],
+    mode: str,
+    count: int,
+    workers: int = 8,
+    max_attempts: Optional[int] = None
+) -> int:
+    """
+    Fetch up to `count` distinct questions with `fetch(salt, mode)` ->
+    (normalized question, answer hash) on `workers` threads and write them
+    to `path`. Gives up after `max_attempts` fetches (default 3 x count).
+    """
+    max_attempts = max_attempts or count * 3
+    records: Dict[tuple, dict] = {}
+    failures = 0
+
+    def fetch_one():
+        salt = secrets.randbelow(_SALT_RANGE)
+        question, answer_hash = fetch(salt, mode)
+        return question, answer_hash, salt
+
+    attempts = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while len(records) < count and attempts < max_attempts:
+            batch = min(count - len(records), max_attempts - attempts)
+            attempts += batch
+            for future in as_completed([pool.submit(fetch_one) for _ in range(batch)]):
+                try:
+                    question, answer_hash, salt = future.result()
+                except Exception as e:
+                    failures += 1
+                    print(f"Fetch failed: {e}")
+                    continue
+                key = (question.dataset, question.config, question.split, question.row_offset)
+                if key in records or len(records) >= count:
+                    continue
+                records[key] = {
+                    "dataset": question.dataset,
+                    "config": question.config,
+                    "split": question.split,
+                    "row_offset": question.row_offset,
+                    "prompt": question.prompt,
+                    "choices": list(question.choices),
+                    "answer_hash": answer_hash,
+                    "salt": salt,
+                }
+    if failures:
+        print(f"{failures} of {attempts} fetches failed")
+    if not records:
+        raise RuntimeError(f"No questions fetched for {mode}")
+    return write_bank(path, list(records.values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Download and normalize questions into a bank file")
+    build.add_argument("--mode", required=True, help="formal_logic or argument_logic")
+    build.add_argument("--count", type=int, default=5000)
+    build.add_argument("--workers", type=int, default=16)
+    build.add_argument("--dir", default=QUESTION_BANK_DIR)
+    info = commands.add_parser("info", help="Show a bank's size and first record")
+    info.add_argument("--mode", required=True)
+    info.add_argument("--dir", default=QUESTION_BANK_DIR)
+    args = parser.parse_args()
+
+    path = bank_path(args.mode, args.dir)
+    if args.command == "build":
+        from hf_datasets import question_service
+        written = build_bank(
+            path,
+            lambda salt, mode: question_service.create_combat_question(combat_id=salt, mode=mode),
+            args.mode, args.count, args.workers
+        )
+        print(f"Wrote {written} {args.mode} questions to {path} ({os.path.getsize(path)} bytes)")
+    else:
+        bank = QuestionBank(path)
+        print(f"{path}: {len(bank)} questions")
+        if len(bank):
+            print(bank.record_at(0)[0])
@@ -0,0 +1,160 @@
+"""
+Pre-fetched HuggingFace questions, one pool per question mode.
+
+issue_api_keys used to fetch its question from the HF datasets API inside
+the request, so the player clicking "issue keys" waited on a remote fetch
+and an HF hiccup became a slow request followed by a fallback. Now a
+background task per mode keeps QUESTION_POOL_LOW_WATER questions ready -
+fetched, normalized and with the answer hashed under their own salt, which
+is stored next to the hash - and key issuance just pops one. A miss (cold
+start, HF down for a while) falls back to the inline fetch as before and
+wakes the refill.
+
+Pools are per worker and in memory; a restart refills them.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from metrics import percentile
+from models import QUESTION_MODES
+
+# Questions kept ready per mode; 0 disables the pool
+QUESTION_POOL_LOW_WATER = int(os.getenv("QUESTION_POOL_LOW_WATER", "8"))
+# Pause after a failed fetch before trying again
+QUESTION_POOL_RETRY_SECONDS = float(os.getenv("QUESTION_POOL_RETRY_SECONDS", "10"))
+
+_LATENCY_SAMPLES = 200
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PooledQuestion:
+    question: Any  # hf_datasets NormalizedQuestion
+    answer_hash: str
+    salt: int
+    fetched_at: float
+
+
+class _ModePool:
+    def __init__(self):
+        self.questions: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+        self.refilled = 0
+        self.refill_failures = 0
+        self.latencies: deque = deque(maxlen=_LATENCY_SAMPLES)
+
+
+class QuestionPool:
+    """Keeps each mode topped up to `low_water` questions in the background"""
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[Tuple[Any, str, int]]],
+        modes: Iterable[str] = QUESTION_MODES,
+        low_water: int = QUESTION_POOL_LOW_WATER,
+        retry_seconds: float = QUESTION_POOL_RETRY_SECONDS
+    ):
+        # await fetch(mode) -> (normalized question, answer hash, salt)
+        self.fetch = fetch
+        self.low_water = low_water
+        self.retry_seconds = retry_seconds
+        self._pools: Dict[str, _ModePool] = {mode: _ModePool() for mode in modes}
+        self._tasks: List[asyncio.Task] = []
+        self.unknown_mode_misses = 0
+
+    def pop(self, mode: str) -> Optional[PooledQuestion]:
+        """A ready question for `mode`, or None if the pool is empty"""
+        pool = self._pools.get(mode)
+        if pool is None:
+            self.unknown_mode_misses += 1
+            return None
+        question = pool.questions.popleft() if pool.questions else None
+        if question is None:
+            pool.misses += 1
+        else:
+            pool.hits += 1
+        if len(pool.questions) < self.low_water:
+            pool.wakeup.set()
+        return question
+
+    def push_back(self, mode: str, question: PooledQuestion):
+        """Return a popped question that turned out unsuitable, behind the others"""
+        pool = self._pools.get(mode)
+        if pool is not None:
+            pool.questions.append(question)
+
+    def size(self, mode: str) -> int:
+        pool = self._pools.get(mode)
+        return len(pool.questions) if pool else 0
+
+    async def fill(self, mode: str) -> bool:
+        """Fetch until `mode` has `low_water` questions; False if a fetch failed"""
+        pool = self._pools[mode]
+        while len(pool.questions) < self.low_water:
+            started = time.perf_counter()
+            try:
+                question, answer_hash, salt = await self.fetch(mode)
+            except Exception as e:
+                pool.refill_failures += 1
+                logger.warning("Question pool refill failed for %s: %s", mode, e)
+                return False
+            pool.latencies.append(time.perf_counter() - started)
+            pool.questions.append(PooledQuestion(question, answer_hash, salt, time.time()))
+            pool.refilled += 1
+        return True
+
+    async def _run(self, mode: str):
+        pool = self._pools[mode]
+        while True:
+            pool.wakeup.clear()
+            if not await self.fill(mode):
+                await asyncio.sleep(self.retry_seconds)
+                continue
+            await pool.wakeup.wait()
+
+    async def start(self):
+        if self.low_water <= 0 or self._tasks:
+            return
+        for mode, pool in self._pools.items():
+            # Bind the events to the serving loop
+            pool.wakeup = asyncio.Event()
+            self._tasks.append(asyncio.create_task(self._run(mode)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def to_dict(self) -> dict:
+        modes = {}
+        for mode, pool in self._pools.items():
+            lookups = pool.hits + pool.misses
+            latencies = list(pool.latencies)
+            modes[mode] = {
+                "size": len(pool.questions),
+                "hits": pool.hits,
+                "misses": pool.misses,
+                "hitRate": round(pool.hits / lookups, 3) if lookups else None,
+                "refilled": pool.refilled,
+                "refillFailures": pool.refill_failures,
+                "refillMs": {
+                    "p50": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+                    "p95": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+                },
+            }
+        return {
+            "lowWater": self.low_water,
+            "running": bool(self._tasks),
+            "unknownModeMisses": self.unknown_mode_misses,
+            "modes": modes,
+        }
@@ -0,0 +1,90 @@
+"""
+Random legacy Question without loading the questions table.
+
+issue_api_keys' fallback used to load every Question row - prompt and
+golden_label included - just to pick one id. The sampler keeps only the
+ids, in a compact array (8 bytes per question), loaded with one id-only
+query and reloaded:
+
+- when this process inserts or deletes a Question through the ORM (seeding),
+- after QUESTION_SAMPLER_REFRESH_SECONDS, for rows written by other workers
+  or scripts,
+- when a picked id turns out to be gone.
+
+A pick is then one primary-key lookup that confirms the row still exists.
+"""
+
+import os
+import random
+import time
+from array import array
+from typing import Optional
+
+from sqlalchemy import event as sa_event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Question
+
+QUESTION_SAMPLER_REFRESH_SECONDS = float(os.getenv("QUESTION_SAMPLER_REFRESH_SECONDS", "300"))
+
+
+class QuestionSampler:
+    def __init__(self, refresh_seconds: float = QUESTION_SAMPLER_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._ids: Optional[array] = None
+        self._loaded_at = 0.0
+        self._stale = True
+        # Metrics
+        self.refreshes = 0
+        self.picks = 0
+        self.stale_picks = 0
+        for change in ("after_insert", "after_delete"):
+            sa_event.listen(Question, change, self._on_change)
+
+    def close(self):
+        """Stop listening for Question changes (the listeners are global to the mapper)"""
+        for change in ("after_insert", "after_delete"):
+            if sa_event.contains(Question, change, self._on_change):
+                sa_event.remove(Question, change, self._on_change)
+
+    def _on_change(self, mapper, connection, target):
+        self.invalidate()
+
+    def invalidate(self):
+        """Reload the ids on the next pick"""
+        self._stale = True
+
+    def __len__(self) -> int:
+        return len(self._ids) if self._ids is not None else 0
+
+    async def refresh(self, db: AsyncSession):
+        ids = array("q", await db.scalars(select(Question.id)))
+        self._ids = ids
+        self._loaded_at = time.monotonic()
+        self._stale = False
+        self.refreshes += 1
+
+    async def pick(self, db: AsyncSession, rng=random) -> Optional[int]:
+        """Id of a random existing Question, or None if there are none"""
+        for _ in range(2):
+            if self._stale or time.monotonic() - self._loaded_at >= self.refresh_seconds:
+                await self.refresh(db)
+            if not self._ids:
+                return None
+            question_id = self._ids[rng.randrange(len(self._ids))]
+            if await db.scalar(select(Question.id).where(Question.id == question_id)) is not None:
+                self.picks += 1
+                return question_id
+            # Deleted since the last refresh
+            self.stale_picks += 1
+            self.invalidate()
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "questions": len(self),
+            "refreshes": self.refreshes,
+            "picks": self.picks,
+            "stalePicks": self.stale_picks,
+            "loadedSecondsAgo": round(time.monotonic() - self._loaded_at, 1) if self._ids is not None else None,
+        }
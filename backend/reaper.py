@@ -0,0 +1,229 @@
+"""
+Periodic cleanup of rows nobody will touch again.
+
+Each run, in batches:
+- expires lobbies abandoned in CREATED / ACCEPTED / KEYS_ISSUED longer than
+  their per-state TTL
+- deletes TempApiKey rows past their expires_at
+- revokes the API keys of combats that finished more than a grace period
+  ago (agents still read /agent/result right after the end)
+
+Expired lobbies and revoked keys are announced on the combat event bus in
+the transaction that changes them, so every worker drops its cached state
+and keys and live status feeds see the lobby expire.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import run_serialized_write
+from event_bus import CombatEvent, CombatEventBus, CombatEventType
+from models import ApiKey, Combat, CombatState, TempApiKey
+
+logger = logging.getLogger(__name__)
+
+REAPER_INTERVAL_SECONDS = float(os.getenv("REAPER_INTERVAL_SECONDS", "300"))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "500"))
+
+# How long a lobby may sit in each pre-RUNNING state before it is expired
+LOBBY_TTL_SECONDS = {
+    CombatState.CREATED: int(os.getenv("LOBBY_TTL_CREATED_SECONDS", str(24 * 3600))),
+    CombatState.ACCEPTED: int(os.getenv("LOBBY_TTL_ACCEPTED_SECONDS", "3600")),
+    CombatState.KEYS_ISSUED: int(os.getenv("LOBBY_TTL_KEYS_ISSUED_SECONDS", "3600")),
+}
+
+# Keys of finished combats stay valid this long so agents can fetch results
+KEY_REVOKE_GRACE_SECONDS = int(os.getenv("KEY_REVOKE_GRACE_SECONDS", "3600"))
+
+
+def _entered_state_at(state: CombatState):
+    """Column recording when a combat entered the given lobby state"""
+    if state == CombatState.CREATED:
+        return Combat.created_at
+    if state == CombatState.ACCEPTED:
+        return Combat.accepted_at
+    # issue_api_keys stamps started_at when the keys are issued
+    return func.coalesce(Combat.started_at, Combat.accepted_at)
+
+
+class CombatReaper:
+    """Batched periodic reaper for abandoned lobbies and stale key rows"""
+
+    def __init__(
+        self,
+        session_factory,
+        event_bus: CombatEventBus,
+        interval_seconds: float = REAPER_INTERVAL_SECONDS,
+        batch_size: int = REAPER_BATCH_SIZE,
+        lobby_ttl_seconds: Optional[dict] = None,
+        key_grace_seconds: int = KEY_REVOKE_GRACE_SECONDS
+    ):
+        self.session_factory = session_factory
+        self.event_bus = event_bus
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.lobby_ttl_seconds = dict(lobby_ttl_seconds or LOBBY_TTL_SECONDS)
+        self.key_grace_seconds = key_grace_seconds
+        self._task: Optional[asyncio.Task] = None
+        # Metrics
+        self.runs = 0
+        self.errors_total = 0
+        self.totals = {"lobbiesExpired": 0, "tempKeysDeleted": 0, "keysRevoked": 0}
+        self.last_run: Optional[dict] = None
+
+    async def _in_batches(self, db: AsyncSession, make_statement, on_rows=None) -> int:
+        """
+        Execute a batched statement until it affects fewer rows than a batch.
+        
+        With `on_rows`, the statement RETURNs the affected rows and
+        `await on_rows(rows)` runs in the same transaction.
+        """
+        processed = 0
+        while True:
+            async def work():
+                result = await db.execute(make_statement())
+                if on_rows is None:
+                    return result.rowcount
+                rows = result.all()
+                await on_rows(rows)
+                return len(rows)
+            affected = await run_serialized_write(db, work)
+            processed += affected
+            if affected < self.batch_size:
+                return processed
+
+    async def expire_abandoned_lobbies(self, db: AsyncSession, now: datetime) -> int:
+        async def announce(rows):
+            for row in rows:
+                await self.event_bus.emit(db, CombatEvent(
+                    CombatEventType.EXPIRED, row.id, row.code, CombatState.EXPIRED.value
+                ))
+        
+        expired = 0
+        for state, ttl in self.lobby_ttl_seconds.items():
+            cutoff = now - timedelta(seconds=ttl)
+            def statement(state=state, cutoff=cutoff):
+                stale = (
+                    select(Combat.id)
+                    .where(Combat.state == state, _entered_state_at(state) < cutoff)
+                    .limit(self.batch_size)
+                )
+                return (
+                    update(Combat)
+                    .where(Combat.id.in_(stale.scalar_subquery()), Combat.state == state)
+                    .values(state=CombatState.EXPIRED, completed_at=now)
+                    .returning(Combat.id, Combat.code)
+                    .execution_options(synchronize_session=False)
+                )
+            expired += await self._in_batches(db, statement, announce)
+        return expired
+
+    async def delete_expired_temp_keys(self, db: AsyncSession, now: datetime) -> int:
+        def statement():
+            stale = select(TempApiKey.id).where(TempApiKey.expires_at < now).limit(self.batch_size)
+            return (
+                delete(TempApiKey)
+                .where(TempApiKey.id.in_(stale.scalar_subquery()))
+                .execution_options(synchronize_session=False)
+            )
+        return await self._in_batches(db, statement)
+
+    async def revoke_finished_keys(self, db: AsyncSession, now: datetime) -> int:
+        cutoff = now - timedelta(seconds=self.key_grace_seconds)
+        
+        async def announce(rows):
+            revoked = {}
+            for row in rows:
+                revoked.setdefault(row.combat_id, []).append(row.token_hash)
+            combats = await db.execute(
+                select(Combat.id, Combat.code, Combat.state).where(Combat.id.in_(list(revoked)))
+            )
+            for combat in combats:
+                await self.event_bus.emit(db, CombatEvent(
+                    CombatEventType.KEYS_REVOKED, combat.id, combat.code, combat.state.value,
+                    data={"token_hashes": revoked[combat.id]}
+                ))
+        
+        def statement():
+            stale = (
+                select(ApiKey.id)
+                .join(Combat, Combat.id == ApiKey.combat_id)
+                .where(
+                    ApiKey.revoked_at.is_(None),
+                    Combat.state.in_([CombatState.COMPLETED, CombatState.EXPIRED]),
+                    Combat.completed_at < cutoff
+                )
+                .limit(self.batch_size)
+            )
+            return (
+                update(ApiKey)
+                .where(ApiKey.id.in_(stale.scalar_subquery()))
+                .values(revoked_at=now)
+                .returning(ApiKey.combat_id, ApiKey.token_hash)
+                .execution_options(synchronize_session=False)
+            )
+        return await self._in_batches(db, statement, announce)
+
+    async def run_once(self) -> dict:
+        """One full reaper pass; returns rows processed per category"""
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            report = {
+                "lobbiesExpired": await self.expire_abandoned_lobbies(db, now),
+                "tempKeysDeleted": await self.delete_expired_temp_keys(db, now),
+                "keysRevoked": await self.revoke_finished_keys(db, now),
+            }
+        for key, count in report.items():
+            self.totals[key] += count
+        self.runs += 1
+        report["durationMs"] = round((time.perf_counter() - started) * 1000, 2)
+        report["ranAt"] = now.isoformat()
+        self.last_run = report
+        if report["lobbiesExpired"] or report["tempKeysDeleted"] or report["keysRevoked"]:
+            logger.info(
+                "Reaper: expired %d lobbies, deleted %d temp keys, revoked %d API keys in %s ms",
+                report["lobbiesExpired"], report["tempKeysDeleted"], report["keysRevoked"], report["durationMs"]
+            )
+        return report
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors_total += 1
+                logger.exception("Reaper run failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def to_dict(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "runs": self.runs,
+            "errorsTotal": self.errors_total,
+            "totals": dict(self.totals),
+            "lastRun": self.last_run,
+        }
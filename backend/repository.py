@@ -0,0 +1,279 @@
+"""
+Read-side loaders for the hot polling endpoints.
+
+`load_combat_snapshot` fetches a combat together with its players, winner,
+question and submissions in a single joined SELECT and returns an immutable
+snapshot, so the status/result endpoints never trigger per-row or lazy loads.
+`load_user_identity` does the same for the authenticated user's profile,
+and `load_leaderboard_page` / `count_ranked_users` read one keyset page
+of the leaderboard and its size, in the caller's transaction.
+"""
+
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from models import Combat, CombatState, SubmissionStatus, User
+
+
+@dataclass(frozen=True)
+class UserIdentity:
+    id: int
+    firebase_uid: str
+    username: str
+    email: Optional[str]
+    wins: int
+    losses: int
+    draws: int
+    total_combats: int
+    score: int
+    rank: str
+    created_at: datetime
+
+
+async def load_user_identity(db: AsyncSession, firebase_uid: str) -> Optional[UserIdentity]:
+    """Profile of the user with this firebase uid, or None if not registered"""
+    user = await db.scalar(select(User).where(User.firebase_uid == firebase_uid))
+    if user is None:
+        return None
+    return UserIdentity(
+        id=user.id,
+        firebase_uid=user.firebase_uid,
+        username=user.username,
+        email=user.email,
+        wins=user.wins,
+        losses=user.losses,
+        draws=user.draws,
+        total_combats=user.total_combats,
+        score=user.score,
+        rank=user.rank,
+        created_at=user.created_at,
+    )
+
+
+@dataclass(frozen=True)
+class LeaderboardCursor:
+    """Sort key of the last row on a page, plus its position"""
+    points: int
+    wins: int
+    win_rate: float
+    user_id: int
+    position: int
+
+    def encode(self) -> str:
+        raw = json.dumps([self.points, self.wins, self.win_rate, self.user_id, self.position])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, cursor: str) -> "LeaderboardCursor":
+        """Parse a cursor from `encode`; raises ValueError if malformed"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            points, wins, win_rate, user_id, position = json.loads(raw)
+            return cls(int(points), int(wins), float(win_rate), int(user_id), int(position))
+        except (TypeError, ValueError, json.JSONDecodeError) as e:
+            raise ValueError(f"Invalid cursor: {e}")
+
+
+def leaderboard_page_query(
+    limit: int,
+    tier: Optional[str] = None,
+    after: Optional[LeaderboardCursor] = None
+):
+    """
+    SELECT for up to `limit` ranked users after `after`, in leaderboard order.
+    
+    Ordered by (points desc, wins desc, win_rate desc, id) and walked with a
+    keyset predicate, so every page is a range read of ix_users_leaderboard
+    (or ix_users_tier_leaderboard when filtering by tier) however deep it is.
+    The OR alone can't bound an index range; the leading `points <= p` is
+    what lets the database seek to the cursor instead of scanning up to it.
+    """
+    stmt = select(
+        User.id, User.username, User.wins, User.losses, User.draws,
+        User.total_combats, User.points, User.win_rate
+    ).where(User.total_combats > 0)
+    if tier is not None:
+        stmt = stmt.where(User.tier == tier)
+    if after is not None:
+        stmt = stmt.where(User.points <= after.points, or_(
+            User.points < after.points,
+            and_(User.points == after.points, User.wins < after.wins),
+            and_(User.points == after.points, User.wins == after.wins, User.win_rate < after.win_rate),
+            and_(
+                User.points == after.points, User.wins == after.wins,
+                User.win_rate == after.win_rate, User.id > after.user_id
+            ),
+        ))
+    return stmt.order_by(User.points.desc(), User.wins.desc(), User.win_rate.desc(), User.id).limit(limit)
+
+
+async def load_leaderboard_page(
+    db: AsyncSession,
+    limit: int,
+    tier: Optional[str] = None,
+    after: Optional[LeaderboardCursor] = None
+) -> List:
+    """Up to `limit` ranked users after `after`, in leaderboard order (see leaderboard_page_query)"""
+    return (await db.execute(leaderboard_page_query(limit, tier, after))).all()
+
+
+async def count_ranked_users(db: AsyncSession, tier: Optional[str] = None) -> int:
+    """Number of users on the leaderboard (at least one combat), optionally in one tier"""
+    stmt = select(func.count()).select_from(User).where(User.total_combats > 0)
+    if tier is not None:
+        stmt = stmt.where(User.tier == tier)
+    return await db.scalar(stmt) or 0
+
+
+@dataclass(frozen=True)
+class SubmissionSnapshot:
+    user_id: int
+    answer: Optional[str]
+    status: SubmissionStatus
+    submitted_at: datetime
+
+
+@dataclass(frozen=True)
+class CombatSnapshot:
+    id: str
+    code: str
+    state: CombatState
+    question_mode: str
+    user_a_id: int
+    user_b_id: Optional[int]
+    user_a_username: Optional[str]
+    user_b_username: Optional[str]
+    winner_id: Optional[int]
+    winner_username: Optional[str]
+    is_draw: bool
+    user_a_ready: bool
+    user_b_ready: bool
+    created_at: datetime
+    accepted_at: Optional[datetime]
+    started_at: Optional[datetime]
+    expires_at: Optional[datetime]
+    completed_at: Optional[datetime]
+    # HF-based question (CombatQuestion) - preferred when present
+    prompt: Optional[str]
+    choices: Optional[Tuple[str, ...]]
+    answer_key_hash: Optional[str]
+    answer_salt: Optional[int]
+    # Legacy Question row
+    question_id: Optional[int]
+    golden_label: Optional[str]
+    submissions: Tuple[SubmissionSnapshot, ...]
+
+    @property
+    def has_combat_question(self) -> bool:
+        return self.answer_key_hash is not None
+
+    def submission_for(self, user_id: Optional[int]) -> Optional[SubmissionSnapshot]:
+        """Submission of the given player, if any"""
+        for sub in self.submissions:
+            if sub.user_id == user_id:
+                return sub
+        return None
+
+    def username_for(self, user_id: Optional[int]) -> Optional[str]:
+        if user_id is None:
+            return None
+        if user_id == self.user_a_id:
+            return self.user_a_username
+        if user_id == self.user_b_id:
+            return self.user_b_username
+        return None
+
+    def question_payload(self) -> Optional[dict]:
+        """Question as shown to players: prompt plus choices when known"""
+        if self.has_combat_question:
+            return {"prompt": self.prompt, "choices": list(self.choices or ())}
+        if self.prompt is None:
+            return None
+        payload = {"prompt": self.prompt}
+        try:
+            label_data = json.loads(self.golden_label)
+            if isinstance(label_data, dict) and "choices" in label_data:
+                payload["choices"] = label_data["choices"]
+        except (json.JSONDecodeError, TypeError):
+            pass
+        return payload
+
+
+def _snapshot_from_combat(combat: Combat) -> CombatSnapshot:
+    combat_question = combat.combat_question[0] if combat.combat_question else None
+    legacy = combat.question
+
+    if combat_question:
+        prompt = combat_question.prompt
+        choices = tuple(json.loads(combat_question.choices_json))
+        answer_key_hash = combat_question.answer_key_hash
+        answer_salt = combat_question.answer_salt
+    else:
+        prompt = legacy.prompt if legacy else None
+        choices = None
+        answer_key_hash = None
+        answer_salt = None
+
+    return CombatSnapshot(
+        id=combat.id,
+        code=combat.code,
+        state=combat.state,
+        question_mode=combat.question_mode or "formal_logic",
+        user_a_id=combat.user_a_id,
+        user_b_id=combat.user_b_id,
+        user_a_username=combat.user_a.username if combat.user_a else None,
+        user_b_username=combat.user_b.username if combat.user_b else None,
+        winner_id=combat.winner_id,
+        winner_username=combat.winner.username if combat.winner else None,
+        is_draw=bool(combat.is_draw),
+        user_a_ready=bool(combat.user_a_ready),
+        user_b_ready=bool(combat.user_b_ready),
+        created_at=combat.created_at,
+        accepted_at=combat.accepted_at,
+        started_at=combat.started_at,
+        expires_at=combat.expires_at,
+        completed_at=combat.completed_at,
+        prompt=prompt,
+        choices=choices,
+        answer_key_hash=answer_key_hash,
+        answer_salt=answer_salt,
+        question_id=combat.question_id,
+        golden_label=legacy.golden_label if legacy else None,
+        submissions=tuple(
+            SubmissionSnapshot(
+                user_id=sub.user_id,
+                answer=sub.answer,
+                status=sub.status,
+                submitted_at=sub.submitted_at,
+            )
+            for sub in sorted(combat.submissions, key=lambda s: s.id)
+        ),
+    )
+
+
+async def load_combat_snapshot(db: AsyncSession, code: str) -> Optional[CombatSnapshot]:
+    """Load a combat and everything the status/result endpoints need in one SELECT"""
+    stmt = (
+        select(Combat)
+        .where(Combat.code == code)
+        .options(
+            joinedload(Combat.user_a),
+            joinedload(Combat.user_b),
+            joinedload(Combat.winner),
+            joinedload(Combat.question),
+            joinedload(Combat.combat_question),
+            joinedload(Combat.submissions),
+        )
+        .execution_options(populate_existing=True)
+    )
+    combat = (await db.scalars(stmt)).unique().first()
+    if combat is None:
+        return None
+    return _snapshot_from_combat(combat)
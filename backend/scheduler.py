@@ -0,0 +1,204 @@
+"""
+Deadline scheduler for RUNNING combats.
+
+Keeps a min-heap of (expires_at, combat_id) for this worker, rebuilt from
+`Combat.expires_at` on startup and periodically re-synced so combats
+started by other workers are picked up too. When the earliest deadline
+passes, overdue combats are claimed in batches with
+
+    UPDATE combats SET state='EXPIRED' WHERE state='RUNNING' AND expires_at <= now
+
+so with several uvicorn workers each combat is expired (and scored) by
+exactly one of them - no leader election needed.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import combat_state_cache
+from models import Combat, CombatState
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "100"))
+EXPIRY_RESCAN_SECONDS = float(os.getenv("EXPIRY_RESCAN_SECONDS", "30"))
+
+
+async def claim_expired_combats(
+    db: AsyncSession,
+    now: datetime,
+    limit: int = EXPIRY_BATCH_SIZE,
+    combat_id: Optional[str] = None
+) -> List[str]:
+    """
+    Move up to `limit` overdue RUNNING combats to EXPIRED and return their ids.
+
+    Only rows this call actually transitioned are returned, so the caller owns
+    scoring them. Pass `combat_id` to claim a single combat.
+    """
+    overdue = (
+        select(Combat.id)
+        .where(Combat.state == CombatState.RUNNING, Combat.expires_at <= now)
+        .limit(limit)
+    )
+    if combat_id is not None:
+        overdue = overdue.where(Combat.id == combat_id)
+
+    result = await db.execute(
+        update(Combat)
+        .where(
+            Combat.id.in_(overdue.scalar_subquery()),
+            Combat.state == CombatState.RUNNING
+        )
+        .values(state=CombatState.EXPIRED, completed_at=now)
+        .returning(Combat.id)
+        .execution_options(synchronize_session=False)
+    )
+    claimed = list(result.scalars().all())
+    await db.commit()
+    for claimed_id in claimed:
+        combat_state_cache.invalidate(claimed_id)
+    return claimed
+
+
+class DeadlineScheduler:
+    """In-process timer heap that expires RUNNING combats at their deadline"""
+
+    def __init__(
+        self,
+        session_factory,
+        on_expired: Callable[[AsyncSession, List[str]], Awaitable[None]],
+        batch_size: int = EXPIRY_BATCH_SIZE,
+        rescan_seconds: float = EXPIRY_RESCAN_SECONDS
+    ):
+        self.session_factory = session_factory
+        self.on_expired = on_expired
+        self.batch_size = batch_size
+        self.rescan_seconds = rescan_seconds
+        self._heap = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Metrics
+        self.expired_total = 0
+        self.batches_total = 0
+        self.errors_total = 0
+        self.last_lag_ms = 0.0
+
+    def schedule(self, combat_id: str, expires_at: datetime):
+        """Register a deadline; wakes the loop if it is earlier than the current head"""
+        is_earliest = not self._heap or expires_at < self._heap[0][0]
+        heapq.heappush(self._heap, (expires_at, combat_id))
+        if is_earliest and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def rebuild(self):
+        """Reload the heap from all RUNNING combats in the database"""
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                select(Combat.expires_at, Combat.id).where(
+                    Combat.state == CombatState.RUNNING,
+                    Combat.expires_at.is_not(None)
+                )
+            )).all()
+        heap = [(row.expires_at, row.id) for row in rows]
+        heapq.heapify(heap)
+        self._heap = heap
+
+    async def score(self, combat_ids: List[str]):
+        """Run winner determination for expired combats in a fresh session"""
+        if not combat_ids:
+            return
+        async with self.session_factory() as db:
+            await self.on_expired(db, combat_ids)
+
+    async def expire_due(self) -> int:
+        """Claim and score every overdue combat, one batch at a time"""
+        expired = 0
+        while True:
+            now = datetime.utcnow()
+            async with self.session_factory() as db:
+                claimed = await claim_expired_combats(db, now, self.batch_size)
+            if claimed:
+                self.batches_total += 1
+                expired += len(claimed)
+                await self.score(claimed)
+            if len(claimed) < self.batch_size:
+                break
+        self.expired_total += expired
+        return expired
+
+    def _pop_due(self, now: datetime) -> Optional[datetime]:
+        """Drop due entries from the heap, returning the latest deadline dropped"""
+        latest = None
+        while self._heap and self._heap[0][0] <= now:
+            latest, _ = heapq.heappop(self._heap)
+        return latest
+
+    async def _run(self):
+        next_rescan = time.monotonic() + self.rescan_seconds
+        while True:
+            try:
+                now = datetime.utcnow()
+                latest_due = self._pop_due(now)
+                if latest_due is not None:
+                    await self.expire_due()
+                    self.last_lag_ms = (datetime.utcnow() - latest_due).total_seconds() * 1000
+
+                if time.monotonic() >= next_rescan:
+                    await self.rebuild()
+                    next_rescan = time.monotonic() + self.rescan_seconds
+                    continue
+
+                timeout = next_rescan - time.monotonic()
+                if self._heap:
+                    until_head = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+                    timeout = min(timeout, until_head)
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                self._wakeup.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors_total += 1
+                logger.exception("Deadline scheduler pass failed")
+                await asyncio.sleep(1)
+
+    async def start(self):
+        """Rebuild from the database and start the background loop"""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        await self.rebuild()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def to_dict(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "pending": len(self._heap),
+            "nextDeadline": self._heap[0][0].isoformat() if self._heap else None,
+            "expiredTotal": self.expired_total,
+            "batchesTotal": self.batches_total,
+            "errorsTotal": self.errors_total,
+            "lastLagMs": round(self.last_lag_ms, 2),
+        }
@@ -38,6 +38,9 @@ class AcceptCombatRequest(BaseModel):
 class SubmitAnswerRequest(BaseModel):
     answer: str
 
+class AgentWebhookRequest(BaseModel):
+    url: Optional[str] = Field(default=None, description="Callback URL for this API key; null removes it")
+
 class CreateCombatResponse(BaseModel):
     combatId: str
     code: str
@@ -80,6 +83,11 @@ class AgentSubmitResponse(BaseModel):
     ok: bool
     status: str
 
+class AgentWebhookResponse(BaseModel):
+    ok: bool
+    url: Optional[str] = None
+    deliveryQueued: bool = False
+
 class AgentResultResponse(BaseModel):
     combatId: str
     state: CombatState
@@ -123,6 +131,7 @@ class UserProfileResponse(BaseModel):
     score: int
     rank: str
     createdAt: datetime
+    position: Optional[int] = None  # Leaderboard position, None until the first combat
 
 class LeaderboardEntryResponse(BaseModel):
     position: int
@@ -138,6 +147,15 @@ class LeaderboardEntryResponse(BaseModel):
 class LeaderboardResponse(BaseModel):
     entries: list[LeaderboardEntryResponse]
     totalUsers: int
+    nextCursor: Optional[str] = None  # Pass as ?cursor= for the next page
+
+class UserRankResponse(BaseModel):
+    username: str
+    position: Optional[int] = None  # None if the user has no combats yet
+    totalUsers: int
+    entry: Optional[LeaderboardEntryResponse] = None
+    above: list[LeaderboardEntryResponse]  # Users ranked just above, in leaderboard order
+    below: list[LeaderboardEntryResponse]  # Users ranked just below
 
 class CombatResultResponse(BaseModel):
     combatId: str
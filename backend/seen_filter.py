@@ -0,0 +1,156 @@
+"""
+Per-user "seen question" filters, so heavy users don't get repeats.
+
+Each user carries a fixed-size Bloom filter of the questions they have
+played - keyed by dataset row (dataset/config/split#row_offset) or legacy
+Question id - in users.seen_questions. Picking a question for a combat
+loads the two players' filters in one query and skips candidates either
+of them has seen, without touching their combat history.
+
+The blob never grows past SEEN_FILTER_BYTES: it holds two generations of
+equal size. New questions go into the current one; when it reaches the
+number of entries it can hold at a ~1% false-positive rate, it becomes
+the previous generation and the old previous one is dropped. A filter
+therefore always remembers at least the user's last `capacity` questions,
+and a false positive only costs one extra candidate.
+
+Two combats of the same user starting at the same moment can each write
+the blob and one of the marks is lost; that only makes a repeat possible.
+"""
+
+import hashlib
+import math
+import os
+import struct
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User
+
+# Bytes stored per user, both generations and the header included
+SEEN_FILTER_BYTES = int(os.getenv("SEEN_FILTER_BYTES", "2048"))
+# Candidates tried before accepting a repeat
+SEEN_MAX_ATTEMPTS = int(os.getenv("SEEN_MAX_ATTEMPTS", "5"))
+
+_HEADER = struct.Struct("<HII")  # version, current count, previous count
+_VERSION = 1
+_HASHES = 7
+# Bits per entry for a ~1% false-positive rate with 7 hashes
+_BITS_PER_ENTRY = 9.6
+
+
+def question_key(question) -> str:
+    """Key of an HF question (anything with dataset, config, split, row_offset)"""
+    return f"{question.dataset}/{question.config}/{question.split}#{question.row_offset}"
+
+
+def legacy_question_key(question_id: int) -> str:
+    return f"legacy#{question_id}"
+
+
+class SeenFilter:
+    def __init__(self, blob: Optional[bytes] = None, size_bytes: int = SEEN_FILTER_BYTES):
+        self.size_bytes = size_bytes
+        self.generation_bytes = (size_bytes - _HEADER.size) // 2
+        self.bits = self.generation_bytes * 8
+        self.capacity = max(1, int(self.bits / _BITS_PER_ENTRY))
+        self.current = bytearray(self.generation_bytes)
+        self.previous = bytearray(self.generation_bytes)
+        self.current_count = self.previous_count = 0
+        # A blob from another size or version is dropped rather than misread
+        if blob and len(blob) == _HEADER.size + 2 * self.generation_bytes:
+            version, current_count, previous_count = _HEADER.unpack_from(blob, 0)
+            if version == _VERSION:
+                start = _HEADER.size
+                self.current[:] = blob[start:start + self.generation_bytes]
+                self.previous[:] = blob[start + self.generation_bytes:]
+                self.current_count, self.previous_count = current_count, previous_count
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(_HASHES)]
+
+    @staticmethod
+    def _has(bits: bytearray, positions) -> bool:
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def __contains__(self, key: str) -> bool:
+        positions = self._positions(key)
+        return self._has(self.current, positions) or self._has(self.previous, positions)
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        if self._has(self.current, positions):
+            return
+        if self.current_count >= self.capacity:
+            self.previous, self.previous_count = self.current, self.current_count
+            self.current, self.current_count = bytearray(self.generation_bytes), 0
+        for p in positions:
+            self.current[p >> 3] |= 1 << (p & 7)
+        self.current_count += 1
+
+    def to_bytes(self) -> bytes:
+        return _HEADER.pack(_VERSION, self.current_count, self.previous_count) + bytes(self.current) + bytes(self.previous)
+
+    def false_positive_rate(self) -> float:
+        """Estimated chance an unseen key tests as seen"""
+        def rate(count):
+            return (1 - math.exp(-_HASHES * count / self.bits)) ** _HASHES
+        current, previous = rate(self.current_count), rate(self.previous_count)
+        return 1 - (1 - current) * (1 - previous)
+
+
+class SeenFilterMetrics:
+    def __init__(self):
+        self.checks = 0
+        # Candidates skipped because a player had seen them
+        self.seen_candidates = 0
+        # Combats that got a seen question after SEEN_MAX_ATTEMPTS candidates
+        self.repeats_served = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "filterBytes": SEEN_FILTER_BYTES,
+            "checks": self.checks,
+            "seenCandidates": self.seen_candidates,
+            "repeatsServed": self.repeats_served,
+        }
+
+
+seen_metrics = SeenFilterMetrics()
+
+
+class ParticipantsSeen:
+    """The seen filters of a combat's players, loaded and saved together"""
+
+    def __init__(self, filters: Dict[int, SeenFilter]):
+        self.filters = filters
+
+    @classmethod
+    async def load(cls, db: AsyncSession, user_ids: Iterable[Optional[int]]) -> "ParticipantsSeen":
+        ids = [user_id for user_id in user_ids if user_id is not None]
+        rows = (await db.execute(select(User.id, User.seen_questions).where(User.id.in_(ids)))).all()
+        return cls({row.id: SeenFilter(row.seen_questions) for row in rows})
+
+    def seen(self, key: str) -> bool:
+        """Whether either player has seen `key` (counted in the metrics)"""
+        seen_metrics.checks += 1
+        if any(key in seen for seen in self.filters.values()):
+            seen_metrics.seen_candidates += 1
+            return True
+        return False
+
+    async def mark(self, db: AsyncSession, key: str):
+        """Record `key` for every player, in the caller's transaction"""
+        for user_id, seen in self.filters.items():
+            seen.add(key)
+            await db.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(seen_questions=seen.to_bytes())
+                .execution_options(synchronize_session=False)
+            )
@@ -1,37 +1,100 @@
 import pytest
+import asyncio
+import anyio
+import httpx
+from fastapi import Header, HTTPException
+from starlette.websockets import WebSocketDisconnect
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 import sys
 import os
+import socket
+import json
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from main import app
-from database import Base, get_db
-from models import User, Combat, ApiKey, Question, CombatState
+from database import Base, get_db, set_sqlite_pragmas
+import database
+from main import determine_winner_and_update_stats, deadline_scheduler, combat_reaper, leaderboard_index, combat_feeds, agent_channel, combat_bus
+from event_bus import CombatEvent, CombatEventType, PostgresCombatEventBus, asyncpg_dsn, create_event_bus
+from main import question_webhooks, question_pool
+import main as main_module
+from question_pool import QuestionPool
+from question_bank import QuestionBank, build_bank, write_bank
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitTimeoutError
+from question_sampler import QuestionSampler
+from repository import LeaderboardCursor, leaderboard_page_query
+from period_stats import check_upsert_support, period_leaderboard_page_query
+import leaderboard as leaderboard_module
+from leaderboard import IndexedSkipList, LeaderboardIndex, RankedUser
+from seen_filter import SeenFilter, SEEN_FILTER_BYTES, question_key, seen_metrics
+from types import SimpleNamespace
+import webhooks
+from webhooks import WebhookDispatcher, is_public_address, sign_payload
+from models import User, Combat, ApiKey, Question, CombatState, CombatQuestion, Submission, TempApiKey
+from auth import hash_token
+from firebase_auth import get_current_firebase_user, VerificationPool
+from cache import IdentityCache, TTLCache, api_key_cache, combat_state_cache, identity_cache
+from token_verifier import FirebaseTokenVerifier, JWKSCache, InvalidTokenError, ExpiredTokenError, parse_max_age
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+AsyncTestingSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+async def override_get_db():
+    async with AsyncTestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+async def override_firebase_user(authorization: str = Header(None)):
+    """Test auth: 'Bearer <uid>' stands in for a verified Firebase ID token"""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing authorization header")
+    return {"uid": authorization.replace("Bearer ", ""), "email": None}
 
 app.dependency_overrides[get_db] = override_get_db
+deadline_scheduler.session_factory = AsyncTestingSessionLocal
+combat_reaper.session_factory = AsyncTestingSessionLocal
+leaderboard_index.session_factory = AsyncTestingSessionLocal
+combat_feeds.session_factory = AsyncTestingSessionLocal
+agent_channel.session_factory = AsyncTestingSessionLocal
+question_webhooks.session_factory = AsyncTestingSessionLocal
+# The test receivers listen on 127.0.0.1
+question_webhooks.allow_private = True
+app.dependency_overrides[get_current_firebase_user] = override_firebase_user
+
+def as_user(uid):
+    return {"Authorization": f"Bearer {uid}"}
+
+def clear_caches():
+    api_key_cache.clear()
+    combat_state_cache.clear()
+    identity_cache.clear()
+    combat_feeds.reset()
 
 @pytest.fixture
 def client():
+    clear_caches()
     Base.metadata.create_all(bind=engine)
     yield TestClient(app)
     Base.metadata.drop_all(bind=engine)
 
 @pytest.fixture
 def db():
+    clear_caches()
     Base.metadata.create_all(bind=engine)
     db = TestingSessionLocal()
     yield db
@@ -50,6 +113,77 @@ def sample_question(db):
     db.refresh(question)
     return question
 
+@pytest.fixture
+def running_combat(db):
+    """A RUNNING combat with an HF question, both API keys and one submission"""
+    user_a = User(username="SnapA", firebase_uid="uid-a")
+    user_b = User(username="SnapB", firebase_uid="uid-b")
+    db.add_all([user_a, user_b])
+    db.commit()
+    combat = Combat(
+        id="snapshot-combat",
+        code="SNAP01",
+        user_a_id=user_a.id,
+        user_b_id=user_b.id,
+        state=CombatState.RUNNING,
+        started_at=datetime.utcnow(),
+        expires_at=datetime.utcnow() + timedelta(minutes=5)
+    )
+    db.add(combat)
+    db.add(CombatQuestion(
+        combat_id=combat.id, dataset="d", config="default", split="validation",
+        row_offset=0, prompt="Q?", choices_json=json.dumps(["yes", "no"]), answer_key_hash="x"
+    ))
+    db.add(ApiKey(combat_id=combat.id, user_id=user_a.id, token_hash=hash_token("key-a")))
+    db.add(ApiKey(combat_id=combat.id, user_id=user_b.id, token_hash=hash_token("key-b")))
+    db.add(Submission(combat_id=combat.id, user_id=user_a.id, answer="yes"))
+    db.commit()
+    return combat.code
+
+@pytest.fixture
+def players(db):
+    """Two registered users; authenticate with as_user('uid-p1') / as_user('uid-p2')"""
+    db.add_all([
+        User(username="PlayerOne", firebase_uid="uid-p1"),
+        User(username="PlayerTwo", firebase_uid="uid-p2"),
+    ])
+    db.commit()
+
+def start_lobby(client):
+    """Create and accept a combat between the two players, returning its code"""
+    code = client.post("/api/combats", json={}, headers=as_user("uid-p1")).json()["code"]
+    assert client.post(f"/api/combats/{code}/accept", headers=as_user("uid-p2")).status_code == 200
+    return code
+
+@contextmanager
+def one_event_loop(client):
+    """Serve every request of `client` from one event loop, like a real server"""
+    with anyio.from_thread.start_blocking_portal() as portal:
+        client.portal = portal
+        try:
+            yield client
+        finally:
+            client.portal = None
+
+@contextmanager
+def count_queries():
+    """Count SQL statements issued through the app's test engine"""
+    counter = {"n": 0}
+    def on_execute(*args):
+        counter["n"] += 1
+    event.listen(async_engine.sync_engine, "before_cursor_execute", on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", on_execute)
+
+def query_plan(stmt):
+    """SQLite's EXPLAIN QUERY PLAN details for a SQLAlchemy statement"""
+    compiled = stmt.compile(dialect=engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    with engine.connect() as conn:
+        return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+
 def test_health_check(client):
     """Test health endpoint"""
     response = client.get("/health")
@@ -192,5 +326,1451 @@ def test_admin_can_list_combats(client):
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
+def test_admin_metrics_reports_db_writes(client):
+    """Test admin metrics expose write lock counters"""
+    headers = {"Authorization": "Bearer admin-secret-token"}
+    response = client.get("/admin/metrics", headers=headers)
+    assert response.status_code == 200
+    data = response.json()["dbWrites"]
+    assert {"writes", "lockWaits", "busyRetries", "busyFailures"} <= set(data)
+
+def test_combat_status_query_count(client, running_combat):
+    """Status polling loads the whole combat in one query"""
+    with count_queries() as queries:
+        response = client.get(f"/api/combats/{running_combat}")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["question"]["choices"] == ["yes", "no"]
+    assert data["submissionsStatus"] == {"SnapA": "submitted", "SnapB": "timeout"}
+    assert queries["n"] == 1
+
+def test_agent_me_query_count(client, running_combat):
+    """Agent assignment: API key lookup plus one snapshot query, then cached key"""
+    with count_queries() as queries:
+        response = client.get("/agent/me", headers={"Authorization": "Bearer key-b"})
+    assert response.status_code == 200
+    assert response.json()["prompt"] == "Q?"
+    assert queries["n"] == 2
+    
+    with count_queries() as queries:
+        response = client.get("/agent/me", headers={"Authorization": "Bearer key-b"})
+    assert response.json()["prompt"] == "Q?"
+    assert queries["n"] == 1
+
+def test_agent_me_waiting_is_served_from_cache(client, running_combat, db):
+    """A waiting agent polling /agent/me costs no queries once its key is cached"""
+    combat = db.query(Combat).filter(Combat.code == running_combat).first()
+    combat.state = CombatState.KEYS_ISSUED
+    db.commit()
+    headers = {"Authorization": "Bearer key-b"}
+    assert client.get("/agent/me", headers=headers).json()["state"] == "KEYS_ISSUED"
+    with count_queries() as queries:
+        response = client.get("/agent/me", headers=headers)
+    assert response.json()["state"] == "KEYS_ISSUED"
+    assert queries["n"] == 0
+    assert api_key_cache.hits >= 1
+
+def test_agent_result_query_count(client, running_combat):
+    """Agent result: API key lookup plus one snapshot query"""
+    with count_queries() as queries:
+        response = client.get("/agent/result", headers={"Authorization": "Bearer key-a"})
+    assert response.status_code == 200
+    assert response.json()["myStatus"] == "submitted"
+    assert queries["n"] == 2
+
+def test_ttl_cache_evicts_and_expires():
+    """TTLCache drops least recently used entries and expired ones"""
+    cache = TTLCache(maxsize=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    cache.set("d", 4, ttl_seconds=0)
+    assert cache.get("d") is None
+    stats = cache.to_dict()
+    assert stats["evictions"] == 2
+    assert stats["expirations"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+
+def test_identity_cache_invalidates_by_user_id_through_evictions():
+    """The user id index follows the cached entries, so invalidation can't miss one"""
+    cache = IdentityCache(maxsize=2, ttl_seconds=60)
+    identity = lambda user_id, uid: SimpleNamespace(id=user_id, firebase_uid=uid)
+    for user_id in range(1, 6):
+        cache.set(f"uid-{user_id}", identity(user_id, f"uid-{user_id}"))
+        cache.get("uid-1")
+    # uid-1 stayed hot through the evictions of the others
+    cache.invalidate_user(1)
+    assert cache.get("uid-1") is None and cache.get("uid-5") is not None
+    cache.invalidate_user(2)
+    assert cache._uids == {5: "uid-5"}
+    cache.clear()
+    assert cache._uids == {}
+
+def test_combat_result_query_count(client, running_combat, db):
+    """Combat result loads the whole combat in one query"""
+    combat = db.query(Combat).filter(Combat.code == running_combat).first()
+    combat.state = CombatState.COMPLETED
+    db.commit()
+    with count_queries() as queries:
+        response = client.get(f"/api/combats/{running_combat}/result")
+    assert response.status_code == 200
+    assert response.json()["userAAnswer"] == "yes"
+    assert queries["n"] == 1
+
+def test_ready_transitions_start_combat(client, players, sample_question):
+    """Both ready flags flip KEYS_ISSUED -> RUNNING exactly once"""
+    code = start_lobby(client)
+    assert client.post(f"/api/combats/{code}/keys").status_code == 200
+    
+    first = client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p1")).json()
+    assert first == {"ok": True, "userAReady": True, "userBReady": False, "state": "KEYS_ISSUED"}
+    
+    second = client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p2")).json()
+    assert second["state"] == "RUNNING"
+    assert second["userAReady"] and second["userBReady"]
+
+def test_identity_is_cached_until_profile_changes(client, players, sample_question, db):
+    """/api/auth/me is served from the identity cache until username or stats change"""
+    assert client.get("/api/auth/me", headers=as_user("uid-p1")).json()["username"] == "PlayerOne"
+    with count_queries() as queries:
+        response = client.get("/api/auth/me", headers=as_user("uid-p1"))
+    assert response.json()["username"] == "PlayerOne"
+    assert queries["n"] == 0
+    
+    response = client.put("/api/auth/username", json={"username": "PlayerUno"}, headers=as_user("uid-p1"))
+    assert response.status_code == 200
+    assert client.get("/api/auth/me", headers=as_user("uid-p1")).json()["username"] == "PlayerUno"
+    
+    # Lobby clicks reuse the cached identity
+    code = start_lobby(client)
+    client.post(f"/api/combats/{code}/keys")
+    with count_queries() as queries:
+        client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p1"))
+    assert queries["n"] == 1
+    
+    # Scoring a combat drops both players' cached profiles
+    combat = db.query(Combat).filter(Combat.code == code).first()
+    combat.state = CombatState.COMPLETED
+    db.commit()
+    asyncio.run(score_in_fresh_session(combat.id))
+    assert client.get("/api/auth/me", headers=as_user("uid-p1")).json()["draws"] == 1
+
+async def score_in_fresh_session(combat_id):
+    async with AsyncTestingSessionLocal() as session:
+        await determine_winner_and_update_stats(await session.get(Combat, combat_id), session)
+
+def test_ready_rejects_non_participant(client, players, db):
+    """A third user cannot mark ready"""
+    db.add(User(username="Outsider", firebase_uid="uid-x"))
+    db.commit()
+    code = start_lobby(client)
+    client.post(f"/api/combats/{code}/keys")
+    response = client.post(f"/api/combats/{code}/ready", headers=as_user("uid-x"))
+    assert response.status_code in (400, 403)
+
+def test_concurrent_key_issuance_claims_once(client, players, sample_question, db):
+    """Concurrent /keys calls: one wins the conditional UPDATE, the rest get 400"""
+    code = start_lobby(client)
+    
+    async def issue_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(*[ac.post(f"/api/combats/{code}/keys") for _ in range(5)])
+    
+    responses = asyncio.run(issue_all())
+    assert sorted(r.status_code for r in responses) == [200, 400, 400, 400, 400]
+    assert db.query(ApiKey).count() == 2
+
+def test_duplicate_submission_hits_unique_index(client, running_combat, db):
+    """Second submission by the same player is rejected"""
+    response = client.post("/agent/submit", headers={"Authorization": "Bearer key-a"}, json={"answer": "no"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Answer already submitted"
+    assert db.query(Submission).count() == 1
+
+def test_second_submission_completes_combat(client, running_combat):
+    """The submission that makes two flips RUNNING -> COMPLETED and scores it"""
+    response = client.post("/agent/submit", headers={"Authorization": "Bearer key-b"}, json={"answer": "no"})
+    assert response.status_code == 200
+    result = client.get(f"/api/combats/{running_combat}/result").json()
+    assert result["isDraw"] is True
+    assert client.get("/api/users/SnapA").json()["draws"] == 1
+
+def test_parallel_completions_keep_exact_totals(db, monkeypatch):
+    """1,000 combats among 10 players scored by overlapping writers: no lost updates"""
+    question = Question(prompt="What is 2+2?", golden_label="4")
+    db.add(question)
+    players = [User(username=f"Racer{i}", firebase_uid=f"uid-r{i}") for i in range(10)]
+    db.add_all(players)
+    db.commit()
+    
+    expected = {p.id: {"wins": 0, "losses": 0, "draws": 0, "total": 0} for p in players}
+    combat_ids = []
+    now = datetime.utcnow()
+    for i in range(1000):
+        a, b = players[i % 10], players[(i * 3 + 1) % 10]
+        if a.id == b.id:
+            b = players[(i + 1) % 10]
+        combat_id = f"race-{i}"
+        combat_ids.append(combat_id)
+        db.add(Combat(
+            id=combat_id, code=f"R{i:05d}", user_a_id=a.id, user_b_id=b.id,
+            state=CombatState.COMPLETED, question_id=question.id
+        ))
+        # i % 3: 0 -> A correct, 1 -> B correct, 2 -> both wrong (draw)
+        db.add(Submission(combat_id=combat_id, user_id=a.id, answer="4" if i % 3 == 0 else "5", submitted_at=now))
+        db.add(Submission(combat_id=combat_id, user_id=b.id, answer="4" if i % 3 == 1 else "5", submitted_at=now))
+        expected[a.id]["total"] += 1
+        expected[b.id]["total"] += 1
+        if i % 3 == 0:
+            expected[a.id]["wins"] += 1
+            expected[b.id]["losses"] += 1
+        elif i % 3 == 1:
+            expected[b.id]["wins"] += 1
+            expected[a.id]["losses"] += 1
+        else:
+            expected[a.id]["draws"] += 1
+            expected[b.id]["draws"] += 1
+    db.commit()
+    
+    # No per-process writer lock: every completion writes on its own pooled
+    # connection, like completions on separate workers, so only the UPDATEs'
+    # own atomicity (plus the busy retry) keeps the counters exact
+    monkeypatch.setattr(database, "get_write_lock", asyncio.Lock)
+    monkeypatch.setattr(database, "WRITE_RETRY_ATTEMPTS", 20)
+    # Eight writers at a time, like eight worker processes
+    workers = asyncio.Semaphore(8)
+    in_flight = {"now": 0, "max": 0}
+    apply_winner_and_stats = main_module._apply_winner_and_stats
+    
+    async def tracked_apply(*args):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        try:
+            return await apply_winner_and_stats(*args)
+        finally:
+            in_flight["now"] -= 1
+    monkeypatch.setattr(main_module, "_apply_winner_and_stats", tracked_apply)
+    
+    async def finish(combat_id):
+        async with workers, AsyncTestingSessionLocal() as session:
+            combat = await session.get(Combat, combat_id)
+            await determine_winner_and_update_stats(combat, session)
+    
+    async def finish_all():
+        # Every combat is finished twice - the second call must be a no-op
+        await asyncio.gather(*[finish(cid) for cid in combat_ids + combat_ids])
+    
+    asyncio.run(finish_all())
+    assert in_flight["max"] > 1
+    
+    db.expire_all()
+    for player in db.query(User).filter(User.username.like("Racer%")).all():
+        assert player.wins == expected[player.id]["wins"]
+        assert player.losses == expected[player.id]["losses"]
+        assert player.draws == expected[player.id]["draws"]
+        assert player.total_combats == expected[player.id]["total"]
+    assert db.query(Combat).filter(Combat.is_draw == 1).count() == 333
+
+def test_status_poll_expires_overdue_combat(client, running_combat, db):
+    """An overdue RUNNING combat is claimed on read and scored in the background"""
+    combat = db.query(Combat).filter(Combat.code == running_combat).first()
+    combat.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    
+    assert client.get(f"/api/combats/{running_combat}").json()["state"] == "EXPIRED"
+    result = client.get(f"/api/combats/{running_combat}/result").json()
+    assert result["isDraw"] is True
+
+def test_deadline_scheduler_expires_unpolled_combats(running_combat, db):
+    """Nobody polls: the scheduler claims overdue combats in batches and scores them"""
+    combat = db.query(Combat).filter(Combat.code == running_combat).first()
+    combat.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    
+    async def run():
+        await deadline_scheduler.rebuild()
+        assert deadline_scheduler.to_dict()["pending"] == 1
+        first = await deadline_scheduler.expire_due()
+        second = await deadline_scheduler.expire_due()
+        return first, second
+    
+    assert asyncio.run(run()) == (1, 0)
+    db.expire_all()
+    combat = db.query(Combat).filter(Combat.code == running_combat).first()
+    assert combat.state == CombatState.EXPIRED
+    assert combat.is_draw == 1
+
+def test_reaper_cleans_abandoned_and_finished_rows(client, running_combat, db):
+    """One reaper pass expires stale lobbies, drops expired temp keys, revokes old keys"""
+    long_ago = datetime.utcnow() - timedelta(days=2)
+    user_a = db.query(User).filter(User.username == "SnapA").first()
+    db.add(Combat(id="stale-lobby", code="STALE1", user_a_id=user_a.id, created_at=long_ago))
+    db.add(Combat(id="fresh-lobby", code="FRESH1", user_a_id=user_a.id))
+    db.add(TempApiKey(combat_id="snapshot-combat", key_a="a", key_b="b", expires_at=long_ago))
+    finished = db.query(Combat).filter(Combat.code == running_combat).first()
+    finished.state = CombatState.COMPLETED
+    finished.completed_at = long_ago
+    db.commit()
+    
+    headers = {"Authorization": "Bearer admin-secret-token"}
+    report = client.post("/admin/reaper/run", headers=headers).json()
+    assert report["lobbiesExpired"] == 1
+    assert report["tempKeysDeleted"] == 1
+    assert report["keysRevoked"] == 2
+    
+    db.expire_all()
+    assert db.query(Combat).filter(Combat.code == "STALE1").first().state == CombatState.EXPIRED
+    assert db.query(Combat).filter(Combat.code == "FRESH1").first().state == CombatState.CREATED
+    assert client.get("/agent/me", headers={"Authorization": "Bearer key-a"}).status_code == 401
+    
+    again = client.post("/admin/reaper/run", headers=headers).json()
+    assert again["lobbiesExpired"] == again["tempKeysDeleted"] == again["keysRevoked"] == 0
+
+def test_reaper_announces_expired_lobbies_and_revoked_keys(client, running_combat, db):
+    """Reaped rows go out on the event bus; every worker drops its cached state and keys"""
+    long_ago = datetime.utcnow() - timedelta(days=2)
+    user_a = db.query(User).filter(User.username == "SnapA").first()
+    db.add(Combat(id="stale-lobby", code="STALE1", user_a_id=user_a.id, created_at=long_ago))
+    finished = db.query(Combat).filter(Combat.code == running_combat).first()
+    finished.state = CombatState.COMPLETED
+    finished.completed_at = long_ago
+    db.commit()
+    client.get("/agent/me", headers={"Authorization": "Bearer key-a"})
+    assert api_key_cache.get(hash_token("key-a")) is not None
+    
+    subscription = combat_bus.subscribe(maxsize=50)
+    try:
+        client.post("/admin/reaper/run", headers={"Authorization": "Bearer admin-secret-token"})
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+    finally:
+        combat_bus.unsubscribe(subscription)
+    
+    expired, revoked = sorted(events, key=lambda e: e.type.value)
+    assert (expired.type, expired.code, expired.state) == (CombatEventType.EXPIRED, "STALE1", "EXPIRED")
+    assert (revoked.type, revoked.combat_id) == (CombatEventType.KEYS_REVOKED, "snapshot-combat")
+    assert sorted(revoked.data["token_hashes"]) == sorted([hash_token("key-a"), hash_token("key-b")])
+    assert api_key_cache.get(hash_token("key-a")) is None
+    
+    # Another worker gets the same events over NOTIFY
+    other_worker = create_event_bus("postgresql://u:p@db/app")
+    other_worker.add_listener(main_module.on_combat_event)
+    api_key_cache.set(hash_token("key-b"), (user_a.id, "snapshot-combat", False))
+    combat_state_cache.set("stale-lobby", ("STALE1", CombatState.CREATED, None))
+    for event in events:
+        other_worker._on_notify(None, 1, other_worker.channel, event.encode())
+    assert api_key_cache.get(hash_token("key-b")) is None
+    assert combat_state_cache.get("stale-lobby") is None
+
+@pytest.fixture(scope="module")
+def signing_key():
+    """Locally generated RSA key standing in for Google's token signing key"""
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def make_verifier(signing_key, fetches, max_age=3600):
+    import jwt
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(signing_key.public_key()))
+    jwk.update({"kid": "test-kid", "alg": "RS256", "use": "sig"})
+    def fetch():
+        fetches.append(1)
+        return {"keys": [jwk]}, max_age
+    return FirebaseTokenVerifier("test-project", jwks=JWKSCache(fetch=fetch))
+
+def make_id_token(signing_key, uid="uid-1", expires_in=3600, kid="test-kid", audience="test-project"):
+    import jwt
+    now = int(datetime.utcnow().timestamp())
+    claims = {
+        "iss": "https://securetoken.google.com/test-project",
+        "aud": audience,
+        "sub": uid,
+        "iat": now - 10,
+        "auth_time": now - 10,
+        "exp": now + expires_in,
+        "email": f"{uid}@example.com",
+    }
+    return jwt.encode(claims, signing_key, algorithm="RS256", headers={"kid": kid})
+
+def test_token_verifier_caches_keys_and_claims(signing_key):
+    """Keys are fetched once and repeat tokens skip the signature check"""
+    fetches = []
+    verifier = make_verifier(signing_key, fetches)
+    token = make_id_token(signing_key)
+    
+    claims = verifier.verify(token)
+    assert claims["uid"] == "uid-1"
+    assert claims["email"] == "uid-1@example.com"
+    assert verifier.verify(token)["uid"] == "uid-1"
+    assert verifier.verify(make_id_token(signing_key, uid="uid-2"))["uid"] == "uid-2"
+    
+    assert len(fetches) == 1
+    assert verifier.signature_checks == 2
+    assert verifier.claims_cache.hits == 1
+
+def test_token_verifier_rejects_bad_tokens(signing_key):
+    """Expired, foreign-audience, unknown-key and tampered tokens are rejected"""
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    verifier = make_verifier(signing_key, [])
+    
+    with pytest.raises(ExpiredTokenError):
+        verifier.verify(make_id_token(signing_key, expires_in=-3600))
+    with pytest.raises(InvalidTokenError):
+        verifier.verify(make_id_token(signing_key, audience="other-project"))
+    with pytest.raises(InvalidTokenError):
+        verifier.verify(make_id_token(signing_key, kid="unknown-kid"))
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with pytest.raises(InvalidTokenError):
+        verifier.verify(make_id_token(other_key))
+    assert len(verifier.claims_cache) == 0
+
+def test_jwks_cache_honours_max_age(signing_key):
+    """Keys are refetched once the Cache-Control max-age has run out"""
+    fetches = []
+    verifier = make_verifier(signing_key, fetches, max_age=0)
+    verifier.verify(make_id_token(signing_key, uid="uid-1"))
+    verifier.verify(make_id_token(signing_key, uid="uid-2"))
+    assert len(fetches) == 2
+    assert parse_max_age("public, max-age=19204, must-revalidate, no-transform") == 19204
+    assert parse_max_age("no-cache") is None
+
+def test_verification_pool_bounds_queue():
+    """Verifications run off the event loop and excess waiters get 503"""
+    import threading
+    release = threading.Event()
+    pool = VerificationPool(workers=1, max_queue=1)
+    
+    async def scenario():
+        first = asyncio.create_task(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(pool.run(lambda: "queued"))
+        await asyncio.sleep(0)
+        assert pool.to_dict()["running"] == 1
+        assert pool.to_dict()["queued"] == 1
+        with pytest.raises(HTTPException) as exc:
+            await pool.run(lambda: "rejected")
+        assert exc.value.status_code == 503
+        release.set()
+        return await first, await second
+    
+    assert asyncio.run(scenario()) == (True, "queued")
+    stats = pool.to_dict()
+    assert stats["submitted"] == 2
+    assert stats["rejected"] == 1
+    assert stats["queued"] == 0
+
+def test_verification_pool_releases_cancelled_waiters():
+    """Verifications cancelled while queued don't count against the bound"""
+    import threading
+    release = threading.Event()
+    pool = VerificationPool(workers=1, max_queue=2)
+    
+    async def scenario():
+        first = asyncio.create_task(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        for _ in range(3):
+            waiters = [asyncio.create_task(pool.run(lambda: "queued")) for _ in range(2)]
+            await asyncio.sleep(0)
+            assert pool.queued == 2
+            for waiter in waiters:
+                waiter.cancel()
+            await asyncio.gather(*waiters, return_exceptions=True)
+            assert pool.in_flight == 1
+        release.set()
+        return await first
+    
+    assert asyncio.run(scenario()) is True
+    assert pool.in_flight == 0 and pool.rejected == 0
+
+def test_leaderboard_index_matches_full_sort(client, db):
+    """The ranked index orders, filters and counts like a full sort would"""
+    import random
+    rng = random.Random(7)
+    users = []
+    for i in range(300):
+        wins, losses, draws = rng.randint(0, 120), rng.randint(0, 40), rng.randint(0, 10)
+        users.append(User(
+            username=f"Ranked{i}", firebase_uid=f"uid-ranked{i}",
+            wins=wins, losses=losses, draws=draws, total_combats=wins + losses + draws
+        ))
+    db.add_all(users)
+    db.commit()
+    asyncio.run(leaderboard_index.rebuild())
+    
+    ranked = sorted(
+        (u for u in users if u.total_combats > 0),
+        key=lambda u: (-u.score, -u.wins, -(u.wins / u.total_combats), u.id)
+    )
+    data = client.get("/api/leaderboard?limit=500").json()
+    assert data["totalUsers"] == len(ranked)
+    assert [e["username"] for e in data["entries"]] == [u.username for u in ranked]
+    
+    gold = [u for u in ranked if u.rank == "Gold"]
+    data = client.get("/api/leaderboard?limit=5&rank=gold").json()
+    assert data["totalUsers"] == len(gold)
+    assert [e["username"] for e in data["entries"]] == [u.username for u in gold[:5]]
+    
+    last = ranked[-1]
+    assert leaderboard_index.position(last.id) == len(ranked)
+    assert leaderboard_index.position(gold[0].id, tier="Gold") == 1
+
+def test_leaderboard_index_follows_scoring(client, players, sample_question, db):
+    """Scoring a combat moves both players in the index without a rebuild"""
+    asyncio.run(leaderboard_index.rebuild())
+    rebuilds = leaderboard_index.rebuilds
+    assert client.get("/api/leaderboard").json()["totalUsers"] == 0
+    
+    code = start_lobby(client)
+    combat = db.query(Combat).filter(Combat.code == code).first()
+    combat.state = CombatState.COMPLETED
+    db.commit()
+    asyncio.run(score_in_fresh_session(combat.id))
+    
+    data = client.get("/api/leaderboard").json()
+    assert data["totalUsers"] == 2
+    assert {e["username"] for e in data["entries"]} == {"PlayerOne", "PlayerTwo"}
+    assert all(e["draws"] == 1 for e in data["entries"])
+    assert leaderboard_index.total() == 2 and leaderboard_index.rebuilds == rebuilds
+
+def test_skip_list_built_from_sorted_input_matches_inserts():
+    """The O(n) bulk build gives the same positions, and stays updatable"""
+    import random
+    keys = random.Random(3).sample(range(10000), 500)
+    built = IndexedSkipList.from_sorted((key, key) for key in sorted(keys))
+    assert len(built) == 500
+    assert all(built.index_of(key) == i for i, key in enumerate(sorted(keys)))
+    assert list(built.iter_from(490)) == sorted(keys)[490:]
+    
+    built.insert(-1, -1)
+    built.remove(sorted(keys)[10])
+    expected = sorted([-1] + keys)
+    expected.remove(sorted(keys)[10])
+    assert list(built.iter_from(0)) == expected
+    assert built.index_of(expected[-1]) == len(expected) - 1
+    assert len(IndexedSkipList.from_sorted([])) == 0
+
+def test_leaderboard_rebuild_builds_off_loop_and_keeps_concurrent_updates(db, monkeypatch):
+    """A resync builds on a worker thread; scores applied meanwhile survive the swap"""
+    db.add_all([
+        User(username=f"Resync{i}", firebase_uid=f"uid-resync{i}", wins=i, total_combats=i + 1)
+        for i in range(20)
+    ])
+    db.commit()
+    index = LeaderboardIndex(AsyncTestingSessionLocal)
+    building, release = threading.Event(), threading.Event()
+    build_views = leaderboard_module._build_views
+    
+    def slow_build(rows):
+        assert threading.current_thread() is not threading.main_thread()
+        building.set()
+        release.wait(5)
+        return build_views(rows)
+    monkeypatch.setattr(leaderboard_module, "_build_views", slow_build)
+    
+    async def scenario():
+        rebuild = asyncio.create_task(index.rebuild())
+        while not building.is_set():
+            await asyncio.sleep(0.01)
+        # The loop stays free during the build; a combat is scored meanwhile
+        index.upsert(RankedUser(10**6, "Latecomer", 50, 0, 0, 50))
+        release.set()
+        await rebuild
+    asyncio.run(scenario())
+    assert len(index) == 21
+    assert index.position(10**6) == 1 and index.get_by_username("Resync19") is not None
+
+def test_scored_combat_event_updates_other_workers_index(client, players, sample_question, db, monkeypatch):
+    """The COMPLETED event carries both players' counters; any worker applies them"""
+    code = start_lobby(client)
+    combat = db.query(Combat).filter(Combat.code == code).first()
+    combat.state = CombatState.COMPLETED
+    db.commit()
+    subscription = combat_bus.subscribe(maxsize=50)
+    try:
+        asyncio.run(score_in_fresh_session(combat.id))
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+    finally:
+        combat_bus.unsubscribe(subscription)
+    completed = next(e for e in events if e.type == CombatEventType.COMPLETED)
+    assert {u["username"] for u in completed.data["users"]} == {"PlayerOne", "PlayerTwo"}
+    
+    # A worker whose index has never seen these players gets it over NOTIFY
+    other_index = LeaderboardIndex(None)
+    monkeypatch.setattr(main_module, "leaderboard_index", other_index)
+    other_worker = create_event_bus("postgresql://u:p@db/app")
+    other_worker.add_listener(main_module.on_combat_event)
+    other_worker._on_notify(None, 1, other_worker.channel, completed.encode())
+    assert len(other_index) == 2
+    assert other_index.get_by_username("PlayerOne").draws == 1
+
+def test_user_rank_with_neighbours(client, db):
+    """A user's position and neighbours come from the ranked index"""
+    users = [
+        User(username=f"Stand{i}", firebase_uid=f"uid-stand{i}", wins=i, losses=0, draws=0, total_combats=max(i, 1))
+        for i in range(20)
+    ]
+    users.append(User(username="Fresh", firebase_uid="uid-fresh"))
+    db.add_all(users)
+    db.commit()
+    asyncio.run(leaderboard_index.rebuild())
+    
+    data = client.get("/api/users/Stand10/rank?neighbors=2").json()
+    assert data["position"] == 10
+    assert data["totalUsers"] == 20
+    assert data["entry"]["username"] == "Stand10"
+    assert [(e["position"], e["username"]) for e in data["above"]] == [(8, "Stand12"), (9, "Stand11")]
+    assert [(e["position"], e["username"]) for e in data["below"]] == [(11, "Stand9"), (12, "Stand8")]
+    
+    top = client.get("/api/users/Stand19/rank?neighbors=3").json()
+    assert top["position"] == 1 and top["above"] == []
+    
+    assert client.get("/api/users/Stand19").json()["position"] == 1
+    unranked = client.get("/api/users/Fresh/rank").json()
+    assert unranked["position"] is None
+    assert client.get("/api/users/Fresh").json()["position"] is None
+    assert client.get("/api/users/Nobody/rank").status_code == 404
+
+def test_leaderboard_totals_come_from_the_page_source(client, players, sample_question, db):
+    """Page totals are counted with the page; rank lookups follow scoring at once"""
+    asyncio.run(leaderboard_index.rebuild())
+    # Written behind the index's back (e.g. by a worker whose event was lost)
+    db.add(User(username="Unindexed", firebase_uid="uid-unindexed", wins=3, total_combats=3))
+    db.commit()
+    data = client.get("/api/leaderboard").json()
+    assert data["totalUsers"] == len(data["entries"]) == 1
+    assert client.get("/api/leaderboard?rank=bronze").json()["totalUsers"] == 1
+    assert client.get("/api/users/Unindexed/rank").json()["totalUsers"] == 0
+    
+    # A scored combat reaches the index through its event, with no resync
+    code = start_lobby(client)
+    combat = db.query(Combat).filter(Combat.code == code).first()
+    combat.state = CombatState.COMPLETED
+    db.commit()
+    asyncio.run(score_in_fresh_session(combat.id))
+    rank = client.get("/api/users/PlayerOne/rank").json()
+    assert rank["totalUsers"] == 2 and rank["position"] in (1, 2)
+    assert client.get("/api/leaderboard").json()["totalUsers"] == 3
+
+def test_leaderboard_keyset_page_seeks_the_index(client):
+    """A deep page is an index range search from the cursor, not a scan up to it"""
+    after = LeaderboardCursor(points=30, wins=10, win_rate=0.5, user_id=42, position=5000)
+    assert query_plan(leaderboard_page_query(50, after=after)) == [
+        "SEARCH users USING INDEX ix_users_leaderboard (points<?)"
+    ]
+    assert query_plan(leaderboard_page_query(50, tier="Gold", after=after)) == [
+        "SEARCH users USING INDEX ix_users_tier_leaderboard (tier=? AND points<?)"
+    ]
+
+def test_period_leaderboard_keyset_page_seeks_the_index(client):
+    """The period board's deep pages seek the bucket index from the cursor too"""
+    after = LeaderboardCursor(points=30, wins=10, win_rate=0.5, user_id=42, position=5000)
+    for tier in (None, "Gold"):
+        assert query_plan(period_leaderboard_page_query("week", "all", 50, tier=tier, after=after))[0] == (
+            "SEARCH user_period_stats USING INDEX ix_user_period_stats_leaderboard "
+            "(period=? AND period_start=? AND mode=? AND points<?)"
+        )
+
+def test_period_stats_rejects_databases_without_upserts():
+    """An unsupported database fails at startup, not on the first scored combat"""
+    check_upsert_support("sqlite")
+    check_upsert_support("postgresql")
+    with pytest.raises(RuntimeError):
+        check_upsert_support("mysql")
+
+def test_leaderboard_cursor_pagination(client, db):
+    """Walking pages with nextCursor yields the full order, globally and per tier"""
+    import random
+    rng = random.Random(11)
+    users = []
+    for i in range(120):
+        wins, losses, draws = rng.randint(0, 60), rng.randint(0, 5), rng.randint(0, 3)
+        users.append(User(
+            username=f"Paged{i}", firebase_uid=f"uid-paged{i}",
+            wins=wins, losses=losses, draws=draws, total_combats=wins + losses + draws
+        ))
+    db.add_all(users)
+    db.commit()
+    asyncio.run(leaderboard_index.rebuild())
+    ranked = sorted(
+        (u for u in users if u.total_combats > 0),
+        key=lambda u: (-u.score, -u.wins, -(u.wins / u.total_combats), u.id)
+    )
+    
+    def walk(query):
+        seen, cursor = [], None
+        while True:
+            url = f"/api/leaderboard?limit=7{query}" + (f"&cursor={cursor}" if cursor else "")
+            data = client.get(url).json()
+            seen += [(e["position"], e["username"]) for e in data["entries"]]
+            cursor = data["nextCursor"]
+            if not cursor:
+                return seen, data["totalUsers"]
+    
+    seen, total = walk("")
+    assert seen == [(i, u.username) for i, u in enumerate(ranked, start=1)]
+    assert total == len(ranked)
+    
+    gold = [u for u in ranked if u.rank == "Gold"]
+    seen, total = walk("&rank=Gold")
+    assert seen == [(i, u.username) for i, u in enumerate(gold, start=1)]
+    assert total == len(gold)
+    
+    assert client.get("/api/leaderboard?cursor=not-a-cursor").status_code == 400
+
+def test_windowed_and_mode_leaderboards(client, players, sample_question, db):
+    """Weekly and per-mode boards only count combats in that window / mode"""
+    asyncio.run(leaderboard_index.rebuild())
+    for mode, completed_at in [("formal_logic", datetime.utcnow()), ("argument_logic", datetime.utcnow() - timedelta(days=40))]:
+        code = client.post("/api/combats", json={"mode": mode}, headers=as_user("uid-p1")).json()["code"]
+        client.post(f"/api/combats/{code}/accept", headers=as_user("uid-p2"))
+        combat = db.query(Combat).filter(Combat.code == code).first()
+        combat.state = CombatState.COMPLETED
+        combat.completed_at = completed_at
+        db.commit()
+        asyncio.run(score_in_fresh_session(combat.id))
+    
+    def board(query):
+        data = client.get(f"/api/leaderboard?{query}").json()
+        return data["totalUsers"], sorted((e["username"], e["draws"]) for e in data["entries"])
+    
+    assert board("window=all") == (2, [("PlayerOne", 2), ("PlayerTwo", 2)])
+    assert board("window=week") == (2, [("PlayerOne", 1), ("PlayerTwo", 1)])
+    assert board("window=month&mode=formal_logic") == (2, [("PlayerOne", 1), ("PlayerTwo", 1)])
+    assert board("mode=argument_logic") == (2, [("PlayerOne", 1), ("PlayerTwo", 1)])
+    assert board("window=week&mode=argument_logic") == (0, [])
+    assert client.get("/api/leaderboard?window=year").status_code == 400
+    assert client.get("/api/leaderboard?mode=trivia").status_code == 400
+    
+    headers = {"Authorization": "Bearer admin-secret-token"}
+    assert client.post("/admin/leaderboard/rebuild-periods", headers=headers).json() == {"combats": 2}
+    assert board("window=week") == (2, [("PlayerOne", 1), ("PlayerTwo", 1)])
+
+def test_combat_event_stream_snapshot_deltas_and_resume(client, players, sample_question, db):
+    """One snapshot on connect, then only changed fields; Last-Event-ID replays the gap"""
+    code = client.post("/api/combats", json={}, headers=as_user("uid-p1")).json()["code"]
+    
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            subscription, initial = await combat_feeds.open(code)
+            assert [e.type for e in initial] == ["snapshot"]
+            assert initial[0].data["state"] == "CREATED" and initial[0].data["userBUsername"] is None
+            
+            await ac.post(f"/api/combats/{code}/accept", headers=as_user("uid-p2"))
+            accepted = await asyncio.wait_for(subscription.queue.get(), 5)
+            assert accepted.type == "accepted"
+            assert set(accepted.data) == {"state", "userBUsername", "acceptedAt"}
+            assert accepted.data["userBUsername"] == "PlayerTwo"
+            
+            await ac.post(f"/api/combats/{code}/keys")
+            keys = await asyncio.wait_for(subscription.queue.get(), 5)
+            assert keys.type == "keys_issued" and keys.data["state"] == "KEYS_ISSUED"
+            
+            # Resume from the snapshot: exactly the two missed events
+            resumed, replay = await combat_feeds.open(code, last_event_id=initial[0].id)
+            assert [e.id for e in replay] == [accepted.id, keys.id]
+            # Unknown id: fresh snapshot instead
+            fresh, snapshot = await combat_feeds.open(code, last_event_id="stale-3")
+            assert [e.type for e in snapshot] == ["snapshot"] and snapshot[0].data["state"] == "KEYS_ISSUED"
+            
+            # Wire format of the stream body
+            body = combat_feeds.stream(fresh, snapshot)
+            assert (await body.__anext__()).startswith("retry: ")
+            assert (await body.__anext__()).startswith(f"id: {snapshot[0].id}\nevent: snapshot\ndata: ")
+            await body.aclose()
+            for sub in (subscription, resumed):
+                combat_feeds.close(sub)
+            assert combat_feeds.to_dict()["streams"] == 0
+    
+    asyncio.run(scenario())
+    assert client.get("/api/combats/NOPE00/events").status_code == 404
+
+def test_agent_websocket_pushes_question_and_result(client, players, sample_question):
+    """The question arrives when the combat starts, answers go over the socket, the result is pushed"""
+    with one_event_loop(client):
+        code = start_lobby(client)
+        keys = client.post(f"/api/combats/{code}/keys").json()
+        
+        with client.websocket_connect("/agent/ws", headers={"Authorization": f"Bearer {keys['keyA']}"}) as ws:
+            first = ws.receive_json()
+            assert (first["type"], first["state"]) == ("state", "KEYS_ISSUED")
+            
+            client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p1"))
+            client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p2"))
+            question = ws.receive_json()
+            assert question["type"] == "question" and question["state"] == "RUNNING"
+            assert question["prompt"] == "What is 2+2?" and question["deadlineTs"]
+            
+            ws.send_json({"type": "submit", "answer": "4"})
+            assert ws.receive_json() == {"type": "submitted", "ok": True, "status": "submitted"}
+            ws.send_json({"type": "submit", "answer": "5"})
+            assert ws.receive_json() == {"type": "error", "status": 400, "detail": "Answer already submitted"}
+            
+            client.post("/agent/submit", headers={"Authorization": f"Bearer {keys['keyB']}"}, json={"answer": "3"})
+            result = ws.receive_json()
+            assert result["type"] == "result" and result["state"] == "COMPLETED"
+            assert (result["myAnswer"], result["opponentAnswer"]) == ("4", "3")
+            with pytest.raises(WebSocketDisconnect):
+                ws.receive_json()
+        
+        with pytest.raises(WebSocketDisconnect):
+            with client.websocket_connect("/agent/ws", headers={"Authorization": "Bearer nope"}) as ws:
+                ws.receive_json()
+    assert agent_channel.to_dict()["openSockets"] == 0
+
+def test_agent_long_polling_wakes_on_start(client, players, sample_question):
+    """?wait= holds /agent/me until the combat starts, and times out cleanly otherwise"""
+    import threading, time
+    with one_event_loop(client):
+        code = start_lobby(client)
+        keys = client.post(f"/api/combats/{code}/keys").json()
+        agent = {"Authorization": f"Bearer {keys['keyA']}"}
+        
+        started = time.perf_counter()
+        assert client.get("/agent/me?wait=0.3", headers=agent).json()["state"] == "KEYS_ISSUED"
+        assert time.perf_counter() - started >= 0.3
+        
+        parked = {}
+        def long_poll():
+            parked["response"] = client.get("/agent/me?wait=20", headers=agent).json()
+            parked["elapsed"] = time.perf_counter() - started
+        thread = threading.Thread(target=long_poll)
+        started = time.perf_counter()
+        thread.start()
+        time.sleep(0.3)
+        client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p1"))
+        client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p2"))
+        thread.join(10)
+        assert parked["response"]["state"] == "RUNNING"
+        assert parked["response"]["prompt"] == "What is 2+2?"
+        assert parked["elapsed"] < 5
+        
+        client.post("/agent/submit", headers=agent, json={"answer": "4"})
+        client.post("/agent/submit", headers={"Authorization": f"Bearer {keys['keyB']}"}, json={"answer": "4"})
+        # Already finished: answered at once
+        started = time.perf_counter()
+        assert client.get("/agent/result?wait=20", headers=agent).json()["state"] == "COMPLETED"
+        assert time.perf_counter() - started < 5
+    assert agent_channel.to_dict()["longPollTimeouts"] >= 1
+
+def test_event_bus_delivers_lifecycle_in_order(client, players, sample_question):
+    """One typed event per transition, delivered after commit, in order"""
+    subscription = combat_bus.subscribe(maxsize=50)
+    try:
+        with one_event_loop(client):
+            code = start_lobby(client)
+            keys = client.post(f"/api/combats/{code}/keys").json()
+            client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p1"))
+            client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p2"))
+            client.post("/agent/submit", headers={"Authorization": f"Bearer {keys['keyA']}"}, json={"answer": "4"})
+            client.post("/agent/submit", headers={"Authorization": f"Bearer {keys['keyB']}"}, json={"answer": "3"})
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+    finally:
+        combat_bus.unsubscribe(subscription)
+    
+    assert [e.type for e in events] == [
+        CombatEventType.ACCEPTED, CombatEventType.KEYS_ISSUED, CombatEventType.READY,
+        CombatEventType.STARTED, CombatEventType.SUBMISSION, CombatEventType.COMPLETED,
+    ]
+    assert {e.code for e in events} == {code}
+    assert [e.state for e in events] == ["ACCEPTED", "KEYS_ISSUED", "KEYS_ISSUED", "RUNNING", "RUNNING", "COMPLETED"]
+
+def test_event_bus_drops_rolled_back_events_and_bounds_queues(db):
+    """Events of a rolled-back transaction are never delivered; full queues drop and flag"""
+    subscription = combat_bus.subscribe(maxsize=1)
+    event = CombatEvent(CombatEventType.ACCEPTED, "c1", "CODE01", "ACCEPTED")
+    
+    async def scenario():
+        async with AsyncTestingSessionLocal() as session:
+            await combat_bus.emit(session, event)
+            await session.rollback()
+            await session.commit()
+        assert subscription.queue.empty()
+        async with AsyncTestingSessionLocal() as session:
+            await combat_bus.emit(session, event)
+            await combat_bus.emit(session, event)
+            await session.commit()
+    try:
+        asyncio.run(scenario())
+        assert subscription.queue.qsize() == 1
+        assert subscription.overflowed and subscription.dropped == 1
+    finally:
+        combat_bus.unsubscribe(subscription)
+
+def test_postgres_event_bus_wire_format():
+    """NOTIFY payloads round-trip; malformed ones are counted and skipped"""
+    bus = create_event_bus("postgresql://u:p@db/app")
+    assert isinstance(bus, PostgresCombatEventBus) and bus.dsn == "postgresql://u:p@db/app"
+    assert not isinstance(create_event_bus("sqlite:///./combat.db"), PostgresCombatEventBus)
+    for url in ("postgresql+asyncpg://u:p@db/app", "postgresql+psycopg://u:p@db/app",
+                "postgresql+psycopg2://u:p@db/app", "postgres://u:p@db/app"):
+        assert asyncpg_dsn(url) == "postgresql://u:p@db/app", url
+    assert asyncpg_dsn("postgresql+psycopg://u:p%40ss@db:5433/app?sslmode=require") == (
+        "postgresql://u:p%40ss@db:5433/app?sslmode=require"
+    )
+    
+    received = []
+    bus.add_listener(received.append)
+    event = CombatEvent(CombatEventType.STARTED, "c1", "CODE01", "RUNNING", user_id=7)
+    bus._on_notify(None, 1, bus.channel, event.encode())
+    bus._on_notify(None, 1, bus.channel, "{not json")
+    assert received == [event]
+    assert bus.to_dict()["decodeErrors"] == 1
+
+class WebhookReceiver:
+    """Local stand-in for an agent's webhook endpoint"""
+    
+    def __init__(self, fail_first=0, delay=0.0, status=503):
+        self.fail_first, self.delay, self.status = fail_first, delay, status
+        self.requests = []
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+        receiver = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                with receiver.lock:
+                    receiver.active += 1
+                    receiver.max_active = max(receiver.max_active, receiver.active)
+                    receiver.requests.append((dict(self.headers), body))
+                    failing = len(receiver.requests) <= receiver.fail_first
+                time.sleep(receiver.delay)
+                with receiver.lock:
+                    receiver.active -= 1
+                self.send_response(receiver.status if failing else 200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def wait_for(self, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while len(self.requests) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(self.requests) >= count
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def test_agent_webhook_gets_question_without_blocking_ready(client, players, sample_question):
+    """The question is POSTed (and retried) off the request path once the combat starts"""
+    receiver = WebhookReceiver(fail_first=1, delay=0.3)
+    question_webhooks.backoff_seconds = 0.01
+    try:
+        with one_event_loop(client):
+            code = start_lobby(client)
+            keys = client.post(f"/api/combats/{code}/keys").json()
+            agent = {"Authorization": f"Bearer {keys['keyA']}"}
+            
+            assert client.put("/agent/webhook", headers=agent, json={"url": "ftp://x"}).status_code == 400
+            registered = client.put("/agent/webhook", headers=agent, json={"url": receiver.url}).json()
+            assert registered == {"ok": True, "url": receiver.url, "deliveryQueued": False}
+            
+            client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p1"))
+            started = time.monotonic()
+            response = client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p2"))
+            assert response.json()["state"] == "RUNNING"
+            # The receiver takes 0.3 s per request; ready must not wait for it
+            assert time.monotonic() - started < 0.3
+            
+            assert receiver.wait_for(2)
+            while question_webhooks.pending and time.monotonic() - started < 5:
+                time.sleep(0.01)
+            metrics = client.get("/admin/metrics", headers={"Authorization": "Bearer admin-secret-token"}).json()
+    finally:
+        receiver.close()
+        question_webhooks.backoff_seconds = 0.5
+    
+    headers, body = receiver.requests[-1]
+    payload = json.loads(body)
+    assert payload["type"] == "question" and payload["state"] == "RUNNING"
+    assert payload["prompt"] == "What is 2+2?" and payload["deadlineTs"]
+    assert headers["X-Webhook-Event"] == "question"
+    assert headers["X-Webhook-Signature"] == sign_payload(body, hash_token(keys["keyA"]))
+    # Retries reuse the delivery id
+    assert receiver.requests[0][0]["X-Webhook-Delivery"] == headers["X-Webhook-Delivery"]
+    assert metrics["webhooks"]["delivered"] == 1 and metrics["webhooks"]["retries"] == 1
+
+def test_webhook_dispatcher_limits_per_target_and_gives_up():
+    """At most target_concurrency requests per host; 4xx responses are final"""
+    slow = WebhookReceiver(delay=0.1)
+    rejecting = WebhookReceiver(fail_first=100, status=400)
+    dispatcher = WebhookDispatcher(workers=8, target_concurrency=2, backoff_seconds=0.01, allow_private=True)
+    
+    async def scenario():
+        for i in range(6):
+            dispatcher.enqueue(slow.url, {"n": i}, "test")
+        dispatcher.enqueue(rejecting.url, {"n": 0}, "test")
+        while dispatcher.pending:
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+    try:
+        asyncio.run(scenario())
+    finally:
+        slow.close()
+        rejecting.close()
+    
+    assert len(slow.requests) == 6 and slow.max_active == 2
+    assert len(rejecting.requests) == 1
+    metrics = dispatcher.to_dict()
+    assert (metrics["delivered"], metrics["failed"], metrics["retries"]) == (6, 1, 0)
+    assert metrics["latencyMs"]["p95"] >= 100
+
+def test_webhook_targets_must_be_public_addresses():
+    """Loopback, private, link-local, reserved and multicast addresses are refused"""
+    for address in ("127.0.0.1", "10.0.0.5", "172.16.0.1", "192.168.1.1", "169.254.169.254",
+                    "100.64.0.1", "240.0.0.1", "0.0.0.0", "224.0.0.1", "::1", "fe80::1", "fc00::1",
+                    "::ffff:127.0.0.1"):
+        assert not is_public_address(address), address
+    assert is_public_address("93.184.216.34") and is_public_address("2606:4700::1")
+
+def test_agent_webhook_rejects_private_targets_at_registration_and_delivery(client, players, sample_question, monkeypatch):
+    """A URL must resolve publicly when registered, and again when the question is sent (DNS rebinding)"""
+    receiver = WebhookReceiver()
+    answers = {"hooks.example": ["93.184.216.34"]}
+    resolve_for_real = webhooks._resolve
+    async def resolve(host, port):
+        if host == "nowhere.invalid":
+            raise socket.gaierror("Name or service not known")
+        return answers[host] if host in answers else await resolve_for_real(host, port)
+    monkeypatch.setattr(webhooks, "_resolve", resolve)
+    monkeypatch.setattr(question_webhooks, "allow_private", False)
+    try:
+        with one_event_loop(client):
+            code = start_lobby(client)
+            keys = client.post(f"/api/combats/{code}/keys").json()
+            agent = {"Authorization": f"Bearer {keys['keyA']}"}
+            for url in (receiver.url, "http://169.254.169.254/latest/meta-data", "http://[::1]/hook", "http://nowhere.invalid/"):
+                assert client.put("/agent/webhook", headers=agent, json={"url": url}).status_code == 400, url
+            
+            hook = f"http://hooks.example:{receiver.server.server_port}/hook"
+            assert client.put("/agent/webhook", headers=agent, json={"url": hook}).json()["ok"]
+            # The name now points at the server's own network
+            answers["hooks.example"] = ["127.0.0.1"]
+            failed = question_webhooks.failed
+            client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p1"))
+            client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p2"))
+            deadline = time.monotonic() + 5
+            while question_webhooks.failed == failed and time.monotonic() < deadline:
+                time.sleep(0.01)
+    finally:
+        receiver.close()
+    assert question_webhooks.failed == failed + 1
+    assert receiver.requests == []
+
+def test_webhook_dispatcher_connects_to_the_checked_address(monkeypatch):
+    """The request goes to the address that passed the check, with the URL's Host header"""
+    receiver = WebhookReceiver()
+    async def resolve(host, port):
+        assert host == "hooks.example"
+        return ["127.0.0.1"]
+    monkeypatch.setattr(webhooks, "_resolve", resolve)
+    dispatcher = WebhookDispatcher(allow_private=True)
+    hook = f"http://hooks.example:{receiver.server.server_port}/hook"
+    
+    async def scenario():
+        dispatcher.enqueue(hook, {"n": 1}, "test")
+        while dispatcher.pending:
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+    try:
+        asyncio.run(scenario())
+    finally:
+        receiver.close()
+    assert dispatcher.delivered == 1
+    assert receiver.requests[0][0]["Host"] == f"hooks.example:{receiver.server.server_port}"
+
+def fake_hf_question(salt, mode):
+    """Stand-in for question_service.create_combat_question"""
+    question = SimpleNamespace(
+        dataset="test/dataset", config="default", split="validation", row_offset=salt % 100,
+        prompt=f"{mode} question?", choices=["yes", "no"]
+    )
+    return question, f"hash-{salt}"
+
+async def fake_fetch(mode, salts=iter(range(1, 10**6))):
+    """Stand-in for main.fetch_question: (question, answer hash, salt)"""
+    salt = next(salts)
+    return (*fake_hf_question(salt, mode), salt)
+
+def test_question_pool_refills_to_low_water_in_background():
+    """Pops are served from memory and trigger a background refill; failures are counted"""
+    calls = []
+    async def fetch(mode):
+        calls.append(mode)
+        if mode == "argument_logic" and calls.count(mode) == 1:
+            raise RuntimeError("HF unavailable")
+        return await fake_fetch(mode)
+    pool = QuestionPool(fetch, low_water=3, retry_seconds=0.01)
+    
+    async def scenario():
+        await pool.start()
+        async def filled():
+            while pool.size("formal_logic") < 3 or pool.size("argument_logic") < 3:
+                await asyncio.sleep(0.01)
+        await asyncio.wait_for(filled(), 5)
+        question = pool.pop("formal_logic")
+        assert question.answer_hash == f"hash-{question.salt}"
+        assert pool.pop("chess") is None
+        await asyncio.wait_for(filled(), 5)
+        await pool.stop()
+    asyncio.run(scenario())
+    
+    metrics = pool.to_dict()
+    formal, argument = metrics["modes"]["formal_logic"], metrics["modes"]["argument_logic"]
+    assert (formal["hits"], formal["misses"], formal["refilled"], formal["size"]) == (1, 0, 4, 3)
+    assert (argument["refillFailures"], argument["refilled"]) == (1, 3)
+    assert formal["refillMs"]["p50"] is not None and metrics["unknownModeMisses"] == 1
+
+def test_issue_keys_uses_pooled_question_and_its_salt(client, players, db, monkeypatch):
+    """Keys are issued with a pooled question, and answers are checked against its salt"""
+    monkeypatch.setattr(question_pool, "fetch", fake_fetch)
+    monkeypatch.setattr(question_pool, "low_water", 1)
+    monkeypatch.setattr(main_module, "verify_answer", lambda answer, answer_hash, salt: answer == "yes" and answer_hash == f"hash-{salt}")
+    asyncio.run(question_pool.fill("formal_logic"))
+    pooled = question_pool._pools["formal_logic"].questions[0]
+    hits = question_pool.to_dict()["modes"]["formal_logic"]["hits"]
+    
+    code = start_lobby(client)
+    keys = client.post(f"/api/combats/{code}/keys").json()
+    assert question_pool.size("formal_logic") == 0
+    assert question_pool.to_dict()["modes"]["formal_logic"]["hits"] == hits + 1
+    
+    client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p1"))
+    client.post(f"/api/combats/{code}/ready", headers=as_user("uid-p2"))
+    me = client.get("/agent/me", headers={"Authorization": f"Bearer {keys['keyA']}"}).json()
+    assert (me["prompt"], me["choices"]) == ("formal_logic question?", ["yes", "no"])
+    client.post("/agent/submit", headers={"Authorization": f"Bearer {keys['keyA']}"}, json={"answer": "no"})
+    client.post("/agent/submit", headers={"Authorization": f"Bearer {keys['keyB']}"}, json={"answer": "yes"})
+    
+    result = client.get(f"/api/combats/{code}/result").json()
+    assert result["winnerUsername"] == "PlayerTwo" and result["correctAnswer"] == "yes"
+    stored = db.query(CombatQuestion).one()
+    assert (stored.answer_key_hash, stored.answer_salt) == (pooled.answer_hash, pooled.salt)
+
+def test_question_bank_build_and_mapped_lookups(tmp_path):
+    """A built bank is de-duplicated and readable by position or dataset row"""
+    path = str(tmp_path / "formal_logic.qbank")
+    # row_offset = salt % 100, so random salts collide and must be de-duplicated
+    written = build_bank(path, fake_hf_question, "formal_logic", count=20, workers=4)
+    bank = QuestionBank(path)
+    try:
+        assert written == len(bank) == 20
+        offsets = set()
+        for index in range(len(bank)):
+            question, answer_hash, salt = bank.record_at(index)
+            assert answer_hash == f"hash-{salt}" and question.row_offset == salt % 100
+            assert bank.find("test/dataset", "default", "validation", question.row_offset) == (question, answer_hash, salt)
+            offsets.add(question.row_offset)
+        assert len(offsets) == 20
+        missing = next(n for n in range(100) if n not in offsets)
+        assert bank.find("test/dataset", "default", "validation", missing) is None
+        assert bank.find("other/dataset", "default", "validation", question.row_offset) is None
+        with pytest.raises(IndexError):
+            bank.record_at(20)
+    finally:
+        bank.close()
+    
+    (tmp_path / "broken.qbank").write_bytes(b"nope" + bytes(12))
+    with pytest.raises(ValueError):
+        QuestionBank(str(tmp_path / "broken.qbank"))
+
+def test_issue_keys_offline_from_question_bank(client, players, db, tmp_path, monkeypatch):
+    """With a bank on disk, key issuance needs no HF access (the test HF service is offline)"""
+    path = str(tmp_path / "formal_logic.qbank")
+    write_bank(path, [{
+        "dataset": "test/dataset", "config": "default", "split": "validation", "row_offset": 42,
+        "prompt": "Banked?", "choices": ["yes", "no"], "answer_hash": "hash-9", "salt": 9,
+    }])
+    bank = QuestionBank(path)
+    monkeypatch.setattr(main_module, "question_banks", {"formal_logic": bank})
+    monkeypatch.setattr(question_pool._pools["formal_logic"], "questions", deque())
+    try:
+        code = start_lobby(client)
+        assert client.post(f"/api/combats/{code}/keys").status_code == 200
+    finally:
+        bank.close()
+    
+    stored = db.query(CombatQuestion).one()
+    assert (stored.prompt, stored.row_offset, stored.answer_key_hash, stored.answer_salt) == ("Banked?", 42, "hash-9", 9)
+
+class FakeDatasetServer:
+    """Local stand-in for the HF datasets API with injectable latency"""
+    
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = 0
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.delay)
+                body = json.dumps({"rows": [{"row_idx": 7, "question": "Remote?", "choices": ["yes", "no"]}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/rows"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def create_combat_question(self, combat_id, mode):
+        """Same shape as hf_datasets.question_service.create_combat_question"""
+        with urllib.request.urlopen(self.url, timeout=5) as response:
+            row = json.load(response)["rows"][0]
+        question = SimpleNamespace(
+            dataset="fake/dataset", config="default", split="validation", row_offset=row["row_idx"],
+            prompt=row["question"], choices=row["choices"]
+        )
+        return question, f"hash-{combat_id}"
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def test_circuit_breaker_opens_on_slow_calls_and_probes_to_close():
+    """Timeouts open the breaker, open calls fail instantly, a good probe closes it"""
+    dataset = FakeDatasetServer(delay=0.4)
+    breaker = CircuitBreaker("fake", timeout_seconds=0.1, error_rate=0.5, min_calls=3, open_seconds=0.2)
+    
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(CircuitTimeoutError):
+                await breaker.call(dataset.create_combat_question, combat_id=1, mode="formal_logic")
+        assert breaker.state == "open"
+        started = time.monotonic()
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(dataset.create_combat_question, combat_id=1, mode="formal_logic")
+        assert time.monotonic() - started < 0.05
+        
+        # Still slow when the probe goes out: back to open
+        await asyncio.sleep(0.25)
+        with pytest.raises(CircuitTimeoutError):
+            await breaker.call(dataset.create_combat_question, combat_id=1, mode="formal_logic")
+        assert breaker.state == "open"
+        
+        dataset.delay = 0
+        await asyncio.sleep(0.25)
+        question, answer_hash = await breaker.call(dataset.create_combat_question, combat_id=5, mode="formal_logic")
+        assert (question.prompt, answer_hash) == ("Remote?", "hash-5")
+        assert breaker.state == "closed"
+        # Let the abandoned slow requests finish before the server goes away
+        await asyncio.sleep(0.4)
+    try:
+        asyncio.run(scenario())
+    finally:
+        dataset.close()
+    
+    metrics = breaker.to_dict()
+    assert (metrics["timeouts"], metrics["shortCircuited"], metrics["opens"], metrics["successes"]) == (4, 1, 2, 1)
+
+def test_issue_keys_falls_back_immediately_while_hf_breaker_is_open(client, players, sample_question, monkeypatch):
+    """Slow HF costs the timeout budget until the breaker opens, then nothing"""
+    dataset = FakeDatasetServer(delay=0.5)
+    monkeypatch.setattr(main_module, "question_service", dataset)
+    monkeypatch.setattr(main_module, "hf_breaker", CircuitBreaker("huggingface", timeout_seconds=0.1, min_calls=2, open_seconds=60))
+    monkeypatch.setattr(question_pool._pools["formal_logic"], "questions", deque())
+    try:
+        durations = []
+        for _ in range(3):
+            code = start_lobby(client)
+            started = time.monotonic()
+            assert client.post(f"/api/combats/{code}/keys").status_code == 200
+            durations.append(time.monotonic() - started)
+            assert client.get(f"/api/combats/{code}").json()["state"] == "KEYS_ISSUED"
+        metrics = client.get("/admin/metrics", headers={"Authorization": "Bearer admin-secret-token"}).json()
+        time.sleep(0.5)
+    finally:
+        dataset.close()
+    
+    # Two fetches hit the 0.1 s budget (not the 0.5 s latency), then the breaker is open
+    assert all(0.1 <= d < 0.5 for d in durations[:2])
+    assert durations[2] < 0.1
+    assert metrics["hfBreaker"]["state"] == "open" and metrics["hfBreaker"]["shortCircuited"] == 1
+
+def test_question_sampler_picks_with_one_primary_key_lookup(db):
+    """Ids are loaded once; each pick is one PK query; inserts and deletions are picked up"""
+    db.add_all([Question(prompt=f"Q{i}?", golden_label="yes") for i in range(30)])
+    db.commit()
+    sampler = QuestionSampler()
+    
+    async def scenario():
+        async with AsyncTestingSessionLocal() as session:
+            assert await sampler.pick(session) is not None
+            with count_queries() as queries:
+                picked = {await sampler.pick(session) for _ in range(20)}
+            assert queries["n"] == 20 and sampler.refreshes == 1
+            
+            # Rows deleted behind the sampler's back are never returned
+            await session.execute(Question.__table__.delete().where(Question.id > 1))
+            await session.commit()
+            assert {await sampler.pick(session) for _ in range(10)} == {1}
+            assert sampler.stale_picks >= 1
+            
+            # ORM inserts mark the ids stale
+            session.add(Question(prompt="New?", golden_label="no"))
+            await session.commit()
+            await sampler.pick(session)
+            assert len(sampler) == 2
+        return picked
+    try:
+        picked = asyncio.run(scenario())
+    finally:
+        sampler.close()
+    assert len(picked) > 1
+    assert not event.contains(Question, "after_insert", sampler._on_change)
+
+def test_seen_filter_fixed_size_and_generations():
+    """The blob stays SEEN_FILTER_BYTES; a full generation is rotated, keeping the latest"""
+    seen = SeenFilter()
+    assert len(seen.to_bytes()) == SEEN_FILTER_BYTES
+    seen.add("test/dataset/default/validation#1")
+    restored = SeenFilter(seen.to_bytes())
+    assert "test/dataset/default/validation#1" in restored
+    assert "test/dataset/default/validation#2" not in restored
+    
+    keys = [f"row#{i}" for i in range(seen.capacity * 3)]
+    for key in keys:
+        seen.add(key)
+    blob = seen.to_bytes()
+    assert len(blob) == SEEN_FILTER_BYTES
+    restored = SeenFilter(blob)
+    assert all(key in restored for key in keys[-seen.capacity:])
+    # Only two generations are kept, so the oldest entries are mostly gone
+    assert sum(key in restored for key in keys[:seen.capacity]) < seen.capacity // 10
+    assert restored.false_positive_rate() < 0.05
+    
+    # A blob of another size is dropped, not misread
+    assert "row#1" not in SeenFilter(blob[:100])
+
+def test_issue_keys_skips_questions_a_player_has_seen(client, players, db, monkeypatch):
+    """A pooled question player one has seen goes back to the pool; both players record the one served"""
+    monkeypatch.setattr(question_pool, "fetch", fake_fetch)
+    monkeypatch.setattr(question_pool, "low_water", 2)
+    monkeypatch.setattr(question_pool._pools["formal_logic"], "questions", deque())
+    asyncio.run(question_pool.fill("formal_logic"))
+    first, second = question_pool._pools["formal_logic"].questions
+    
+    seen = SeenFilter()
+    seen.add(question_key(first.question))
+    player_one = db.query(User).filter_by(firebase_uid="uid-p1").one()
+    player_one.seen_questions = seen.to_bytes()
+    db.commit()
+    skipped = seen_metrics.seen_candidates
+    
+    code = start_lobby(client)
+    assert client.post(f"/api/combats/{code}/keys").status_code == 200
+    assert db.query(CombatQuestion).one().answer_salt == second.salt
+    assert list(question_pool._pools["formal_logic"].questions) == [first]
+    assert seen_metrics.seen_candidates == skipped + 1
+    
+    db.expire_all()
+    for user in db.query(User).all():
+        assert question_key(second.question) in SeenFilter(user.seen_questions)
+
+def test_issue_keys_releases_the_claim_when_anything_fails(client, players, sample_question, db, monkeypatch):
+    """A failure after ACCEPTED -> KEYS_ISSUED hands the combat back instead of stranding it"""
+    async def broken(*args, **kwargs):
+        raise RuntimeError("injected")
+    code = start_lobby(client)
+    for target, name in ((main_module.ParticipantsSeen, "load"), (combat_bus, "emit")):
+        with monkeypatch.context() as patch:
+            patch.setattr(target, name, broken)
+            with pytest.raises(RuntimeError):
+                client.post(f"/api/combats/{code}/keys")
+        db.expire_all()
+        combat = db.query(Combat).filter(Combat.code == code).one()
+        assert combat.state == CombatState.ACCEPTED and combat.expires_at is None
+        assert db.query(ApiKey).filter(ApiKey.combat_id == combat.id).count() == 0
+    
+    assert client.post(f"/api/combats/{code}/keys").status_code == 200
+    db.expire_all()
+    assert db.query(ApiKey).filter(ApiKey.combat_id == combat.id).count() == 2
+
+def test_issue_keys_fetches_inline_at_most_once(client, players, db, monkeypatch):
+    """With the pool empty and no local bank, a seen fetched question is served rather than fetching again"""
+    question, answer_hash = fake_hf_question(7, "formal_logic")
+    calls = []
+    async def fetch(mode):
+        calls.append(mode)
+        return question, answer_hash, 7
+    monkeypatch.setattr(main_module, "fetch_question", fetch)
+    monkeypatch.setattr(question_pool._pools["formal_logic"], "questions", deque())
+    monkeypatch.setattr(question_pool, "low_water", 0)
+    seen = SeenFilter()
+    seen.add(question_key(question))
+    player_one = db.query(User).filter_by(firebase_uid="uid-p1").one()
+    player_one.seen_questions = seen.to_bytes()
+    db.commit()
+    repeats = seen_metrics.repeats_served
+    
+    code = start_lobby(client)
+    assert client.post(f"/api/combats/{code}/keys").status_code == 200
+    assert calls == ["formal_logic"]
+    assert db.query(CombatQuestion).one().answer_salt == 7
+    assert seen_metrics.repeats_served == repeats + 1
+
+def test_issue_keys_pops_a_seen_pooled_question_once(client, players, db, monkeypatch):
+    """A lone pooled question the players have seen is tried once, then the inline fetch serves"""
+    monkeypatch.setattr(question_pool, "fetch", fake_fetch)
+    monkeypatch.setattr(question_pool, "low_water", 1)
+    monkeypatch.setattr(question_pool._pools["formal_logic"], "questions", deque())
+    asyncio.run(question_pool.fill("formal_logic"))
+    monkeypatch.setattr(question_pool, "low_water", 0)
+    (pooled,) = question_pool._pools["formal_logic"].questions
+    calls = []
+    async def fetch(mode):
+        calls.append(mode)
+        return await fake_fetch(mode)
+    monkeypatch.setattr(main_module, "fetch_question", fetch)
+    seen = SeenFilter()
+    seen.add(question_key(pooled.question))
+    player_one = db.query(User).filter_by(firebase_uid="uid-p1").one()
+    player_one.seen_questions = seen.to_bytes()
+    db.commit()
+    
+    code = start_lobby(client)
+    assert client.post(f"/api/combats/{code}/keys").status_code == 200
+    assert calls == ["formal_logic"]
+    assert db.query(CombatQuestion).one().answer_salt != pooled.salt
+    assert list(question_pool._pools["formal_logic"].questions) == [pooled]
+
+def test_legacy_fallback_serves_a_repeat_when_nothing_else_is_left(client, players, sample_question, monkeypatch):
+    """With a single legacy question, the second combat still gets it, counted as a repeat"""
+    async def unavailable(mode):
+        raise RuntimeError("HF unavailable")
+    monkeypatch.setattr(main_module, "fetch_question", unavailable)
+    monkeypatch.setattr(question_pool._pools["formal_logic"], "questions", deque())
+    monkeypatch.setattr(question_pool, "low_water", 0)
+    repeats = seen_metrics.repeats_served
+    for _ in range(2):
+        code = start_lobby(client)
+        assert client.post(f"/api/combats/{code}/keys").status_code == 200
+    assert seen_metrics.repeats_served == repeats + 1
+    metrics = client.get("/admin/metrics", headers={"Authorization": "Bearer admin-secret-token"}).json()
+    assert metrics["seenFilter"]["filterBytes"] == SEEN_FILTER_BYTES
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
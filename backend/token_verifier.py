@@ -0,0 +1,245 @@
+"""
+Offline verification of Firebase ID tokens.
+
+Google's signing keys are fetched as a JWKS document and kept until the
+response's Cache-Control max-age runs out; a background task refreshes them
+ahead of that, so requests never wait on the network in steady state.
+Decoded claims are cached by token hash until the token's `exp`, so repeat
+requests from the same browser session skip the RS256 check entirely.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+import jwt
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+FIREBASE_JWKS_URL = os.getenv(
+    "FIREBASE_JWKS_URL",
+    "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+)
+# Used when the key endpoint sends no usable Cache-Control header
+JWKS_DEFAULT_MAX_AGE_SECONDS = int(os.getenv("JWKS_DEFAULT_MAX_AGE_SECONDS", "3600"))
+# Refresh this long before the cached keys expire
+JWKS_REFRESH_MARGIN_SECONDS = int(os.getenv("JWKS_REFRESH_MARGIN_SECONDS", "300"))
+# Unknown `kid`s force a refetch at most this often
+JWKS_MIN_REFETCH_SECONDS = float(os.getenv("JWKS_MIN_REFETCH_SECONDS", "30"))
+FIREBASE_CLAIMS_CACHE_SIZE = int(os.getenv("FIREBASE_CLAIMS_CACHE_SIZE", "10000"))
+# Tolerated clock skew when checking exp / iat
+TOKEN_CLOCK_SKEW_SECONDS = int(os.getenv("TOKEN_CLOCK_SKEW_SECONDS", "30"))
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def parse_max_age(cache_control: Optional[str]) -> Optional[int]:
+    """Extract max-age (seconds) from a Cache-Control header"""
+    if not cache_control:
+        return None
+    match = _MAX_AGE.search(cache_control)
+    return int(match.group(1)) if match else None
+
+
+def fetch_google_jwks(url: str = FIREBASE_JWKS_URL) -> Tuple[dict, Optional[int]]:
+    """Download the JWKS document; returns (jwks, max_age_seconds)"""
+    response = httpx.get(url, timeout=10.0)
+    response.raise_for_status()
+    return response.json(), parse_max_age(response.headers.get("cache-control"))
+
+
+class InvalidTokenError(Exception):
+    """Raised when an ID token fails verification"""
+
+
+class ExpiredTokenError(InvalidTokenError):
+    """Raised when an ID token is past its exp"""
+
+
+class JWKSCache:
+    """Signing keys by `kid`, valid until the Cache-Control max-age expires"""
+
+    def __init__(
+        self,
+        fetch: Callable[[], Tuple[dict, Optional[int]]] = fetch_google_jwks,
+        default_max_age: int = JWKS_DEFAULT_MAX_AGE_SECONDS,
+        refresh_margin: int = JWKS_REFRESH_MARGIN_SECONDS,
+        min_refetch_seconds: float = JWKS_MIN_REFETCH_SECONDS
+    ):
+        self.fetch = fetch
+        self.default_max_age = default_max_age
+        self.refresh_margin = refresh_margin
+        self.min_refetch_seconds = min_refetch_seconds
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._expires_at = 0.0
+        self._last_fetch = 0.0
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Metrics
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def _refresh_locked(self):
+        self._last_fetch = time.monotonic()
+        try:
+            jwks, max_age = self.fetch()
+            keys = {}
+            for jwk in jwks.get("keys", []):
+                if jwk.get("kid"):
+                    keys[jwk["kid"]] = jwt.PyJWK(jwk, algorithm="RS256")
+        except Exception:
+            self.refresh_errors += 1
+            raise
+        self._keys = keys
+        self._expires_at = time.monotonic() + (max_age if max_age is not None else self.default_max_age)
+        self.refreshes += 1
+
+    def refresh(self):
+        """Fetch the key set and replace the cached keys"""
+        with self._lock:
+            self._refresh_locked()
+
+    def get_key(self, kid: str) -> Optional[jwt.PyJWK]:
+        """Key for `kid`; refetches synchronously only when cold, stale or unknown"""
+        key = self._keys.get(kid)
+        if key is not None and time.monotonic() < self._expires_at:
+            return key
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            key = self._keys.get(kid)
+            now = time.monotonic()
+            if now < self._expires_at:
+                if key is not None or now - self._last_fetch < self.min_refetch_seconds:
+                    return key
+            try:
+                self._refresh_locked()
+            except Exception:
+                # Keep serving the previous key set while the endpoint is unreachable
+                if key is not None:
+                    return key
+                raise
+            return self._keys.get(kid)
+
+    def seconds_until_refresh(self) -> float:
+        return self._expires_at - self.refresh_margin - time.monotonic()
+
+    async def _run(self):
+        while True:
+            delay = max(self.seconds_until_refresh(), 1.0)
+            await asyncio.sleep(delay)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("JWKS refresh failed: %s", e)
+                await asyncio.sleep(min(self.min_refetch_seconds, 60))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def to_dict(self) -> dict:
+        return {
+            "keys": len(self._keys),
+            "expiresInSeconds": round(max(self._expires_at - time.monotonic(), 0.0), 1),
+            "refreshes": self.refreshes,
+            "refreshErrors": self.refresh_errors,
+            "backgroundRefresh": self._task is not None,
+        }
+
+
+class FirebaseTokenVerifier:
+    """Verifies Firebase ID tokens against cached keys, memoizing decoded claims"""
+
+    def __init__(
+        self,
+        project_id: str,
+        jwks: Optional[JWKSCache] = None,
+        claims_cache_size: int = FIREBASE_CLAIMS_CACHE_SIZE,
+        clock_skew: int = TOKEN_CLOCK_SKEW_SECONDS
+    ):
+        self.project_id = project_id
+        self.issuer = f"https://securetoken.google.com/{project_id}"
+        self.jwks = jwks or JWKSCache()
+        self.clock_skew = clock_skew
+        self.claims_cache = TTLCache(maxsize=claims_cache_size, ttl_seconds=0)
+        self.signature_checks = 0
+
+    def _decode(self, id_token: str) -> dict:
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except jwt.InvalidTokenError as e:
+            raise InvalidTokenError(str(e))
+        if header.get("alg") != "RS256":
+            raise InvalidTokenError("Unexpected token algorithm")
+        key = self.jwks.get_key(header.get("kid", ""))
+        if key is None:
+            raise InvalidTokenError("Unknown signing key")
+
+        self.signature_checks += 1
+        try:
+            claims = jwt.decode(
+                id_token,
+                key=key,
+                algorithms=["RS256"],
+                audience=self.project_id,
+                issuer=self.issuer,
+                leeway=self.clock_skew,
+                options={"require": ["exp", "iat", "aud", "iss", "sub"]}
+            )
+        except jwt.ExpiredSignatureError:
+            raise ExpiredTokenError("Token has expired")
+        except jwt.InvalidTokenError as e:
+            raise InvalidTokenError(str(e))
+
+        if not claims["sub"] or len(claims["sub"]) > 128:
+            raise InvalidTokenError("Invalid subject")
+        if claims.get("auth_time", 0) > time.time() + self.clock_skew:
+            raise InvalidTokenError("Token auth_time is in the future")
+        # Same shape as firebase_admin.auth.verify_id_token
+        claims["uid"] = claims["sub"]
+        return claims
+
+    def cached_claims(self, id_token: str) -> Optional[dict]:
+        """Claims of a token verified earlier and not yet expired; no crypto"""
+        return self.claims_cache.get(hashlib.sha256(id_token.encode()).hexdigest())
+
+    def verify(self, id_token: str) -> dict:
+        """Decoded claims for a valid token; raises InvalidTokenError otherwise"""
+        token_hash = hashlib.sha256(id_token.encode()).hexdigest()
+        claims = self.claims_cache.get(token_hash)
+        if claims is not None:
+            return claims
+
+        claims = self._decode(id_token)
+        ttl = claims["exp"] - time.time()
+        if ttl > 0:
+            self.claims_cache.set(token_hash, claims, ttl_seconds=ttl)
+        return claims
+
+    def to_dict(self) -> dict:
+        return {
+            "projectId": self.project_id,
+            "signatureChecks": self.signature_checks,
+            "claimsCache": self.claims_cache.to_dict(),
+            "jwks": self.jwks.to_dict(),
+        }
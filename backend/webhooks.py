@@ -0,0 +1,332 @@
+"""
+Outbound webhooks: POST JSON payloads to agents' callback URLs.
+
+Agents behind serverless endpoints register a callback URL for their API
+key (PUT /agent/webhook) and get the question POSTed to it the moment
+their combat starts, instead of polling /agent/me. Deliveries are handed
+to a pool of worker tasks, so the request that triggered them never waits
+on a third-party server:
+
+- per-target concurrency: at most WEBHOOK_TARGET_CONCURRENCY requests are
+  in flight to one host; further deliveries to it wait on that target
+  without tying up a worker, so one slow receiver can't stall the others.
+- retries: connection errors, timeouts, 408/425/429 and 5xx responses are
+  retried with exponential backoff and jitter, up to WEBHOOK_MAX_ATTEMPTS
+  attempts; any other response is final.
+- metrics: queue depth, outcomes and delivery latency (first enqueue to a
+  2xx response) for /admin/metrics.
+- address checks: the callback host must resolve only to public addresses,
+  checked when the URL is registered and again before every attempt, and
+  the request goes to the address that was checked - so a URL can't point
+  the server at its own network, not even by re-resolving (DNS
+  rebinding). Redirects are not followed. WEBHOOK_ALLOW_PRIVATE=1 lifts
+  the check for local development.
+
+Each body is signed with HMAC-SHA256 (X-Webhook-Signature: sha256=<hex>)
+keyed by the SHA-256 hex digest of the agent's API key - the only form of
+the key the server keeps, and one the agent can compute itself.
+
+Pending deliveries live in memory; after a restart agents fall back to
+/agent/me.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_TARGET_CONCURRENCY = int(os.getenv("WEBHOOK_TARGET_CONCURRENCY", "2"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+# First retry delay; doubles per attempt up to WEBHOOK_BACKOFF_MAX_SECONDS
+WEBHOOK_BACKOFF_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_SECONDS", "0.5"))
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "30"))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "5"))
+# Deliveries accepted but not finished (queued, in flight or backing off)
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "10000"))
+# Allow callbacks to loopback and private addresses (local development only)
+WEBHOOK_ALLOW_PRIVATE = bool(int(os.getenv("WEBHOOK_ALLOW_PRIVATE", "0")))
+
+_RETRY_STATUSES = {408, 425, 429}
+_LATENCY_SAMPLES = 1000
+
+
+class CallbackTargetError(ValueError):
+    """The callback host resolves to an address webhooks must not reach"""
+
+
+def is_valid_callback_url(url: str) -> bool:
+    parts = urlsplit(url)
+    try:
+        parts.port
+    except ValueError:
+        return False
+    return parts.scheme in ("http", "https") and bool(parts.hostname)
+
+
+def is_public_address(address: str) -> bool:
+    # is_global rules out loopback, private, link-local, shared, reserved and unspecified ranges
+    ip = ipaddress.ip_address(address)
+    return ip.is_global and not ip.is_multicast
+
+
+async def _resolve(host: str, port: int) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+async def resolve_callback_target(url: str, allow_private: bool = WEBHOOK_ALLOW_PRIVATE) -> str:
+    """
+    The address to connect to for `url`. Raises CallbackTargetError if the
+    host resolves to any non-public address, OSError if it doesn't resolve.
+    """
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    addresses = await _resolve(parts.hostname, port)
+    if not allow_private:
+        for address in addresses:
+            if not is_public_address(address):
+                raise CallbackTargetError(f"{parts.hostname} resolves to non-public address {address}")
+    return addresses[0]
+
+
+def sign_payload(body: bytes, secret: str) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+@dataclass
+class WebhookDelivery:
+    url: str
+    body: bytes
+    headers: Dict[str, str]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+    created: float = field(default_factory=time.monotonic)
+
+    @property
+    def target(self) -> str:
+        return urlsplit(self.url).netloc.lower()
+
+
+class _Target:
+    """Requests in flight to one host and the deliveries waiting for a slot"""
+
+    def __init__(self):
+        self.active = 0
+        self.waiting: deque = deque()
+
+
+class WebhookDispatcher:
+    """Per-worker delivery queue served by a fixed pool of tasks"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        workers: int = WEBHOOK_WORKERS,
+        target_concurrency: int = WEBHOOK_TARGET_CONCURRENCY,
+        max_attempts: int = WEBHOOK_MAX_ATTEMPTS,
+        backoff_seconds: float = WEBHOOK_BACKOFF_SECONDS,
+        backoff_max_seconds: float = WEBHOOK_BACKOFF_MAX_SECONDS,
+        timeout_seconds: float = WEBHOOK_TIMEOUT_SECONDS,
+        max_pending: int = WEBHOOK_MAX_PENDING,
+        allow_private: bool = WEBHOOK_ALLOW_PRIVATE
+    ):
+        # For background jobs that load what to send
+        self.session_factory = session_factory
+        self.workers = workers
+        self.target_concurrency = target_concurrency
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.timeout_seconds = timeout_seconds
+        self.max_pending = max_pending
+        self.allow_private = allow_private
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._workers: List[asyncio.Task] = []
+        self._targets: Dict[str, _Target] = {}
+        self._retry_timers: Set[asyncio.TimerHandle] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._latencies: deque = deque(maxlen=_LATENCY_SAMPLES)
+        self.pending = 0
+        self.in_flight = 0
+        # Metrics
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.dropped = 0
+        self.attempts = 0
+
+    def _ensure_started(self):
+        # Also started lazily, on whatever loop first enqueues (tests, scripts)
+        loop = asyncio.get_running_loop()
+        if self._queue is not None and self._loop is loop:
+            return
+        # Anything left from a previous loop is unreachable now
+        self._targets = {}
+        self._retry_timers = set()
+        self._tasks = set()
+        self.pending = 0
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._client = httpx.AsyncClient(timeout=self.timeout_seconds)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def start(self):
+        self._ensure_started()
+
+    async def stop(self):
+        for task in self._workers + list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._tasks, return_exceptions=True)
+        for timer in self._retry_timers:
+            timer.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+        self._loop = None
+        self._queue = None
+        self._client = None
+        self._workers = []
+        self._targets.clear()
+        self._retry_timers.clear()
+        self._tasks.clear()
+        self.pending = 0
+
+    def run_in_background(self, coro: Awaitable):
+        """Run `coro` (e.g. loading who to notify) without awaiting it"""
+        self._ensure_started()
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def enqueue(self, url: str, payload: dict, event: str, secret: Optional[str] = None) -> bool:
+        """Queue a POST of `payload`; False if the backlog is full and it was dropped"""
+        if self.pending >= self.max_pending:
+            self.dropped += 1
+            logger.warning("Webhook backlog full, dropping %s for %s", event, urlsplit(url).netloc)
+            return False
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        delivery = WebhookDelivery(url, body, {"Content-Type": "application/json", "X-Webhook-Event": event})
+        delivery.headers["X-Webhook-Delivery"] = delivery.id
+        if secret:
+            delivery.headers["X-Webhook-Signature"] = sign_payload(body, secret)
+        self._ensure_started()
+        self.pending += 1
+        self.enqueued += 1
+        self._queue.put_nowait(delivery)
+        return True
+
+    def backoff(self, attempts: int) -> float:
+        """Delay before the next attempt after `attempts` failed ones"""
+        delay = min(self.backoff_max_seconds, self.backoff_seconds * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _work(self):
+        while True:
+            delivery = await self._queue.get()
+            key = delivery.target
+            target = self._targets.setdefault(key, _Target())
+            if target.active >= self.target_concurrency:
+                # Park it with its target instead of holding up this worker
+                target.waiting.append(delivery)
+                continue
+            target.active += 1
+            try:
+                while delivery is not None:
+                    await self._attempt(delivery)
+                    delivery = target.waiting.popleft() if target.waiting else None
+            finally:
+                target.active -= 1
+                if not target.active and not target.waiting:
+                    self._targets.pop(key, None)
+
+    async def _attempt(self, delivery: WebhookDelivery):
+        delivery.attempts += 1
+        self.attempts += 1
+        self.in_flight += 1
+        try:
+            # Re-check on every attempt (DNS can change after registration) and
+            # connect to the checked address rather than resolving again
+            address = await resolve_callback_target(delivery.url, self.allow_private)
+            url = httpx.URL(delivery.url)
+            response = await self._client.post(
+                url.copy_with(host=address),
+                content=delivery.body,
+                headers={**delivery.headers, "Host": url.netloc.decode("ascii")},
+                extensions={"sni_hostname": url.host}
+            )
+            error = None if response.is_success else f"HTTP {response.status_code}"
+            retryable = response.status_code >= 500 or response.status_code in _RETRY_STATUSES
+        except (httpx.TransportError, OSError) as e:
+            error, retryable = f"{type(e).__name__}: {e}", True
+        except Exception as e:
+            error, retryable = f"{type(e).__name__}: {e}", False
+        finally:
+            self.in_flight -= 1
+
+        if error is None:
+            self.delivered += 1
+            self._latencies.append(time.monotonic() - delivery.created)
+            self.pending -= 1
+        elif retryable and delivery.attempts < self.max_attempts:
+            self.retries += 1
+            self._retry_later(delivery)
+        else:
+            self.failed += 1
+            self.pending -= 1
+            logger.warning(
+                "Webhook %s to %s failed after %d attempts: %s",
+                delivery.id, delivery.target, delivery.attempts, error
+            )
+
+    def _retry_later(self, delivery: WebhookDelivery):
+        # Sleep on a timer, not in a worker, so backing-off deliveries cost nothing
+        queue = self._queue
+
+        def requeue():
+            self._retry_timers.discard(timer)
+            queue.put_nowait(delivery)
+
+        timer = asyncio.get_running_loop().call_later(self.backoff(delivery.attempts), requeue)
+        self._retry_timers.add(timer)
+
+    def to_dict(self) -> dict:
+        latencies = list(self._latencies)
+        queued = (self._queue.qsize() if self._queue else 0) + sum(len(t.waiting) for t in self._targets.values())
+        return {
+            "workers": len(self._workers),
+            "pending": self.pending,
+            "queued": queued,
+            "inFlight": self.in_flight,
+            "backingOff": len(self._retry_timers),
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "attempts": self.attempts,
+            "latencyMs": {
+                "p50": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+                "p95": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+                "max": round(max(latencies) * 1000, 1) if latencies else None,
+            },
+        }
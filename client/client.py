@@ -6,7 +6,9 @@ A simple CLI client for participating in combat challenges.
 
 import os
 import sys
+import json
 import time
+import asyncio
 import requests
 from datetime import datetime
 from dotenv import load_dotenv
@@ -15,6 +17,10 @@ load_dotenv()
 
 API_KEY = os.getenv("AGENT_KEY")
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+# Seconds the server may hold each polling request open (long polling)
+LONG_POLL_SECONDS = 30
+# "ws" (pushed over /agent/ws) or "poll" (HTTP long polling)
+AGENT_TRANSPORT = os.getenv("AGENT_TRANSPORT", "ws")
 
 class Colors:
     RED = '\033[91m'
@@ -57,12 +63,14 @@ class AgentClient:
             "Content-Type": "application/json"
         }
     
-    def get_assignment(self):
-        """Fetch current combat assignment"""
+    def get_assignment(self, wait=0):
+        """Fetch current combat assignment (waiting up to `wait` s for the start)"""
         try:
             response = requests.get(
                 f"{self.base_url}/agent/me",
-                headers=self.headers
+                headers=self.headers,
+                params={"wait": wait},
+                timeout=wait + 10
             )
             response.raise_for_status()
             return response.json()
@@ -90,12 +98,14 @@ class AgentClient:
                     pass
             return None
     
-    def get_result(self):
-        """Get combat result"""
+    def get_result(self, wait=0):
+        """Get combat result (waiting up to `wait` s for the combat to finish)"""
         try:
             response = requests.get(
                 f"{self.base_url}/agent/result",
-                headers=self.headers
+                headers=self.headers,
+                params={"wait": wait},
+                timeout=wait + 10
             )
             response.raise_for_status()
             return response.json()
@@ -103,13 +113,71 @@ class AgentClient:
             print_error(f"Failed to fetch result: {e}")
             return None
 
+class AsyncAgentClient:
+    """Same calls as AgentClient, but async and pushed over the /agent/ws WebSocket"""
+    
+    def __init__(self, api_key, base_url):
+        self.api_key = api_key
+        self.ws_url = base_url.replace("http", "ws", 1).rstrip("/") + "/agent/ws"
+        self.socket = None
+        self.assignment = None
+        self.result = None
+    
+    async def connect(self):
+        """Open the socket (authenticated with the API key)"""
+        import websockets
+        self.socket = await websockets.connect(
+            self.ws_url,
+            extra_headers={"Authorization": f"Bearer {self.api_key}"}
+        )
+    
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.close()
+    
+    async def _next(self):
+        message = json.loads(await self.socket.recv())
+        if message["type"] == "question":
+            self.assignment = message
+        elif message["type"] == "result":
+            self.result = message
+        elif message["type"] == "state":
+            print(f"{Colors.CYAN}Status: {message['state']}{Colors.END}", end='\r')
+        return message
+    
+    async def get_assignment(self):
+        """Wait for the question to be pushed; returns the result instead if the combat ended first"""
+        while self.assignment is None and self.result is None:
+            await self._next()
+        return self.assignment or self.result
+    
+    async def submit_answer(self, answer):
+        """Submit answer over the socket"""
+        await self.socket.send(json.dumps({"type": "submit", "answer": answer}))
+        while True:
+            message = await self._next()
+            if message["type"] == "submitted":
+                return message
+            if message["type"] == "error":
+                print_error(f"Failed to submit answer: {message['detail']}")
+                return None
+            if message["type"] == "result":
+                print_error("Combat ended before the answer was accepted")
+                return None
+    
+    async def get_result(self):
+        """Wait for the result to be pushed"""
+        while self.result is None:
+            await self._next()
+        return self.result
+
 def wait_for_combat(client):
-    """Poll for combat to start"""
+    """Long-poll for combat to start (the server answers as soon as it does)"""
     print_header("AGENT FIGHT CLUB - CLIENT")
     print_info("Waiting for combat to start...")
     
     while True:
-        assignment = client.get_assignment()
+        assignment = client.get_assignment(wait=LONG_POLL_SECONDS)
         if not assignment:
             time.sleep(2)
             continue
@@ -123,7 +191,6 @@ def wait_for_combat(client):
             return None
         
         print(f"{Colors.CYAN}Status: {state}{Colors.END}", end='\r')
-        time.sleep(2)
 
 def display_question(assignment):
     """Display the question"""
@@ -186,10 +253,10 @@ def submit_and_wait(client, answer):
     print_info("Waiting for opponent and final results...")
     
     while True:
-        time.sleep(2)
-        result_data = client.get_result()
+        result_data = client.get_result(wait=LONG_POLL_SECONDS)
         
         if not result_data:
+            time.sleep(2)
             continue
         
         state = result_data.get("state")
@@ -237,6 +304,32 @@ def display_results(result_data):
     else:
         print_warning("⏱️ BOTH TIMED OUT - No winner")
 
+async def run_pushed(client):
+    """wait_for_combat / submit_and_wait over the WebSocket: no polling delay"""
+    print_header("AGENT FIGHT CLUB - CLIENT")
+    print_info("Waiting for combat to start...")
+    await client.connect()
+    try:
+        assignment = await client.get_assignment()
+        if assignment.get("type") != "question":
+            print_warning(f"Combat already {assignment.get('state', '').lower()}")
+            return None
+        
+        display_question(assignment)
+        # input() blocks; keep the socket's event loop running meanwhile
+        answer = await asyncio.to_thread(get_user_answer)
+        if not answer:
+            return None
+        
+        print_info("Submitting answer...")
+        if not await client.submit_answer(answer):
+            return None
+        print_success("Answer submitted successfully!")
+        print_info("Waiting for opponent and final results...")
+        return await client.get_result()
+    finally:
+        await client.close()
+
 def main():
     """Main client loop"""
     if not API_KEY:
@@ -245,6 +338,18 @@ def main():
         print_info("Or create a .env file with: AGENT_KEY=your-api-key")
         sys.exit(1)
     
+    if AGENT_TRANSPORT == "ws":
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            print_warning("websockets not installed, falling back to polling")
+        else:
+            result_data = asyncio.run(run_pushed(AsyncAgentClient(API_KEY, API_BASE_URL)))
+            if not result_data:
+                sys.exit(1)
+            display_results(result_data)
+            return
+    
     client = AgentClient(API_KEY, API_BASE_URL)
     
     assignment = wait_for_combat(client)
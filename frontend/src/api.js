@@ -58,6 +58,39 @@ export const getCombatStatus = async (code) => {
   return response.data;
 };
 
+// Live combat status over Server-Sent Events: `onStatus` gets the full status
+// on connect and after every change. Falls back to polling every 2 s if the
+// browser has no EventSource. Returns a function that closes the stream.
+export const subscribeCombatStatus = (code, onStatus, onError) => {
+  if (typeof EventSource === 'undefined') {
+    const poll = () => getCombatStatus(code).then(onStatus).catch(onError);
+    poll();
+    const interval = setInterval(poll, 2000);
+    return () => clearInterval(interval);
+  }
+
+  let status = null;
+  const source = new EventSource(`${API_BASE_URL}/api/combats/${code}/events`);
+  const apply = (event, isSnapshot) => {
+    const data = JSON.parse(event.data);
+    status = isSnapshot || !status ? data : { ...status, ...data };
+    onStatus(status);
+    if (status.state === 'COMPLETED' || status.state === 'EXPIRED') {
+      source.close();
+    }
+  };
+  source.addEventListener('snapshot', (event) => apply(event, true));
+  ['sync', 'accepted', 'keys_issued', 'ready', 'started', 'submission', 'completed', 'expired'].forEach((type) => {
+    source.addEventListener(type, (event) => apply(event, false));
+  });
+  source.onerror = () => {
+    // EventSource reconnects by itself (resuming via Last-Event-ID);
+    // only report streams that could not be opened at all
+    if (!status && onError) onError(new Error('Failed to connect to combat status stream'));
+  };
+  return () => source.close();
+};
+
 export const issueKeys = async (code) => {
   const response = await api.post(`/api/combats/${code}/keys`);
   return response.data;
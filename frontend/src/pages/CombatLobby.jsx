@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react'
 import { useParams, useNavigate } from 'react-router-dom'
-import { getCombatStatus, issueKeys, getMyApiKey, markReady } from '../api'
+import { subscribeCombatStatus, issueKeys, getMyApiKey, markReady } from '../api'
 import { useAuth } from '../AuthContext'
 import { Swords, Users, Link, Key, Copy, AlertTriangle, CheckCircle, Clock, Loader } from 'lucide-react'
 
@@ -19,36 +19,31 @@ function CombatLobby() {
   const [markingReady, setMarkingReady] = useState(false)
   const [amReady, setAmReady] = useState(false)
 
-  const fetchStatus = async () => {
-    try {
-      const data = await getCombatStatus(code)
-      setCombat(data)
-      
-      // Update my ready status based on combat data
-      if (user && data) {
-        if (user.username === data.userAUsername) {
-          setAmReady(data.userAReady)
-        } else if (user.username === data.userBUsername) {
-          setAmReady(data.userBReady)
-        }
-      }
-      
-      // Redirect to dashboard once combat is running
-      if (data.state === 'RUNNING' || data.state === 'COMPLETED' || data.state === 'EXPIRED') {
-        navigate(`/dashboard/${code}`)
+  const handleStatus = (data) => {
+    setCombat(data)
+    setLoading(false)
+    
+    // Update my ready status based on combat data
+    if (user && data) {
+      if (user.username === data.userAUsername) {
+        setAmReady(data.userAReady)
+      } else if (user.username === data.userBUsername) {
+        setAmReady(data.userBReady)
       }
-    } catch (err) {
-      setError(err.response?.data?.detail || 'Failed to fetch combat status')
-    } finally {
-      setLoading(false)
+    }
+    
+    // Redirect to dashboard once combat is running
+    if (data.state === 'RUNNING' || data.state === 'COMPLETED' || data.state === 'EXPIRED') {
+      navigate(`/dashboard/${code}`)
     }
   }
 
   useEffect(() => {
-    fetchStatus()
-    // Poll for updates
-    const interval = setInterval(fetchStatus, 2000)
-    return () => clearInterval(interval)
+    // Pushed updates instead of polling
+    return subscribeCombatStatus(code, handleStatus, (err) => {
+      setError(err.response?.data?.detail || 'Failed to fetch combat status')
+      setLoading(false)
+    })
   }, [code, user])
 
   const handleGenerateKeys = async () => {
@@ -106,7 +101,7 @@ function CombatLobby() {
     try {
       const result = await markReady(code)
       setAmReady(true)
-      // If both are ready, we'll get redirected by the polling
+      // If both are ready, we'll get redirected by the status stream
     } catch (err) {
       setError(err.response?.data?.detail || 'Failed to mark as ready')
     } finally {
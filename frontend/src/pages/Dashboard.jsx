@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react'
 import { useParams, useNavigate } from 'react-router-dom'
-import { getCombatStatus, getCombatResult } from '../api'
+import { subscribeCombatStatus, getCombatResult } from '../api'
 import { Gamepad2, Clock, Target, BarChart3, CheckCircle, XCircle, Trophy, Handshake, Home, Zap, AlertTriangle } from 'lucide-react'
 
 function Dashboard() {
@@ -12,40 +12,47 @@ function Dashboard() {
   const [error, setError] = useState('')
   const [redirecting, setRedirecting] = useState(false)
 
-  const fetchStatus = async () => {
-    try {
-      const data = await getCombatStatus(code)
-      setCombat(data)
-      
-      // Fetch combat result when completed or expired
-      if ((data.state === 'COMPLETED' || data.state === 'EXPIRED') && !combatResult) {
-        try {
-          const result = await getCombatResult(code)
-          setCombatResult(result)
-        } catch (err) {
-          console.error('Failed to fetch combat result:', err)
-        }
+  const handleStatus = async (data) => {
+    setCombat(data)
+    setLoading(false)
+    
+    // Fetch combat result when completed or expired
+    if ((data.state === 'COMPLETED' || data.state === 'EXPIRED') && !combatResult) {
+      try {
+        const result = await getCombatResult(code)
+        setCombatResult(result)
+      } catch (err) {
+        console.error('Failed to fetch combat result:', err)
       }
-      
-      if (data.state === 'EXPIRED' && !redirecting) {
-        setRedirecting(true)
-        setTimeout(() => {
-          navigate('/')
-        }, 10000) // Give more time to see the result
-      }
-    } catch (err) {
-      setError(err.response?.data?.detail || 'Failed to fetch combat status')
-    } finally {
-      setLoading(false)
+    }
+    
+    if (data.state === 'EXPIRED' && !redirecting) {
+      setRedirecting(true)
+      setTimeout(() => {
+        navigate('/')
+      }, 10000) // Give more time to see the result
     }
   }
 
   useEffect(() => {
-    fetchStatus()
-    const interval = setInterval(fetchStatus, 2000)
-    return () => clearInterval(interval)
+    // Pushed updates instead of polling
+    return subscribeCombatStatus(code, handleStatus, (err) => {
+      setError(err.response?.data?.detail || 'Failed to fetch combat status')
+      setLoading(false)
+    })
   }, [code])
 
+  useEffect(() => {
+    // The stream only carries the countdown with changes; tick it down locally
+    if (combat?.state !== 'RUNNING') return
+    const interval = setInterval(() => {
+      setCombat((current) => current && current.countdownSeconds
+        ? { ...current, countdownSeconds: current.countdownSeconds - 1 }
+        : current)
+    }, 1000)
+    return () => clearInterval(interval)
+  }, [combat?.state])
+
   if (loading) {
     return <div className="container"><div className="loading">Loading dashboard</div></div>
   }